@@ -0,0 +1,5 @@
+#!/bin/sh
+
+# runs once on initialization of the db service (mounted into /docker-entrypoint-initdb.d/):
+# allows streaming replication connections of the db_replica service
+echo "host replication all all trust" >> "$PGDATA/pg_hba.conf"
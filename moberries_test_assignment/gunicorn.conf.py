@@ -0,0 +1,33 @@
+"""
+gunicorn configuration of the production profile. Every value could be overridden with environment variables.
+
+Workers are processes with several threads each (gthread): database access releases GIL, and the threads
+keep Server-Sent Events streams from blocking a whole process. Every thread keeps its own database
+connection open (CONN_MAX_AGE), so workers * threads should fit into max_connections of Postgres
+(or of pgbouncer, see docker-compose.yml).
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+if workers > 1:
+    # in-process orders caches of the workers get invalidations of each other's writes (see pizza_ordering/cache.py)
+    os.environ.setdefault('ORDERS_CACHE_INVALIDATION', 'postgres')
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# HTTP keep-alive between requests of the same client (seconds)
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# restart workers now and then to bound memory growth, jitter avoids restarting all of them at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+
+def worker_exit(server, worker):
+    # metrics of the exiting worker changed after the last snapshot (see pizza_ordering/metrics.py)
+    from pizza_ordering.metrics import flush_snapshot
+    flush_snapshot()
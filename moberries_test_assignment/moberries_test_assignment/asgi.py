@@ -0,0 +1,16 @@
+"""
+ASGI config for moberries_test_assignment project.
+
+It exposes the ASGI callable as a module-level variable named ``application``. Cached list and retrieve requests
+are answered on the event loop, the rest by the WSGI application in a thread pool (see pizza_ordering.asgi):
+
+    uvicorn moberries_test_assignment.asgi:application --host 0.0.0.0 --port 8000
+"""
+
+import os
+
+from pizza_ordering.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'moberries_test_assignment.settings')
+
+application = get_asgi_application()
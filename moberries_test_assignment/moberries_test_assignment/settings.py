@@ -12,6 +12,18 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 
+
+def env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_list(name, default):
+    value = os.environ.get(name)
+    return [item.strip() for item in value.split(',') if item.strip()] if value is not None else default
+
+
+# Settings could be overridden with environment variables (see docker-compose.yml for the production profile)
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -20,22 +32,21 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = '!14=o&+l^-#p-5)pldge3o)sq&%1g&mpo^6_i=_&b1d$buo1x3'
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', '!14=o&+l^-#p-5)pldge3o)sq&%1g&mpo^6_i=_&b1d$buo1x3')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# DEBUG also makes every connection record all the executed SQL queries in memory
+DEBUG = env_bool('DJANGO_DEBUG', True)
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = env_list('DJANGO_ALLOWED_HOSTS', [])
 
 
 # Application definition
 
+# The API has no admin, sessions or messages. auth and contenttypes are kept for DRF's AnonymousUser
 INSTALLED_APPS = [
-    'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
-    'django.contrib.sessions',
-    'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
     'pizza_ordering.apps.PizzaOrderingConfig',
@@ -43,12 +54,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'pizza_ordering.replicas.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'moberries_test_assignment.urls'
@@ -62,8 +69,6 @@ TEMPLATES = [
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
-                'django.contrib.auth.context_processors.auth',
-                'django.contrib.messages.context_processors.messages',
             ],
         },
     },
@@ -78,14 +83,38 @@ WSGI_APPLICATION = 'moberries_test_assignment.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'postgres',
-        'USER': 'postgres',
-        'PASSWORD': '',
-        'HOST': 'db',
-        'PORT': '5432',
+        'NAME': os.environ.get('POSTGRES_DB', 'postgres'),
+        'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'db'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # keep connections open between requests (seconds, 0 - close after every request)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        # server-side cursors don't work with pgbouncer in transaction pooling mode
+        'DISABLE_SERVER_SIDE_CURSORS': env_bool('DB_PGBOUNCER', False),
     }
 }
 
+# Streaming replicas of the database: POSTGRES_REPLICAS=host[:port][=weight],... (see docker-compose.yml). Replicas
+# get aliases replica1, replica2, ... and the rest of the connection settings of 'default'
+REPLICA_WEIGHTS = {}
+for index, replica in enumerate(env_list('POSTGRES_REPLICAS', [])):
+    address, _, weight = replica.partition('=')
+    host, _, port = address.partition(':')
+    DATABASES[f'replica{index + 1}'] = dict(DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'],
+                                            OPTIONS={'connect_timeout': int(os.environ.get('DB_REPLICA_TIMEOUT', 2))},
+                                            TEST={'MIRROR': 'default'})
+    REPLICA_WEIGHTS[f'replica{index + 1}'] = int(weight or 1)
+
+# Direct connection to the primary, which bypasses pgbouncer: POSTGRES_DIRECT_HOST=host[:port]. Alias 'direct' keeps
+# server-side cursors and doesn't keep the connection open between requests (it's used by long reads only)
+if os.environ.get('POSTGRES_DIRECT_HOST'):
+    host, _, port = os.environ['POSTGRES_DIRECT_HOST'].partition(':')
+    DATABASES['direct'] = dict(DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'],
+                               CONN_MAX_AGE=0, DISABLE_SERVER_SIDE_CURSORS=False, TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['pizza_ordering.replicas.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -128,4 +157,159 @@ STATIC_URL = '/static/'
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 10,
-}
\ No newline at end of file
+    # the API is public, there are no users to authenticate
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': [],
+    # JSON is encoded and decoded with orjson when it's installed. Browsable API is for development only
+    'DEFAULT_RENDERER_CLASSES': ['pizza_ordering.renderers.FastJSONRenderer']
+    + (['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
+    'DEFAULT_PARSER_CLASSES': ['pizza_ordering.parsers.FastJSONParser',
+                               'rest_framework.parsers.FormParser',
+                               'rest_framework.parsers.MultiPartParser'],
+}
+
+# Orders list pagination.
+# Mode used when neither `offset` nor `cursor` query param is passed: 'offset' or 'cursor'
+ORDERS_PAGINATION_MODE = 'offset'
+# Total count calculation for cursor mode (unless `count` query param is passed): 'exact', 'estimate' or 'none'
+ORDERS_PAGINATION_COUNT = 'none'
+
+# Bulk orders creation (POST /api/v1/orders/bulk/)
+# max amount of orders accepted in one request
+ORDERS_BULK_MAX_ITEMS = 10000
+# max amount of orders inserted with one INSERT statement
+ORDERS_BULK_BATCH_SIZE = 500
+
+# How to handle order items of the same flavour and size: 'keep_first' (drop duplicates) or 'sum' (sum quantities)
+ORDER_ITEMS_DEDUPLICATION = 'keep_first'
+
+# Where order_items in API responses are rendered from: 'json' (Order.order_items) or 'rows' (OrderItem table)
+ORDER_ITEMS_SOURCE = 'json'
+
+# Whether orders lists are serialized straight from .values() rows instead of OrderSerializer (same output, less CPU)
+ORDERS_VALUES_SERIALIZATION = True
+
+# Number of orders fetched from the server-side cursor at once by the export (GET /api/v1/orders/export/)
+ORDERS_EXPORT_CHUNK_SIZE = 2000
+
+# Database alias the export reads from (None - chosen by the routers). Server-side cursors don't work through pgbouncer
+# in transaction pooling mode, without them the whole export would be fetched into memory at once
+ORDERS_EXPORT_DATABASE = 'direct' if 'direct' in DATABASES else None
+
+# Source of GET /api/v1/orders/stats/: 'live' (aggregated from orders), 'summary' (hourly summary table maintained by
+# refresh_order_stats command) or 'auto' (summary, when it was refreshed and could answer the query)
+ORDERS_STATS_SOURCE = 'auto'
+
+# Seconds after the last refresh_order_stats, when 'auto' stops using the summary and aggregates orders live
+# (None - use the summary however old it is). Should be above the interval the refresh is run with
+ORDERS_STATS_MAX_STALENESS = 600
+
+# Cache of serialized orders for GET requests.
+# BACKEND: 'lru' (in-process LRU), 'django' (Django cache CACHE_ALIAS, shared between processes, when CACHES
+# configure a shared one) or None to disable (ORDERS_CACHE_BACKEND=none). Writes invalidate the cache of their own
+# process only, so without INVALIDATION 'lru' is for a single worker process, which is the only writer.
+# INVALIDATION = 'postgres' (ORDERS_CACHE_INVALIDATION, the default of gunicorn.conf.py with several workers, 'none'
+# turns it off) sends invalidations of every write to all the processes with NOTIFY on CHANNEL; 'lru' caches LISTEN
+# on a dedicated connection, with LISTEN_PARAMS overriding the connection parameters (ORDERS_CACHE_LISTEN_HOST:
+# pgbouncer in transaction pooling mode doesn't support LISTEN).
+# TTL is in seconds, MAX_SIZE is used by 'lru' backend only.
+ORDERS_CACHE = {
+    'BACKEND': (None if os.environ.get('ORDERS_CACHE_BACKEND') == 'none'
+                else os.environ.get('ORDERS_CACHE_BACKEND', 'lru')),
+    'CACHE_ALIAS': 'default',
+    'TTL': 30,
+    'MAX_SIZE': 10000,
+    'INVALIDATION': (None if os.environ.get('ORDERS_CACHE_INVALIDATION') == 'none'
+                     else os.environ.get('ORDERS_CACHE_INVALIDATION') or None),
+    'CHANNEL': 'orders_cache',
+    'LISTEN_PARAMS': ({'host': os.environ['ORDERS_CACHE_LISTEN_HOST']}
+                      if os.environ.get('ORDERS_CACHE_LISTEN_HOST') else {}),
+}
+
+# Whether orders list responses carry ETag/Last-Modified. It costs one aggregate query (max(updated_at), count)
+# over the filtered orders per list request (cached list pages keep their ETag).
+ORDERS_LIST_ETAG = True
+
+# Instrumentation of the orders API: SQL queries, database time, rendering time, response size and latency per view
+# action. Collected into Prometheus histograms at /metrics (per process) when ENABLED, SERVER_TIMING adds
+# Server-Timing header with the numbers of the request to responses. With several worker processes set
+# MULTIPROCESS_DIR (ORDERS_METRICS_DIR, local to the host and emptied on start): processes save snapshots there
+# every SNAPSHOT_INTERVAL seconds and /metrics sums them up.
+ORDERS_METRICS = {
+    'ENABLED': env_bool('ORDERS_METRICS', False),
+    'SERVER_TIMING': True,
+    'MULTIPROCESS_DIR': os.environ.get('ORDERS_METRICS_DIR') or None,
+    'SNAPSHOT_INTERVAL': 1,
+}
+
+# Idempotency-Key header of POST /api/v1/orders/: responses are stored by key for TTL seconds (purge expired keys with
+# purge_idempotency_keys command) and kept in an in-process cache of CACHE_SIZE entries for CACHE_TTL seconds
+# (CACHE_SIZE = 0 disables the cache).
+ORDERS_IDEMPOTENCY = {
+    'TTL': 24 * 3600,
+    'CACHE_SIZE': 10000,
+    'CACHE_TTL': 300,
+}
+
+# Kitchen claims (POST /api/v1/orders/claim/): orders are leased to a station for LEASE seconds by default (MAX_LEASE at
+# most), MAX_BATCH orders per claim at most.
+ORDERS_CLAIMS = {
+    'LEASE': 300,
+    'MAX_LEASE': 3600,
+    'MAX_BATCH': 100,
+}
+
+# Read replicas (see pizza_ordering.replicas): safe requests read from the replicas by WEIGHTS, replicas more than
+# MAX_LAG seconds behind or failing health checks (every CHECK_INTERVAL seconds) are skipped. After a write the client
+# reads from the primary for PIN_SECONDS (PIN_COOKIE cookie), None: MAX_LAG + CHECK_INTERVAL, the longest a replica
+# passing the checks could be behind.
+ORDERS_REPLICAS = {
+    'WEIGHTS': REPLICA_WEIGHTS,
+    'PIN_SECONDS': None,
+    'PIN_COOKIE': 'orders_primary',
+    'CHECK_INTERVAL': 5,
+    'MAX_LAG': 5,
+}
+
+# Transactional outbox of order events (see pizza_ordering.outbox): order creations and delivery_status changes are
+# recorded for every destination of DESTINATIONS (name: URL, no events are recorded without destinations) and POSTed
+# to them by dispatch_outbox command in batches of BATCH_SIZE with WORKERS concurrent requests (TIMEOUT seconds each).
+# A claimed batch is leased for ceil(BATCH_SIZE / WORKERS) * TIMEOUT * 2 seconds plus a margin.
+# Failed deliveries are retried after BACKOFF * 2 ** attempt seconds (MAX_BACKOFF at most), MAX_ATTEMPTS times.
+# The dispatcher polls for due events every POLL_INTERVAL seconds.
+ORDERS_OUTBOX = {
+    'DESTINATIONS': {name: url for name, url in (('delivery_partner', os.environ.get('OUTBOX_DELIVERY_PARTNER_URL')),
+                                                 ('notifications', os.environ.get('OUTBOX_NOTIFICATIONS_URL')))
+                     if url},
+    'BATCH_SIZE': 100,
+    'WORKERS': 8,
+    'TIMEOUT': 5,
+    'BACKOFF': 1,
+    'MAX_BACKOFF': 300,
+    'MAX_ATTEMPTS': 20,
+    'POLL_INTERVAL': 1,
+}
+
+# ASGI entry point (moberries_test_assignment.asgi): number of threads running requests, which aren't answered from
+# the orders cache on the event loop. Every thread keeps its own database connection.
+ORDERS_ASGI = {
+    'THREADS': int(os.environ.get('ASGI_THREADS', 32)),
+}
+
+# Server-Sent Events streams of delivery_status changes (GET /api/v1/orders/events/, /api/v1/orders/{id}/events/).
+# BROKER: 'inprocess' (single worker process) or 'postgres' (LISTEN/NOTIFY on CHANNEL, shared between processes).
+# MAX_DURATION - seconds after which a stream is closed (clients reconnect), HEARTBEAT - seconds between
+# keep-alive comments. LISTEN_PARAMS - connection parameters of the 'postgres' listener overriding the database ones
+# (LISTEN needs a direct connection, not one through pgbouncer in transaction pooling mode). MAX_STREAMS - streams
+# served at once by a worker process (None: no limit), others get 503 Service Unavailable. Every stream holds
+# a server thread, keep it below threads of a worker, so the worker has threads left for other requests.
+ORDERS_EVENTS = {
+    'BROKER': os.environ.get('ORDERS_EVENTS_BROKER', 'inprocess'),
+    'CHANNEL': 'order_events',
+    'MAX_DURATION': 300,
+    'HEARTBEAT': 15,
+    'LISTEN_PARAMS': ({'host': os.environ['ORDERS_EVENTS_LISTEN_HOST']}
+                      if os.environ.get('ORDERS_EVENTS_LISTEN_HOST') else {}),
+    'MAX_STREAMS': (int(os.environ['ORDERS_EVENTS_MAX_STREAMS'])
+                    if os.environ.get('ORDERS_EVENTS_MAX_STREAMS') else None),
+}
@@ -16,11 +16,13 @@ Including another URLconf
 from django.urls import include, path
 from rest_framework import routers
 
-from pizza_ordering.views import OrderViewSet
+from pizza_ordering.views import CustomerViewSet, OrderViewSet, metrics
 
 router = routers.DefaultRouter()
 router.register(r'orders', OrderViewSet)
+router.register(r'customers', CustomerViewSet, basename='customer')
 
 urlpatterns = [
     path('api/v1/', include(router.urls)),
+    path('metrics', metrics),
 ]
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PizzaOrderingConfig(AppConfig):
     name = 'pizza_ordering'
+
+    def ready(self):
+        # register custom lookups, signal handlers and system checks
+        from pizza_ordering import checks, lookups, signals  # noqa: F401
@@ -0,0 +1,272 @@
+"""
+ASGI application of the orders API, so one process could hold thousands of concurrent slow clients (e.g. polling
+an order with keep-alive connections). Django 2.2 has no ASGI support, so requests are served in two ways:
+
+- GET list and retrieve requests, which the orders cache (in-process 'lru' backend with 'postgres' INVALIDATION,
+  so writes of every process and container invalidate it) could answer, are answered on the event loop: the cached
+  payload is rendered the same way as by OrderViewSet (the same JSON, ETag/Last-Modified, 304 Not Modified,
+  X-Cache: HIT) without taking a thread or a database connection (except for clients pinned to the primary after
+  a write, see pizza_ordering.replicas);
+- every other request (cache misses, writes, other endpoints) is handed to the Django WSGI application running in
+  a bounded thread pool (ORDERS_ASGI['THREADS'] threads, which is also the max number of database connections of
+  the process). Streamed responses are produced in the pool thread and sent as they are produced, with back-pressure.
+
+Requests answered on the event loop skip middleware and ORDERS_METRICS instrumentation.
+"""
+import asyncio
+import io
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.wsgi import get_wsgi_application
+from django.http import HttpResponse
+from django.urls import reverse
+
+from pizza_ordering import fastjson
+from pizza_ordering.cache import LRUCache, get_order_cache
+from pizza_ordering.conditional import conditional_response, set_validators
+from pizza_ordering.replicas import is_pinned
+
+DEFAULT_SETTINGS = {
+    'THREADS': 32,
+}
+
+# chunks of a streamed response produced ahead of sending them to the client
+STREAM_BUFFER = 16
+LIST_ACTIONS = {'get': 'list', 'post': 'create'}
+DETAIL_ACTIONS = {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}
+JSON_ACCEPT = ('', '*/*', 'application/json')
+
+
+def get_settings() -> Dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ORDERS_ASGI', {})}
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def wsgi_environ(scope: Dict, body: bytes) -> Dict:
+    """
+    WSGI environ of the ASGI HTTP request.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+
+def encode_headers(headers: List[Tuple[str, str]]) -> List[Tuple[bytes, bytes]]:
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+def view_headers(actions: Dict[str, str]) -> Dict[str, str]:
+    """
+    Headers OrderViewSet adds to responses of the route with the actions (Allow, Vary).
+    """
+    from pizza_ordering.views import OrderViewSet
+
+    view = OrderViewSet()
+    for method, action in actions.items():
+        setattr(view, method, getattr(view, action))
+    view.head = view.get
+    return view.default_response_headers
+
+
+class OrdersASGIApplication:
+    """
+    ASGI 3 application answering cached list and retrieve requests on the event loop and the rest with the Django
+    WSGI application in a thread pool.
+    """
+
+    def __init__(self, wsgi_application, threads: int):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        self.list_path = reverse('order-list')
+        self.detail_re = re.compile(rf'^{re.escape(self.list_path)}(?P<pk>\d+)/$')
+        self.list_headers = view_headers(LIST_ACTIONS)
+        self.detail_headers = view_headers(DETAIL_ACTIONS)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        try:
+            body = await read_body(receive)
+        except ClientDisconnected:
+            return
+        environ = wsgi_environ(scope, body)
+        response = self.cached_response(environ) if scope['method'] == 'GET' else None
+        if response is not None:
+            await send({'type': 'http.response.start', 'status': response.status_code,
+                        'headers': encode_headers(list(response.items()))})
+            await send({'type': 'http.response.body', 'body': response.content})
+        else:
+            await self.wsgi_response(environ, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def cached_response(self, environ: Dict) -> Optional[HttpResponse]:
+        """
+        Response of OrderViewSet list or retrieve built from the orders cache or None, if the request should be
+        handled by the view: it isn't cached, it isn't a plain JSON request, the cache isn't in-process
+        (a shared cache would block the event loop) or it misses writes of other processes (no INVALIDATION).
+        """
+        order_cache = get_order_cache()
+        if order_cache is None or not isinstance(order_cache.backend, LRUCache) or order_cache.listener is None:
+            return None
+        path = environ['PATH_INFO']
+        match = self.detail_re.match(path) if path != self.list_path else None
+        if match is None and path != self.list_path:
+            return None
+        if environ.get('HTTP_ACCEPT', '').strip() not in JSON_ACCEPT:
+            return None
+
+        request = WSGIRequest(environ)
+        if 'format' in request.GET or is_pinned(request):
+            return None
+        try:
+            host = request.get_host()
+        except DisallowedHost:
+            return None
+        if match is not None:
+            cached, headers = order_cache.get_order(int(match.group('pk'))), self.detail_headers
+        else:
+            cached, headers = order_cache.get_list(host, request.GET), self.list_headers
+        if cached is None:
+            return None
+
+        # the same as OrderViewSet.cached_response()
+        response = None
+        if cached['etag'] is not None:
+            response = conditional_response(request, cached['etag'], cached['last_modified'])
+        if response is None:
+            response = HttpResponse(fastjson.dumps(cached['data']), content_type='application/json')
+            if cached['etag'] is not None:
+                set_validators(response, cached['etag'], cached['last_modified'])
+        response['X-Cache'] = 'HIT'
+        for name, value in headers.items():
+            response[name] = value
+        response['Content-Length'] = str(len(response.content))
+        return response
+
+    async def wsgi_response(self, environ: Dict, receive, send):
+        """
+        Runs the WSGI application in a pool thread. Messages (response start and body chunks) are passed to the event
+        loop through a queue, the thread waits when STREAM_BUFFER chunks are not sent yet.
+        """
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue()
+        credits = threading.Semaphore(STREAM_BUFFER)
+        stopped = threading.Event()
+
+        def put(message):
+            while not credits.acquire(timeout=1):
+                if stopped.is_set():
+                    raise ClientDisconnected
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+        def start_response(status, headers, exc_info=None):
+            put(('start', int(status.split(' ', 1)[0]), headers))
+
+        def run():
+            try:
+                iterable = self.wsgi_application(environ, start_response)
+                try:
+                    for chunk in iterable:
+                        if stopped.is_set():
+                            break
+                        if chunk:
+                            put(('body', chunk))
+                finally:
+                    # Django sends request_finished (closes the database connection if needed) in the same thread
+                    if hasattr(iterable, 'close'):
+                        iterable.close()
+            except ClientDisconnected:
+                pass
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            stopped.set()
+
+        head = environ['REQUEST_METHOD'] == 'HEAD'
+        watcher = asyncio.ensure_future(watch_disconnect())
+        worker = loop.run_in_executor(self.executor, run)
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+                if message[0] == 'start':
+                    await send({'type': 'http.response.start', 'status': message[1],
+                                'headers': encode_headers(message[2])})
+                elif not head and not stopped.is_set():
+                    await send({'type': 'http.response.body', 'body': message[1], 'more_body': True})
+                credits.release()
+            # errors raised by the application while streaming
+            await worker
+            if not stopped.is_set():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            stopped.set()
+            watcher.cancel()
+
+
+def get_asgi_application() -> OrdersASGIApplication:
+    """
+    Sets Django up and returns the ASGI application (see moberries_test_assignment.asgi).
+    """
+    return OrdersASGIApplication(get_wsgi_application(), threads=get_settings()['THREADS'])
@@ -0,0 +1,281 @@
+"""
+Helpers shared by benchmark management commands: data seeding, latency statistics, the benchmark suite
+of OrderViewSet actions (benchmark_suite command) and a local HTTP stand-in of outbox destinations.
+"""
+import json
+import random
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client, override_settings
+
+from pizza_ordering.models import Order
+
+SEED_CUSTOMERS = 1000
+
+
+def seed_orders(count: int, customers: int = SEED_CUSTOMERS, before: datetime = None,
+                step: timedelta = timedelta(seconds=1), active: int = None) -> None:
+    """
+    Inserts `count` generated orders with a single INSERT ... SELECT generate_series statement.
+    Orders are spread over customers, delivery statuses, flavours and sizes and get a creation time
+    `step` apart from each other going back from `before` (now by default).
+    When `active` is given, only that many newest orders are spread over statuses, the rest are delivered.
+    """
+    statuses = [status for status, _ in Order.DELIVERY_STATUSES]
+    sql = f"""
+        INSERT INTO {Order._meta.db_table}
+            (created_at, updated_at, customer_email, delivery_status, order_items)
+        SELECT ts, ts,
+               'customer' || (g %% %(customers)s) || '@example.com',
+               CASE WHEN g > %(active)s THEN 'delivered' ELSE (%(statuses)s::text[])[1 + g %% %(statuses_len)s] END,
+               jsonb_build_array(
+                   jsonb_build_object('flavour', (%(flavours)s::text[])[1 + g %% %(flavours_len)s],
+                                      'quantity', 1 + g %% 4,
+                                      'size', (%(sizes)s::text[])[1 + g %% %(sizes_len)s]),
+                   jsonb_build_object('flavour', (%(flavours)s::text[])[1 + (g / 7) %% %(flavours_len)s],
+                                      'quantity', 1 + g %% 2,
+                                      'size', (%(sizes)s::text[])[1 + (g / 3) %% %(sizes_len)s]))
+        FROM (SELECT g, COALESCE(%(before)s::timestamptz, now()) - %(step)s * g AS ts
+              FROM generate_series(1, %(count)s) g) AS series
+    """
+    params = {'count': count, 'before': before, 'step': step, 'active': count if active is None else active,
+              'customers': customers,
+              'statuses': statuses, 'statuses_len': len(statuses),
+              'flavours': Order.ITEM_FLAVOURS, 'flavours_len': len(Order.ITEM_FLAVOURS),
+              'sizes': Order.ITEM_SIZES, 'sizes_len': len(Order.ITEM_SIZES)}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        cursor.execute(f"ANALYZE {Order._meta.db_table}")
+
+
+def measure(func: Callable[[], object], repeat: int) -> List[float]:
+    """
+    Calls func `repeat` times and returns list of latencies in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    """
+    Latency statistics (in milliseconds) for the list of timings.
+    """
+    ordered = sorted(timings)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {'count': len(ordered),
+            'mean': round(statistics.mean(ordered), 3),
+            'p50': round(percentile(50), 3),
+            'p95': round(percentile(95), 3),
+            'p99': round(percentile(99), 3),
+            'max': round(ordered[-1], 3)}
+
+
+SUITE_ACTIONS = ('list', 'retrieve', 'create', 'put', 'patch', 'delete')
+SUITE_OFFSETS = (0, 1000, 10000)
+SUITE_URL = '/api/v1/orders/'
+SUITE_ORDER_ITEMS = [{'flavour': 'margherita', 'quantity': 1, 'size': 'big'},
+                     {'flavour': 'hawaii', 'quantity': 2, 'size': 'small'}]
+
+
+def suite_scenarios(actions=SUITE_ACTIONS, offsets=SUITE_OFFSETS) -> List[Dict]:
+    """
+    Scenarios of the benchmark suite in the order they are run: {'name', 'action', 'request', 'status', 'write'},
+    where request(client, number) sends the number-th request of the scenario. Writes go to the orders created by
+    'create' scenario (or by the ORM, when it isn't run): put and patch change them, delete removes them.
+    """
+    newest = Order.objects.order_by('-created_at', '-id').values('id', 'customer_email').first()
+    customer_email = newest['customer_email'] if newest else 'customer1@example.com'
+    pool = []  # orders created during the run
+
+    def get(params):
+        return lambda client, number: client.get(SUITE_URL, params)
+
+    def create(client, number):
+        response = client.post(SUITE_URL, {'customer_email': f'benchmark{number}@example.com',
+                                           'order_items': SUITE_ORDER_ITEMS}, content_type='application/json')
+        pool.append(response.json()['id'])
+        return response
+
+    def put(client, number):
+        items = [dict(SUITE_ORDER_ITEMS[0], quantity=1 + number % 5)]
+        return client.put(f'{SUITE_URL}{pool[number % len(pool)]}/',
+                          {'customer_email': f'benchmark{number}@example.com', 'order_items': items},
+                          content_type='application/json')
+
+    def patch(client, number):
+        # every round over the pool switches orders between the first two statuses, both changes are allowed
+        status = 'ready_for_delivery' if (number // len(pool)) % 2 == 0 else 'not_in_delivery'
+        return client.patch(f'{SUITE_URL}{pool[number % len(pool)]}/', {'delivery_status': status},
+                            content_type='application/json')
+
+    def delete(client, number):
+        return client.delete(f'{SUITE_URL}{pool.pop()}/')
+
+    scenarios = []
+    if 'list' in actions:
+        for offset in offsets:
+            scenarios.append({'name': f'list_offset_{offset}', 'request': get({'offset': offset})})
+        scenarios.extend([
+            {'name': 'list_cursor', 'request': get({'cursor': ''})},
+            {'name': 'list_customer', 'request': get({'customer_email': customer_email})},
+            {'name': 'list_status', 'request': get({'delivery_status': 'not_in_delivery'})},
+            {'name': 'list_flavour', 'request': get({'flavour': 'hawaii', 'size': 'small'})},
+        ])
+        for scenario in scenarios:
+            scenario['action'] = 'list'
+    if 'retrieve' in actions and newest is not None:
+        scenarios.append({'name': 'retrieve', 'action': 'retrieve',
+                          'request': lambda client, number: client.get(f"{SUITE_URL}{newest['id']}/")})
+    if 'create' in actions:
+        scenarios.append({'name': 'create', 'action': 'create', 'request': create, 'status': 201, 'write': True})
+    elif {'put', 'patch', 'delete'} & set(actions):
+        scenarios.append({'name': 'pool', 'action': None, 'write': True,
+                          'request': lambda client, number: pool.append(
+                              Order.objects.create(customer_email=f'benchmark{number}@example.com',
+                                                   order_items=SUITE_ORDER_ITEMS).id)})
+    for name, request, status in [('put', put, 200), ('patch', patch, 200), ('delete', delete, 204)]:
+        if name in actions:
+            scenarios.append({'name': name, 'action': name, 'request': request, 'status': status, 'write': True})
+    for scenario in scenarios:
+        scenario.setdefault('status', 200)
+        scenario.setdefault('write', False)
+    return scenarios
+
+
+def run_suite(repeat: int = 50, actions=SUITE_ACTIONS, offsets=SUITE_OFFSETS, warmup: int = 5,
+              cached: bool = False) -> List[Dict]:
+    """
+    Sends `repeat` requests of every scenario through the whole Django stack (test client) one after another
+    with the orders cache disabled, so warmed up reads measure the database path. With `cached`, read scenarios
+    are repeated with ORDERS_CACHE setting as `<name>_cached` ones. Read scenarios are warmed up first. Returns
+    latency statistics and throughput (requests per second) of every scenario.
+    """
+    client = Client(HTTP_HOST='localhost')
+    scenarios = suite_scenarios(actions, offsets)
+    rounds = [(False, scenarios)]
+    if cached:
+        rounds.append((True, [scenario for scenario in scenarios if not scenario['write']]))
+    results = []
+    for with_cache, round_scenarios in rounds:
+        cache = getattr(settings, 'ORDERS_CACHE', {}) if with_cache else {'BACKEND': None}
+        with override_settings(ALLOWED_HOSTS=['localhost'], DEBUG=False, ORDERS_CACHE=cache):
+            for scenario in round_scenarios:
+                request, status = scenario['request'], scenario['status']
+                if not scenario['write']:
+                    for number in range(warmup):
+                        request(client, number)
+
+                timings = []
+                started = time.perf_counter()
+                for number in range(repeat):
+                    request_started = time.perf_counter()
+                    response = request(client, number)
+                    timings.append((time.perf_counter() - request_started) * 1000)
+                    if scenario['action'] is not None and response.status_code != status:
+                        raise AssertionError(f"{scenario['name']}: {response.status_code} {response.content[:200]}")
+                elapsed = time.perf_counter() - started
+
+                if scenario['action'] is not None:
+                    name = f"{scenario['name']}_cached" if with_cache else scenario['name']
+                    results.append(dict(summarize(timings), scenario=name, action=scenario['action'],
+                                        throughput=round(repeat / elapsed, 1)))
+    return results
+
+
+def compare_results(results: List[Dict], baseline: List[Dict], max_regression: float,
+                    metric: str = 'p95') -> List[Dict]:
+    """
+    Scenarios, which are slower than in the baseline by more than `max_regression` percent of the metric.
+    Scenarios missing in the baseline are skipped.
+    """
+    baseline = {result['scenario']: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['scenario'])
+        if previous is None or not previous[metric]:
+            continue
+        change = (result[metric] / previous[metric] - 1) * 100
+        if change > max_regression:
+            regressions.append({'scenario': result['scenario'], 'metric': metric, 'baseline': previous[metric],
+                                'current': result[metric], 'change_percent': round(change, 1)})
+    return regressions
+
+
+class OutboxStandIn:
+    """
+    HTTP server standing in for the outbox destinations (delivery partner, notification service) in tests and
+    benchmarks. Accepts POSTed events (answers `fail_rate` of them with 503 after `latency` seconds) and checks
+    that events of an order arrive to a path in order. Runs in a background thread.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0, fail_rate: float = 0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.events = []
+        self.failures = 0
+        self.out_of_order = 0
+        self.duplicates = 0
+        self.last_ids = {}
+        self.seen = set()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                event = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                status = 503 if stand_in.fail_rate and random.random() < stand_in.fail_rate else 204
+                stand_in.receive(self.path, event, status)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def receive(self, path: str, event: Dict, status: int) -> None:
+        with self.lock:
+            if status != 204:
+                self.failures += 1
+                return
+            key = (path, event['order_id'])
+            if (path, event['id']) in self.seen:
+                self.duplicates += 1
+            elif event['id'] < self.last_ids.get(key, 0):
+                self.out_of_order += 1
+            self.seen.add((path, event['id']))
+            self.last_ids[key] = max(event['id'], self.last_ids.get(key, 0))
+            self.events.append(dict(event, path=path))
+
+    def start(self) -> 'OutboxStandIn':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
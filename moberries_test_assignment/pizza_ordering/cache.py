@@ -0,0 +1,383 @@
+"""
+Read-through cache for serialized orders payloads.
+
+Order details are cached by id, list pages - by normalized query string. Every write bumps a "generation"
+counter: list pages are keyed by the generation, so all of them become unreachable at once, and details
+are deleted by id. Payloads read before a concurrent write are not stored (generation is checked before set).
+
+Backends:
+- 'lru' - in-process LRU with TTL and max size. Every worker process has its own cache. Without INVALIDATION
+  invalidations are not shared between processes, so it's for a single process, which is the only writer;
+- 'django' - any configured Django cache (e.g. memcached or redis), shared between processes.
+
+INVALIDATION = 'postgres' shares invalidations between processes: every write sends them with NOTIFY in its
+transaction (so they are delivered only if it's committed), also from processes with the cache disabled, and
+every process with 'lru' cache LISTENs with one dedicated connection (InvalidationListener). The 'lru' cache isn't
+read or filled while its listener isn't listening, and is invalidated whenever listening starts, since
+notifications could have been missed meanwhile.
+"""
+import json
+import logging
+import select
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+import psycopg2
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.dispatch import receiver
+from django.utils.http import urlencode
+
+logger = logging.getLogger(__name__)
+
+BACKEND_LRU = 'lru'
+BACKEND_DJANGO = 'django'
+INVALIDATION_POSTGRES = 'postgres'
+
+DEFAULT_SETTINGS = {
+    'BACKEND': BACKEND_LRU,
+    'CACHE_ALIAS': 'default',
+    'TTL': 30,
+    'MAX_SIZE': 10000,
+    'KEY_PREFIX': 'orders',
+    'INVALIDATION': None,
+    'CHANNEL': 'orders_cache',
+    'LISTEN_PARAMS': {},
+}
+
+# NOTIFY payloads are limited to 8000 bytes, larger invalidations drop all the cached orders
+MAX_PAYLOAD = 7900
+INVALIDATE_ALL = '*'
+# seconds to wait before reconnecting a failed listener
+RECONNECT_DELAY = 1
+
+MISSING = object()
+
+
+def get_settings() -> Dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ORDERS_CACHE', {})}
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with TTL. Expired entries are dropped on access,
+    least recently used ones - when max_size is reached.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # counters are kept apart from the entries, so they are never evicted
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: str, default=None):
+        with self.lock:
+            entry = self.entries.get(key, MISSING)
+            if entry is not MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any) -> None:
+        with self.lock:
+            self._set(key, value)
+
+    def set_if_counter(self, key: str, value: Any, counter_key: str, expected: int) -> None:
+        """
+        Sets the value only if the counter is still `expected`, atomically.
+        """
+        with self.lock:
+            if self.counters.get(counter_key, 0) == expected:
+                self._set(key, value)
+
+    def _set(self, key: str, value: Any) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def get_counter(self, key: str) -> int:
+        return self.counters.get(key, 0)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+
+    def clear_entries(self) -> None:
+        # counters go on, so payloads read before the clearing are not stored
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.entries), 'max_size': self.max_size}
+
+
+class DjangoCache:
+    """
+    Adapter over a Django cache backend with the same interface as LRUCache.
+    Hit and miss counters are counted per process.
+    """
+
+    def __init__(self, alias: str, ttl: float):
+        self.cache = caches[alias]
+        self.ttl = ttl
+        self.hits = self.misses = 0
+
+    def get(self, key: str, default=None):
+        value = self.cache.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.cache.set(key, value, self.ttl)
+
+    def set_if_counter(self, key: str, value: Any, counter_key: str, expected: int) -> None:
+        """
+        Sets the value only if the counter is still `expected`. A shared cache has no lock, so the counter is checked
+        once again after the value is set: a writer, which increments the counter after that, deletes the key after.
+        """
+        if self.get_counter(counter_key) != expected:
+            return
+        self.cache.set(key, value, self.ttl)
+        if self.get_counter(counter_key) != expected:
+            self.cache.delete(key)
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        self.cache.delete_many(list(keys))
+
+    def incr(self, key: str) -> int:
+        # counter starts from the current time, so if it's evicted, it won't start over
+        # and meet keys built with its old values
+        self.cache.add(key, int(time.time() * 1000), None)
+        return self.cache.incr(key)
+
+    def get_counter(self, key: str) -> int:
+        return self.cache.get(key, 0)
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class OrderCache:
+    """
+    Cache of serialized order details and list pages on top of LRUCache or DjangoCache.
+    """
+
+    def __init__(self, backend, key_prefix: str):
+        self.backend = backend
+        self.key_prefix = key_prefix
+        self.generation_key = f'{key_prefix}:generation'
+        # InvalidationListener of the in-process cache, which is shared between processes
+        self.listener = None
+
+    def available(self) -> bool:
+        """
+        Whether the cache could be read and filled: it doesn't miss invalidations of other processes.
+        """
+        return self.listener is None or self.listener.listening
+
+    def generation(self) -> int:
+        """
+        Current write generation. Should be taken before reading from DB and passed to set_*() methods.
+        """
+        return self.backend.get_counter(self.generation_key)
+
+    def detail_key(self, pk) -> str:
+        return f'{self.key_prefix}:detail:{pk}'
+
+    def list_key(self, generation: int, host: str, query_params) -> str:
+        query = urlencode(sorted((key, sorted(values)) for key, values in query_params.lists()), doseq=True)
+        return f'{self.key_prefix}:list:{generation}:{host}:{query}'
+
+    def get_order(self, pk) -> Optional[Dict]:
+        return self.backend.get(self.detail_key(pk)) if self.available() else None
+
+    def set_order(self, pk, data: Dict, generation: int) -> None:
+        # don't store payloads which could be read before a concurrent write: invalidate() increments the generation
+        # before deleting the key, so the payload is either not set or deleted after
+        if self.available():
+            self.backend.set_if_counter(self.detail_key(pk), data, self.generation_key, generation)
+
+    def get_list(self, host: str, query_params) -> Optional[Dict]:
+        return self.backend.get(self.list_key(self.generation(), host, query_params)) if self.available() else None
+
+    def set_list(self, host: str, query_params, data: Dict, generation: int) -> None:
+        if generation == self.generation() and self.available():
+            self.backend.set(self.list_key(generation, host, query_params), data)
+
+    def invalidate(self, pks: Iterable = ()) -> None:
+        """
+        Drops cached details of the orders and all the list pages.
+        """
+        self.backend.incr(self.generation_key)
+        self.backend.delete_many([self.detail_key(pk) for pk in pks])
+
+    def invalidate_all(self) -> None:
+        """
+        Drops all the cached payloads of the in-process cache.
+        """
+        self.backend.incr(self.generation_key)
+        self.backend.clear_entries()
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self.backend.stats()
+
+
+class InvalidationListener:
+    """
+    Applies invalidations sent by invalidate_orders() of all the processes to the in-process cache. LISTENs
+    on a dedicated connection in a background thread, reconnects after failures.
+    """
+
+    def __init__(self, order_cache: OrderCache, channel: str, listen_params: Dict = None):
+        self.order_cache = order_cache
+        self.channel = channel
+        # overrides of the connection parameters, e.g. to bypass pgbouncer in transaction pooling mode,
+        # which doesn't support LISTEN
+        self.listen_params = listen_params or {}
+        self.listening = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='orders-cache-invalidation', daemon=True)
+
+    def start(self) -> 'InvalidationListener':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except psycopg2.Error:
+                logger.exception("Orders cache invalidation listener failed, reconnecting")
+            self.stopped.wait(RECONNECT_DELAY)
+
+    def listen(self) -> None:
+        conn = psycopg2.connect(**dict(connections[DEFAULT_DB_ALIAS].get_connection_params(), **self.listen_params))
+        conn.set_session(autocommit=True)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            # invalidations sent before listening started could have been missed
+            self.order_cache.invalidate_all()
+            self.listening = True
+            while not self.stopped.is_set():
+                if select.select([conn], [], [], 1) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self.apply(conn.notifies.pop(0).payload)
+        finally:
+            self.listening = False
+            conn.close()
+
+    def apply(self, payload: str) -> None:
+        if payload == INVALIDATE_ALL:
+            self.order_cache.invalidate_all()
+            return
+        try:
+            pks = json.loads(payload)
+        except ValueError:
+            logger.warning("Malformed orders cache invalidation: %s", payload)
+            self.order_cache.invalidate_all()
+            return
+        self.order_cache.invalidate(pks)
+
+
+_order_cache = MISSING
+_order_cache_lock = threading.Lock()
+
+
+def get_order_cache() -> Optional[OrderCache]:
+    """
+    Returns OrderCache configured with ORDERS_CACHE setting or None if caching is disabled.
+    """
+    global _order_cache
+    if _order_cache is MISSING:
+        with _order_cache_lock:
+            if _order_cache is MISSING:
+                _order_cache = build_order_cache(get_settings())
+    return _order_cache
+
+
+def build_order_cache(options: Dict) -> Optional[OrderCache]:
+    if options['BACKEND'] == BACKEND_LRU:
+        backend = LRUCache(max_size=options['MAX_SIZE'], ttl=options['TTL'])
+    elif options['BACKEND'] == BACKEND_DJANGO:
+        backend = DjangoCache(alias=options['CACHE_ALIAS'], ttl=options['TTL'])
+    else:
+        return None
+    order_cache = OrderCache(backend, options['KEY_PREFIX'])
+    # a shared Django cache gets invalidations of all the processes anyway
+    if options['BACKEND'] == BACKEND_LRU and options['INVALIDATION'] == INVALIDATION_POSTGRES:
+        order_cache.listener = InvalidationListener(order_cache, options['CHANNEL'], options['LISTEN_PARAMS']).start()
+    return order_cache
+
+
+def invalidate_orders(pks: Iterable = ()) -> None:
+    """
+    Invalidates cached orders right away and once again after the current transaction is committed,
+    so readers can't put back data, which was read between the write and the commit. With 'postgres'
+    INVALIDATION other processes are notified too, when the transaction is committed.
+    """
+    pks = list(pks)
+    options = get_settings()
+    if options['INVALIDATION'] == INVALIDATION_POSTGRES:
+        payload = json.dumps(pks)
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)",
+                           [options['CHANNEL'], payload if len(payload) <= MAX_PAYLOAD else INVALIDATE_ALL])
+
+    order_cache = get_order_cache()
+    if order_cache is None:
+        return
+    order_cache.invalidate(pks)
+    transaction.on_commit(lambda: order_cache.invalidate(pks))
+
+
+@receiver(setting_changed)
+def reset_order_cache(setting, **kwargs):
+    global _order_cache
+    if setting == 'ORDERS_CACHE':
+        with _order_cache_lock:
+            if _order_cache not in (MISSING, None) and _order_cache.listener is not None:
+                _order_cache.listener.stop()
+            _order_cache = MISSING
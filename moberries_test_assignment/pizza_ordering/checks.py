@@ -0,0 +1,16 @@
+"""
+System checks of the settings, which would otherwise fail only when a request uses them.
+"""
+from django.conf import settings
+from django.core.checks import Error, register
+
+from pizza_ordering.serializers import DEDUPLICATE_KEEP_FIRST, DEDUPLICATION_POLICIES
+
+
+@register()
+def check_order_items_deduplication(app_configs, **kwargs):
+    policy = getattr(settings, 'ORDER_ITEMS_DEDUPLICATION', DEDUPLICATE_KEEP_FIRST)
+    if policy in DEDUPLICATION_POLICIES:
+        return []
+    return [Error(f"Unknown ORDER_ITEMS_DEDUPLICATION setting {policy!r}.",
+                  hint=f"Must be one of: {', '.join(DEDUPLICATION_POLICIES)}.", id='pizza_ordering.E001')]
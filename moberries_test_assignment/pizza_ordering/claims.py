@@ -0,0 +1,94 @@
+"""
+Kitchen work queue over not_in_delivery orders: stations claim batches of orders with POST /api/v1/orders/claim/
+instead of polling the list and racing each other to PATCH the same orders.
+
+A claim is one statement: the oldest unclaimed not_in_delivery orders (optionally containing items of a flavour
+and size, so a station bakes like pizzas together) are locked with SELECT ... FOR NO KEY UPDATE SKIP LOCKED and
+leased to the station (Order.claimed_by, Order.claim_expires_at). Concurrent claims skip orders locked by each other
+instead of waiting, so stations don't contend. An order claimed by a transaction committed after the statement
+started is re-checked by Postgres once it's locked (its new version is leased already) and replaced with the next
+one, so a station never gets a claimed order and still gets a full batch.
+
+Leases expire after `lease` seconds: orders of an abandoned (crashed) station are handed out again. A station
+finishes an order by moving it out of not_in_delivery (PATCH delivery_status) or gives it back with
+DELETE /api/v1/orders/{id}/claim/.
+"""
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from pizza_ordering.models import Order
+
+DEFAULT_SETTINGS = {
+    'LEASE': 300,
+    'MAX_LEASE': 3600,
+    'MAX_BATCH': 100,
+}
+
+
+def get_settings() -> Dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ORDERS_CLAIMS', {})}
+
+
+def claim_orders(station: str, limit: int, lease: float, flavour: str = None,
+                 size: str = None) -> Tuple[List[int], datetime]:
+    """
+    Leases at most `limit` oldest unclaimed not_in_delivery orders (containing an item of the flavour and size,
+    when given) to the station for `lease` seconds. Returns ids of the claimed orders and expiry time of the lease.
+    """
+    table = connection.ops.quote_name(Order._meta.db_table)
+    item = {key: value for key, value in [('flavour', flavour), ('size', size)] if value is not None}
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=lease)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH candidates AS (
+                SELECT id FROM {table}
+                WHERE delivery_status = 'not_in_delivery'
+                      AND (claim_expires_at IS NULL OR claim_expires_at <= %(now)s)
+                      {'AND order_items @> %(items)s::jsonb' if item else ''}
+                ORDER BY created_at, id
+                LIMIT %(limit)s
+                FOR NO KEY UPDATE SKIP LOCKED
+            )
+            UPDATE {table} AS o SET claimed_by = %(station)s, claim_expires_at = %(expires_at)s
+            FROM candidates WHERE o.id = candidates.id
+            RETURNING o.id
+        """, {'now': now, 'expires_at': expires_at, 'station': station, 'limit': limit,
+              'items': json.dumps([item])})
+        return [order_id for order_id, in cursor.fetchall()], expires_at
+
+
+def group_items(rows: List[Dict]) -> List[Dict]:
+    """
+    Items of the claimed orders grouped by flavour and size (the biggest group first): pizzas of a group could be
+    baked together.
+    """
+    groups = OrderedDict()
+    for row in rows:
+        # order_items saved bypassing the API may be not a list of objects
+        items = row['order_items'] if isinstance(row['order_items'], list) else []
+        for item in (item for item in items if isinstance(item, dict)):
+            key = (item.get('flavour'), item.get('size'))
+            group = groups.setdefault(key, {'flavour': key[0], 'size': key[1], 'quantity': 0, 'order_ids': []})
+            group['quantity'] += item.get('quantity') or 0
+            if row['id'] not in group['order_ids']:
+                group['order_ids'].append(row['id'])
+    return sorted(groups.values(), key=lambda group: -group['quantity'])
+
+
+def release_claim(pk: int, station: str) -> Optional[bool]:
+    """
+    Gives the order back to the queue. Returns True if the station held the claim, False if somebody else
+    holds it and None if the order isn't claimed.
+    """
+    now = timezone.now()
+    if Order.objects.filter(pk=pk, claimed_by=station, claim_expires_at__gt=now).update(claimed_by=None,
+                                                                                       claim_expires_at=None):
+        return True
+    return False if Order.objects.filter(pk=pk, claim_expires_at__gt=now).exists() else None
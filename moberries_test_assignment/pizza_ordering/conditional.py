@@ -0,0 +1,69 @@
+"""
+Validators (ETag and Last-Modified) for conditional requests to the orders API.
+Order's validators are derived from its id and updated_at, list's - from max(updated_at) and count of the
+filtered orders, so neither of them requires serialization.
+"""
+import hashlib
+import re
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+ORDER_ETAG_RE = re.compile(r'^"(?P<pk>\d+)-(?P<microseconds>\d+)"$')
+
+
+def order_validators(pk, updated_at: datetime) -> Tuple[str, int]:
+    """
+    ETag and Last-Modified (unix timestamp) of the order. ETag holds exact microseconds of updated_at
+    (see parse_order_etag()).
+    """
+    return f'"{pk}-{(updated_at - EPOCH) // MICROSECOND}"', int(updated_at.timestamp())
+
+
+def parse_order_etag(if_match: str, pk: int) -> Optional[datetime]:
+    """
+    updated_at of the order encoded in If-Match header, when it holds a single ETag given by order_validators()
+    for the order, otherwise None (the header has to be checked against the stored order).
+    """
+    match = ORDER_ETAG_RE.match(if_match.strip())
+    if match is None or int(match.group('pk')) != pk:
+        return None
+    return EPOCH + int(match.group('microseconds')) * MICROSECOND
+
+
+def list_validators(queryset, query: str) -> Tuple[str, Optional[int], int]:
+    """
+    ETag and Last-Modified (unix timestamp) of the orders list for the filtered queryset and count of the orders,
+    which the pagination could reuse. Query string is a part of the ETag, since different pages of the same list
+    have different content.
+    """
+    aggregates = queryset.order_by().aggregate(last_updated_at=Max('updated_at'), count=Count('id'))
+    last_updated_at = aggregates['last_updated_at']
+    last_updated = (last_updated_at - EPOCH) // MICROSECOND if last_updated_at else 0
+    digest = hashlib.md5(f"{last_updated}:{aggregates['count']}:{query}".encode('utf-8')).hexdigest()
+    return f'"{digest}"', int(last_updated_at.timestamp()) if last_updated_at else None, aggregates['count']
+
+
+def conditional_response(request, etag: str, last_modified: Optional[int]):
+    """
+    Returns 304 Not Modified (for GET/HEAD) or 412 Precondition Failed (for unsafe methods) response
+    if request's conditional headers tell so, otherwise None.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag: str, last_modified: Optional[int]):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,190 @@
+"""
+Per-customer summary of orders (CustomerSummary) behind GET /api/v1/customers/{email}/summary/: number of orders,
+active (not delivered) orders, time of the last order and pizzas per flavour and size, which give the favourite ones.
+A lookup reads one row by primary key instead of aggregating the customer's orders.
+
+The summary is maintained incrementally: every order change made through the API (create and update by
+OrderSerializer, DELETE, delivery_status changes, bulk create and bulk status change) collects its deltas
+in SummaryChanges and writes them in the transaction of the change with a single upsert. Rows are upserted in email
+order, so concurrent changes of the same customer serialize on its row without deadlocks. When orders are removed,
+the last order time is looked up again (order_customer_created_at_idx) and a customer left without orders loses
+the row.
+
+Orders written bypassing the API (seed_orders, raw SQL, archived partitions) are reflected only when
+rebuild_customer_summaries command recomputes the table from the orders, in chunks of customers. Every chunk is
+a short transaction holding SHARE ROW EXCLUSIVE lock on the table: order changes of the time wait for the chunk
+to commit and then apply their deltas on top of it, so they are neither lost nor counted twice.
+"""
+import json
+from typing import Dict, Optional
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from pizza_ordering.models import CustomerSummary, Order, OrderItem
+
+REBUILD_CHUNK_SIZE = 1000
+
+
+def is_active(delivery_status: str) -> bool:
+    return delivery_status != 'delivered'
+
+
+class SummaryChanges:
+    """
+    Deltas of customer summaries collected from order changes. save() writes them, it must be called
+    in the transaction, which changes the orders.
+    """
+
+    def __init__(self):
+        self.deltas = {}
+        # customers, who lost orders: their last order time is looked up again
+        self.removed = set()
+
+    def delta(self, customer_email: str) -> Dict:
+        if customer_email not in self.deltas:
+            self.deltas[customer_email] = {'orders': 0, 'active_orders': 0, 'last_order_at': None,
+                                           'flavour_pizzas': [0] * len(Order.ITEM_FLAVOURS),
+                                           'size_pizzas': [0] * len(Order.ITEM_SIZES)}
+        return self.deltas[customer_email]
+
+    def add(self, order: Order, sign: int = 1) -> 'SummaryChanges':
+        """
+        Counts the order in the summary of its customer (out of it with sign=-1).
+        """
+        delta = self.delta(order.customer_email)
+        delta['orders'] += sign
+        delta['active_orders'] += sign * is_active(order.delivery_status)
+        order_items = order.order_items
+        # orders saved bypassing the API may contain JSON-encoded string
+        if isinstance(order_items, str):
+            order_items = json.loads(order_items)
+        for item in order_items if isinstance(order_items, list) else []:
+            if not isinstance(item, dict) or not isinstance(item.get('quantity'), int):
+                continue
+            # the same items as rebuild_chunk() counts
+            flavour, size = OrderItem.FLAVOUR_CODES.get(item.get('flavour')), OrderItem.SIZE_CODES.get(item.get('size'))
+            if flavour is not None:
+                delta['flavour_pizzas'][flavour] += sign * item['quantity']
+            if size is not None:
+                delta['size_pizzas'][size] += sign * item['quantity']
+        if sign > 0:
+            latest = delta['last_order_at']
+            delta['last_order_at'] = order.created_at if latest is None else max(latest, order.created_at)
+        else:
+            self.removed.add(order.customer_email)
+        return self
+
+    def remove(self, order: Order) -> 'SummaryChanges':
+        return self.add(order, sign=-1)
+
+    def change_status(self, customer_email: str, previous_status: str, delivery_status: str) -> 'SummaryChanges':
+        self.delta(customer_email)['active_orders'] += is_active(delivery_status) - is_active(previous_status)
+        return self
+
+    def save(self) -> None:
+        # status changes between active statuses change nothing
+        deltas = [(customer_email, delta) for customer_email, delta in sorted(self.deltas.items())
+                  if customer_email in self.removed or delta['orders'] or delta['active_orders']
+                  or delta['last_order_at'] or any(delta['flavour_pizzas']) or any(delta['size_pizzas'])]
+        if not deltas:
+            return
+
+        table = connection.ops.quote_name(CustomerSummary._meta.db_table)
+        orders_table = connection.ops.quote_name(Order._meta.db_table)
+        now = timezone.now()
+        values = ', '.join(['(%s, %s, %s, %s::timestamptz, %s::integer[], %s::integer[], %s)'] * len(deltas))
+
+        def add_arrays(column):
+            # element-wise sum, the arrays could be shorter than a grown catalogue
+            return (f"ARRAY(SELECT GREATEST(COALESCE(a, 0) + COALESCE(b, 0), 0) "
+                    f"FROM unnest(s.{column}, excluded.{column}) WITH ORDINALITY AS p(a, b, n) ORDER BY n)")
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {table} AS s
+                    (customer_email, orders, active_orders, last_order_at, flavour_pizzas, size_pizzas, updated_at)
+                VALUES {values}
+                ON CONFLICT (customer_email) DO UPDATE
+                SET orders = GREATEST(s.orders + excluded.orders, 0),
+                    active_orders = GREATEST(s.active_orders + excluded.active_orders, 0),
+                    last_order_at = GREATEST(s.last_order_at, excluded.last_order_at),
+                    flavour_pizzas = {add_arrays('flavour_pizzas')},
+                    size_pizzas = {add_arrays('size_pizzas')},
+                    updated_at = excluded.updated_at
+            """, [value for customer_email, delta in deltas
+                  for value in (customer_email, delta['orders'], delta['active_orders'], delta['last_order_at'],
+                                delta['flavour_pizzas'], delta['size_pizzas'], now)])
+            if self.removed:
+                removed = sorted(self.removed)
+                # orders, which were never counted (saved bypassing the API), could leave negative rows
+                cursor.execute(f"DELETE FROM {table} WHERE customer_email = ANY(%s) AND orders <= 0", [removed])
+                cursor.execute(f"""
+                    UPDATE {table} AS s
+                    SET last_order_at = (SELECT max(o.created_at) FROM {orders_table} AS o
+                                         WHERE o.customer_email = s.customer_email)
+                    WHERE s.customer_email = ANY(%s)
+                """, [removed])
+
+
+def rebuild_chunk(after: str, until: Optional[str]) -> int:
+    """
+    Recomputes summaries of customers with emails in (after, until] (till the end, if until is None) from their
+    orders. Returns the number of customers.
+    """
+    table = connection.ops.quote_name(CustomerSummary._meta.db_table)
+    params = {'after': after, 'until': until, 'now': timezone.now()}
+    condition = "customer_email > %(after)s" + (" AND customer_email <= %(until)s" if until is not None else "")
+    sums = []
+    for prefix, key, names in (('f', 'flavour', Order.ITEM_FLAVOURS), ('s', 'size', Order.ITEM_SIZES)):
+        for code, name in enumerate(names):
+            params[f'{prefix}{code}'] = name
+            sums.append(f"COALESCE(sum((i ->> 'quantity')::integer) FILTER (WHERE i ->> '{key}' = %({prefix}{code})s),"
+                        f" 0) AS {prefix}{code}")
+    flavours = ', '.join(f'sum(p.f{code})' for code in range(len(Order.ITEM_FLAVOURS)))
+    sizes = ', '.join(f'sum(p.s{code})' for code in range(len(Order.ITEM_SIZES)))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # concurrent order changes wait for the chunk instead of being lost or counted twice
+        cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(f"DELETE FROM {table} WHERE {condition}", params)
+        cursor.execute(f"""
+            INSERT INTO {table}
+                (customer_email, orders, active_orders, last_order_at, flavour_pizzas, size_pizzas, updated_at)
+            SELECT o.customer_email, count(*), count(*) FILTER (WHERE o.delivery_status <> 'delivered'),
+                   max(o.created_at), ARRAY[{flavours}]::integer[], ARRAY[{sizes}]::integer[], %(now)s
+            FROM {connection.ops.quote_name(Order._meta.db_table)} AS o
+            CROSS JOIN LATERAL (
+                SELECT {', '.join(sums)}
+                FROM jsonb_array_elements(CASE jsonb_typeof(o.order_items)
+                                              WHEN 'array' THEN o.order_items
+                                              WHEN 'string' THEN (o.order_items #>> '{{}}')::jsonb
+                                              ELSE '[]' END) AS i
+                WHERE jsonb_typeof(i -> 'quantity') = 'number') AS p
+            WHERE o.{condition}
+            GROUP BY o.customer_email
+        """, params)
+        return cursor.rowcount
+
+
+def rebuild_summaries(chunk_size: int = REBUILD_CHUNK_SIZE) -> int:
+    """
+    Recomputes all the summaries in chunks of `chunk_size` customers (short transactions, which don't hold
+    the table for long). Returns the number of customers.
+    """
+    orders_table = connection.ops.quote_name(Order._meta.db_table)
+    after, customers = '', 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT max(customer_email), count(*)
+                FROM (SELECT DISTINCT customer_email FROM {orders_table} WHERE customer_email > %s
+                      ORDER BY customer_email LIMIT %s) AS chunk
+            """, [after, chunk_size])
+            until, found = cursor.fetchone()
+        # the last chunk also drops summaries of customers after the last one with orders
+        last = found < chunk_size
+        customers += rebuild_chunk(after, None if last else until)
+        if last:
+            return customers
+        after = until
@@ -0,0 +1,262 @@
+"""
+Publish/subscribe of order events (delivery_status changes) for streaming endpoints.
+
+Brokers:
+- 'inprocess' - subscribers of the same process only. Events are published after the transaction is committed.
+  Suitable for a single worker process;
+- 'postgres' - events are sent with NOTIFY in the transaction, which changes the order (so they are delivered
+  only if it's committed). Every process LISTENs with one dedicated connection and fans events out
+  to its local subscribers.
+"""
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import psycopg2
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.dispatch import receiver
+from rest_framework.fields import DateTimeField
+
+logger = logging.getLogger(__name__)
+
+BROKER_INPROCESS = 'inprocess'
+BROKER_POSTGRES = 'postgres'
+
+EVENT_DELIVERY_STATUS = 'delivery_status'
+
+
+class Subscription:
+    """
+    Queue of events for one watcher. Events not matching the predicate are not queued.
+    When the queue is full (slow watcher), new events are dropped.
+    """
+
+    def __init__(self, predicate: Callable[[Dict], bool] = None, max_size: int = 1000):
+        self.predicate = predicate
+        self.events = queue.Queue(maxsize=max_size)
+        self.dropped = 0
+
+    def put(self, event: Dict) -> None:
+        if self.predicate is not None and not self.predicate(event):
+            return
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout: float) -> Optional[Dict]:
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class InProcessBroker:
+    """
+    Fans events out to subscribers of the current process.
+    """
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, predicate: Callable[[Dict], bool] = None) -> Subscription:
+        subscription = Subscription(predicate)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def dispatch(self, event: Dict) -> None:
+        """
+        Delivers event to the subscribers right away.
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def publish(self, event: Dict, using: str = 'default') -> None:
+        """
+        Delivers event once the current transaction is committed (right away in autocommit mode).
+        """
+        self.publish_many([event], using=using)
+
+    def publish_many(self, events: List[Dict], using: str = 'default') -> None:
+        def dispatch_all():
+            for event in events:
+                self.dispatch(event)
+        transaction.on_commit(dispatch_all, using=using)
+
+
+class PostgresBroker(InProcessBroker):
+    """
+    Delivers events between processes with LISTEN/NOTIFY.
+    """
+
+    def __init__(self, channel: str, using: str = 'default', listen_params: Dict = None):
+        super(PostgresBroker, self).__init__()
+        self.channel = channel
+        self.using = using
+        # overrides of the connection parameters for the listener, e.g. to bypass pgbouncer in transaction
+        # pooling mode, which doesn't support LISTEN
+        self.listen_params = listen_params or {}
+        self.listener = None
+
+    def subscribe(self, predicate: Callable[[Dict], bool] = None) -> Subscription:
+        self.ensure_listener()
+        return super(PostgresBroker, self).subscribe(predicate)
+
+    def publish_many(self, events: List[Dict], using: str = 'default') -> None:
+        # NOTIFY is transactional: listeners get it only after commit
+        if not events:
+            return
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+                           [self.channel, [json.dumps(event) for event in events]])
+
+    def ensure_listener(self) -> None:
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen, name='order-events-listener', daemon=True)
+                self.listener.start()
+
+    def listen(self) -> None:
+        """
+        Listener loop: waits for notifications on the dedicated connection and dispatches them.
+        """
+        conn = psycopg2.connect(**dict(connections[self.using].get_connection_params(), **self.listen_params))
+        conn.set_session(autocommit=True)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            while True:
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        self.dispatch(json.loads(notify.payload))
+                    except ValueError:
+                        logger.warning("Malformed order event payload: %s", notify.payload)
+        except psycopg2.Error:
+            logger.exception("Order events listener failed, it will be restarted on the next subscription")
+        finally:
+            conn.close()
+
+
+class EventStream:
+    """
+    Iterator of Server-Sent Events messages for StreamingHttpResponse.
+    Sends initial events first, then events of the subscription and keep-alive comments when there are none.
+    Ends after `duration` seconds (clients reconnect automatically). Unsubscribes when closed by the server,
+    even if streaming hasn't started.
+    """
+
+    def __init__(self, broker, subscription: Subscription, initial_events: Iterable[Dict],
+                 duration: float, heartbeat: float):
+        self.broker = broker
+        self.subscription = subscription
+        self.pending = [format_event(event) for event in initial_events]
+        self.duration = duration
+        self.heartbeat = heartbeat
+        self.deadline = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.duration
+            # reconnection delay for clients, ms
+            return 'retry: 3000\n\n'
+        if self.pending:
+            return self.pending.pop(0)
+
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            self.close()
+            raise StopIteration
+        event = self.subscription.get(timeout=min(self.heartbeat, remaining))
+        return format_event(event) if event is not None else ': keep-alive\n\n'
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self.subscription)
+
+
+def format_event(event: Dict) -> str:
+    """
+    Formats event as Server-Sent Events message.
+    """
+    return f"id: {event['event_id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+def status_event(order, previous_status: Optional[str]) -> Dict:
+    """
+    Event about delivery_status of the order.
+    """
+    return {
+        'event_id': f"{order.id}-{int(order.updated_at.timestamp() * 1000000)}",
+        'type': EVENT_DELIVERY_STATUS,
+        'data': {'id': order.id,
+                 'customer_email': order.customer_email,
+                 'delivery_status': order.delivery_status,
+                 'previous_status': previous_status,
+                 'updated_at': DateTimeField().to_representation(order.updated_at)},
+    }
+
+
+def publish_status_change(order, previous_status: str) -> None:
+    """
+    Publishes delivery_status change of the order. Must be called in the transaction, which changes the order.
+    """
+    broker = get_broker()
+    if broker is not None:
+        broker.publish(status_event(order, previous_status))
+
+
+def publish_status_changes(changes: Iterable) -> None:
+    """
+    Publishes delivery_status changes of many orders, `changes` are pairs of the order and its previous status.
+    """
+    broker = get_broker()
+    if broker is not None:
+        broker.publish_many([status_event(order, previous_status) for order, previous_status in changes])
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """
+    Returns broker configured with ORDERS_EVENTS setting.
+    """
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                options = getattr(settings, 'ORDERS_EVENTS', {})
+                if options.get('BROKER', BROKER_INPROCESS) == BROKER_POSTGRES:
+                    _broker = PostgresBroker(channel=options.get('CHANNEL', 'order_events'),
+                                             listen_params=options.get('LISTEN_PARAMS'))
+                else:
+                    _broker = InProcessBroker()
+    return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'ORDERS_EVENTS':
+        _broker = None
@@ -0,0 +1,134 @@
+"""
+Query plans of the orders API: every scenario (a request to one of OrderViewSet actions) is sent through the test
+client, the statements it issues are captured and run again with EXPLAIN ANALYZE. Sequential scans over the orders
+table (or its partitions) on a large table mean a query shape isn't served by any index.
+
+Everything runs in a transaction, which is rolled back at the end, so scenarios could change orders freely.
+Queries, which read all the orders by nature (unfiltered exact count, ETag of the unfiltered list, unfiltered
+statistics), are not a part of the scenarios: they are avoided with `count=none`, ORDERS_LIST_ETAG=False and filters.
+"""
+import re
+from typing import Dict, Iterator, List, Tuple
+
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from pizza_ordering.benchmarking import seed_orders
+from pizza_ordering.models import Order
+
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+# server-side cursors are recorded as DECLARE ... CURSOR ... FOR <query>
+DECLARE_CURSOR_RE = re.compile(r'^DECLARE\s+\S+\s+.*?CURSOR\s+(?:WITH(?:OUT)?\s+HOLD\s+)?FOR\s+', re.I | re.S)
+ORDERS_TABLE_RE = re.compile(rf'^{Order._meta.db_table}(_y\d{{4}}m\d{{2}}|_default)?$')
+
+URL = '/api/v1/orders/'
+
+
+def seed_plans_data(count: int, active: int = None) -> None:
+    """
+    Seeds `count` orders shaped like production data: all but the newest `active` orders (2% by default)
+    are delivered.
+    """
+    seed_orders(count, active=count // 50 if active is None else active)
+
+
+def order_view_scenarios() -> List[Tuple[str, str, str, Dict]]:
+    """
+    Requests to OrderViewSet actions as (name, method, path, data) for the newest order, which isn't in delivery yet,
+    and its customer. Order changes go in the order of allowed delivery status transitions.
+    """
+    order = Order.objects.filter(delivery_status='not_in_delivery').order_by('-created_at', '-id').first()
+    pk, email = order.id, order.customer_email
+    return [
+        ('list', 'get', URL, {'count': 'none'}),
+        ('list_cursor', 'get', URL, {'cursor': '', 'count': 'none'}),
+        ('list_customer', 'get', URL, {'customer_email': email}),
+        ('list_customer_cursor', 'get', URL, {'customer_email': email, 'cursor': ''}),
+        ('list_active_status', 'get', URL, {'delivery_status': 'not_in_delivery'}),
+        ('list_delivered', 'get', URL, {'delivery_status': 'delivered', 'count': 'none'}),
+        ('list_flavour', 'get', URL, {'flavour': 'fungi', 'size': 'big', 'count': 'none'}),
+        ('retrieve', 'get', f'{URL}{pk}/', {}),
+        ('stats_customer', 'get', f'{URL}stats/', {'customer_email': email, 'group_by': 'flavour'}),
+        ('export_customer', 'get', f'{URL}export/', {'customer_email': email}),
+        ('put', 'put', f'{URL}{pk}/', {'customer_email': email,
+                                      'order_items': [{'flavour': 'hawaii', 'quantity': 1, 'size': 'big'}]}),
+        ('patch', 'patch', f'{URL}{pk}/', {'delivery_status': 'ready_for_delivery'}),
+        ('bulk_status_ids', 'patch', f'{URL}status/', {'delivery_status': 'dispatched', 'ids': [pk]}),
+        ('bulk_status_filter', 'patch', f'{URL}status/', {'delivery_status': 'on_its_way',
+                                                         'filter': {'customer_email': email}}),
+        ('delete', 'delete', f'{URL}{pk}/', {}),
+    ]
+
+
+def plan_nodes(plan: Dict) -> Iterator[Dict]:
+    """
+    All the nodes of EXPLAIN (FORMAT JSON) plan.
+    """
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def sequential_scans(plan: Dict) -> List[str]:
+    """
+    Relations of the orders table read with sequential scans.
+    """
+    return [node['Relation Name'] for node in plan_nodes(plan)
+            if node['Node Type'] == 'Seq Scan' and ORDERS_TABLE_RE.match(node.get('Relation Name', ''))]
+
+
+def index_names(plan: Dict) -> List[str]:
+    """
+    Indexes used by the plan.
+    """
+    return [node['Index Name'] for node in plan_nodes(plan) if 'Index Name' in node]
+
+
+def explain_analyze(sql: str) -> Dict:
+    """
+    Runs the statement with EXPLAIN ANALYZE in a savepoint, which is rolled back. Returns the plan.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}")
+        plan = cursor.fetchone()[0]
+        transaction.set_rollback(True)
+    return plan[0]['Plan']
+
+
+def capture_plans(method: str, path: str, data: Dict) -> List[Dict]:
+    """
+    Sends the request and returns {'sql', 'plan', 'seq_scans'} for every statement it issued.
+    """
+    client = Client(HTTP_HOST='localhost')
+    with CaptureQueriesContext(connection) as context:
+        if method == 'get':
+            response = client.get(path, data)
+        else:
+            response = getattr(client, method)(path, data=data, content_type='application/json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+    assert response.status_code < 400, (path, response.status_code)
+
+    result = []
+    for query in context.captured_queries:
+        sql = DECLARE_CURSOR_RE.sub('', query['sql'])
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            continue
+        plan = explain_analyze(sql)
+        result.append({'sql': sql, 'plan': plan, 'seq_scans': sequential_scans(plan)})
+    return result
+
+
+def explain_order_views(scenarios: List[Tuple[str, str, str, Dict]] = None) -> List[Dict]:
+    """
+    Captures plans of all the scenarios (order_view_scenarios() by default) in a transaction, which is rolled back.
+    Returns {'scenario', 'sql', 'plan', 'seq_scans'} for every statement.
+    """
+    results = []
+    with override_settings(ORDERS_CACHE={'BACKEND': None}, ORDERS_LIST_ETAG=False, ALLOWED_HOSTS=['localhost']), \
+            transaction.atomic():
+        for name, method, path, data in scenarios or order_view_scenarios():
+            results.extend(dict(plan, scenario=name) for plan in capture_plans(method, path, data))
+        transaction.set_rollback(True)
+    return results
@@ -0,0 +1,63 @@
+"""
+Streaming export of orders as NDJSON (one order per line, the same shape as the API gives) or CSV
+(one line per order item). Orders are read with a server-side cursor and written in chunks, so memory use
+doesn't depend on the number of exported orders.
+"""
+import csv
+import io
+import json
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
+
+from pizza_ordering import fastjson
+from pizza_ordering.serializers import ORDER_FIELDS, orders_to_dicts
+
+CSV_COLUMNS = ['id', 'created_at', 'updated_at', 'customer_email', 'delivery_status', 'flavour', 'size', 'quantity']
+
+
+def chunks(queryset, chunk_size: int) -> Iterator[List[Dict]]:
+    """
+    Serialized orders of the queryset in lists of chunk_size, fetched with a server-side cursor.
+    """
+    rows = queryset.values(*ORDER_FIELDS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield orders_to_dicts(chunk)
+
+
+def export_ndjson(queryset, chunk_size: int) -> Iterator[bytes]:
+    for chunk in chunks(queryset, chunk_size):
+        yield b''.join(fastjson.dumps(order) + b'\n' for order in chunk)
+
+
+def flatten_order_items(order_items) -> Iterable[Dict]:
+    """
+    Order items as dicts. Orders without (valid) items give one empty item, so every order is exported.
+    """
+    if isinstance(order_items, str):
+        try:
+            order_items = json.loads(order_items)
+        except ValueError:
+            order_items = None
+    items = [item for item in order_items if isinstance(item, dict)] if isinstance(order_items, list) else []
+    return items or [{}]
+
+
+def export_csv(queryset, chunk_size: int) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for chunk in chunks(queryset, chunk_size):
+        for order in chunk:
+            for item in flatten_order_items(order['order_items']):
+                writer.writerow([order['id'], order['created_at'], order['updated_at'], order['customer_email'],
+                                 order['delivery_status'], item.get('flavour'), item.get('size'),
+                                 item.get('quantity')])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # header only, when there are no orders
+    if buffer.tell():
+        yield buffer.getvalue()
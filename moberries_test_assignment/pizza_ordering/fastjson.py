@@ -0,0 +1,44 @@
+"""
+JSON encoding and decoding with orjson when it's installed (`pip install orjson`), otherwise with the standard library.
+Output of dumps() is the same as of DRF's JSONRenderer in compact mode: no whitespace, non-ASCII characters
+as is, U+2028 and U+2029 escaped, values unknown to JSON encoded by DRF's JSONEncoder.
+"""
+import json
+from typing import Union
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        # datetimes are formatted by DRF's encoder ('Z' suffix for UTC), not by orjson
+        output = orjson.dumps(data, default=_encoder.default,
+                              option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    else:
+        output = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, allow_nan=False,
+                            separators=(',', ':')).encode('utf-8')
+    # line and paragraph separators are valid in JSON, but not in JavaScript
+    if b'\xe2\x80\xa8' in output or b'\xe2\x80\xa9' in output:
+        output = output.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return output
+
+
+def strict_constant(value):
+    raise ValueError(f"Out of range float values are not JSON compliant: {value!r}")
+
+
+def loads(data: Union[bytes, str]):
+    """
+    Decodes JSON document (str or UTF-8 encoded bytes). NaN and Infinity are rejected.
+    Raises ValueError on malformed input.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data, parse_constant=strict_constant)
@@ -0,0 +1,63 @@
+import django_filters
+from django import forms
+
+from pizza_ordering.models import Order
+
+
+class IntegerFilter(django_filters.NumberFilter):
+    """
+    Filter by a whole number: fractions are rejected rather than truncated.
+    """
+    field_class = forms.IntegerField
+
+
+class OrderFilter(django_filters.FilterSet):
+    """
+    Filters for the orders list.
+    Besides customer_email and delivery_status orders could be filtered by their content: `flavour`, `size` and
+    `min_quantity` are applied together to the same element of order_items. They are compiled to
+    `order_items @> '[{"flavour": ..., "size": ...}]'` containment query (and `@?` JSON path query for min_quantity)
+    served by GIN (jsonb_path_ops) index on order_items.
+    """
+    ORDER_ITEM_FILTERS = ('flavour', 'size', 'min_quantity')
+
+    flavour = django_filters.ChoiceFilter(choices=[(flavour, flavour) for flavour in Order.ITEM_FLAVOURS],
+                                          method='filter_order_item')
+    size = django_filters.ChoiceFilter(choices=[(size, size) for size in Order.ITEM_SIZES],
+                                       method='filter_order_item')
+    min_quantity = IntegerFilter(min_value=1, method='filter_order_item')
+
+    class Meta:
+        model = Order
+        fields = ['customer_email', 'delivery_status']
+
+    def filter_order_item(self, queryset, name, value):
+        """
+        Order item filters are applied all at once in filter_queryset().
+        """
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super(OrderFilter, self).filter_queryset(queryset)
+        return self.filter_by_order_item(queryset, **{name: self.form.cleaned_data.get(name)
+                                                      for name in self.ORDER_ITEM_FILTERS})
+
+    @staticmethod
+    def filter_by_order_item(queryset, flavour: str = None, size: str = None, min_quantity: int = None):
+        """
+        Keeps orders, which contain an item of the flavour and size with at least min_quantity pizzas.
+        """
+        element = {}
+        if flavour:
+            element['flavour'] = flavour
+        if size:
+            element['size'] = size
+        if element:
+            queryset = queryset.filter(order_items__contains=[element])
+
+        if min_quantity is not None:
+            # values are validated against catalogue, so they are safe to be put into the path as is
+            conditions = [f'@.{key} == "{value}"' for key, value in element.items()]
+            conditions.append(f'@.quantity >= {min_quantity}')
+            queryset = queryset.filter(order_items__path_exists=f'$[*] ? ({" && ".join(conditions)})')
+        return queryset
@@ -0,0 +1,167 @@
+"""
+Idempotency keys of POST /api/v1/orders/: a client sends a unique Idempotency-Key header with an order and could
+retry the request safely. The first request creates the order, the repeated ones get the stored response
+(with Idempotent-Replayed: true header) without validating the order and inserting it again.
+
+Keys are stored in IdempotencyKey table with a unique index on the key. The key row is inserted
+(INSERT ... ON CONFLICT DO NOTHING) in the transaction the order is created in and its response is written before
+the commit, so of concurrent requests with the same key exactly one creates the order: the others wait on the unique
+index until it is committed and read the stored response (or take the key over, if it was rolled back).
+Only successful responses are stored, failed requests could be retried with the same key.
+
+Keys expire after ORDERS_IDEMPOTENCY['TTL'] seconds: an expired key is taken over by the next request with it and
+purge_idempotency_keys command deletes expired rows. Stored responses are also kept in an in-process LRU cache
+in front of the table (CACHE_SIZE entries for CACHE_TTL seconds, CACHE_SIZE = 0 disables it).
+"""
+import hashlib
+import threading
+from datetime import timedelta
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from pizza_ordering import fastjson
+from pizza_ordering.cache import MISSING, LRUCache
+from pizza_ordering.models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+DEFAULT_SETTINGS = {
+    'TTL': 24 * 3600,
+    'CACHE_SIZE': 10000,
+    'CACHE_TTL': 300,
+}
+
+PURGE_BATCH_SIZE = 10000
+
+
+def get_settings() -> Dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ORDERS_IDEMPOTENCY', {})}
+
+
+_front_cache = MISSING
+_front_cache_lock = threading.Lock()
+
+
+def get_front_cache() -> Optional[LRUCache]:
+    """
+    In-process cache of stored responses by key or None if it's disabled.
+    """
+    global _front_cache
+    if _front_cache is MISSING:
+        with _front_cache_lock:
+            if _front_cache is MISSING:
+                options = get_settings()
+                _front_cache = (LRUCache(max_size=options['CACHE_SIZE'], ttl=min(options['CACHE_TTL'], options['TTL']))
+                                if options['CACHE_SIZE'] else None)
+    return _front_cache
+
+
+@receiver(setting_changed)
+def reset_front_cache(setting, **kwargs):
+    global _front_cache
+    if setting == 'ORDERS_IDEMPOTENCY':
+        _front_cache = MISSING
+
+
+def request_fingerprint(request) -> str:
+    """
+    sha256 of the request body. Should be called before request.data is accessed.
+    """
+    return hashlib.sha256(request.body).hexdigest()
+
+
+def acquire_key(key: str, fingerprint: str, ttl: float) -> bool:
+    """
+    Inserts the key row or takes over the expired one. Returns False, if the key is already used: a concurrent
+    request with the same key waits here until the transaction, which inserted it, is finished.
+    Should be called in a transaction.
+    """
+    table = connection.ops.quote_name(IdempotencyKey._meta.db_table)
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {table} ("key", fingerprint, created_at) VALUES (%(key)s, %(fingerprint)s, %(now)s)
+            ON CONFLICT ("key") DO UPDATE
+                SET fingerprint = EXCLUDED.fingerprint, created_at = EXCLUDED.created_at,
+                    status_code = NULL, response = NULL
+                WHERE {table}.created_at < %(expired_before)s
+            RETURNING id
+        """, {'key': key, 'fingerprint': fingerprint, 'now': now, 'expired_before': now - timedelta(seconds=ttl)})
+        return cursor.fetchone() is not None
+
+
+def stored_response(key: str) -> Optional[Dict]:
+    return (IdempotencyKey.objects.filter(key=key, status_code__isnull=False)
+            .values('fingerprint', 'status_code', 'response').first())
+
+
+def replay(stored: Dict, fingerprint: str) -> Response:
+    if stored['fingerprint'] != fingerprint:
+        return Response({'detail': "Idempotency-Key has already been used with another request."},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return Response(fastjson.loads(stored['response']), status=stored['status_code'],
+                    headers={REPLAYED_HEADER: 'true'})
+
+
+def idempotent_response(request, key: str, handler: Callable[[], Response]) -> Response:
+    """
+    Response of the handler for the first request with the key, the stored response for the repeated ones.
+    """
+    if not key or len(key) > IdempotencyKey.MAX_KEY_LENGTH:
+        return Response({'detail': f"Idempotency-Key should be 1 to {IdempotencyKey.MAX_KEY_LENGTH} characters long."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    fingerprint = request_fingerprint(request)
+    front_cache = get_front_cache()
+    stored = front_cache.get(key) if front_cache is not None else None
+    if stored is not None:
+        return replay(stored, fingerprint)
+
+    options = get_settings()
+    # the key row could be purged between the failed insert and the read, then the key is acquired again
+    while stored is None:
+        with transaction.atomic():
+            if acquire_key(key, fingerprint, options['TTL']):
+                response = handler()
+                if not status.is_success(response.status_code):
+                    # the key is released
+                    transaction.set_rollback(True)
+                    return response
+                stored = {'fingerprint': fingerprint, 'status_code': response.status_code,
+                          'response': fastjson.dumps(response.data).decode('utf-8')}
+                IdempotencyKey.objects.filter(key=key).update(status_code=stored['status_code'],
+                                                              response=stored['response'])
+                if front_cache is not None:
+                    transaction.on_commit(lambda: front_cache.set(key, stored))
+                return response
+        stored = stored_response(key)
+
+    if front_cache is not None:
+        front_cache.set(key, stored)
+    return replay(stored, fingerprint)
+
+
+def purge_expired_keys(batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """
+    Deletes expired keys in batches (short transactions, which don't hold many row locks). Returns their number.
+    """
+    table = connection.ops.quote_name(IdempotencyKey._meta.db_table)
+    expired_before = timezone.now() - timedelta(seconds=get_settings()['TTL'])
+    deleted = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"""
+                DELETE FROM {table} WHERE id IN (
+                    SELECT id FROM {table} WHERE created_at < %s ORDER BY created_at LIMIT %s)
+            """, [expired_before, batch_size])
+            deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
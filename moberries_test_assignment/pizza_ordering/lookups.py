@@ -0,0 +1,18 @@
+from django.contrib.postgres.fields import JSONField
+from django.db.models import Lookup
+
+
+@JSONField.register_lookup
+class JSONPathExists(Lookup):
+    """
+    `jsonb @? jsonpath` lookup: checks that JSON path returns any item for the value.
+    Could be served by GIN (jsonb_path_ops) index for equality conditions of the path.
+    """
+    lookup_name = 'path_exists'
+    # path is passed as is, not as a JSON document
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} @? {rhs}::jsonpath", lhs_params + rhs_params
@@ -0,0 +1,79 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+
+from pizza_ordering.customers import SummaryChanges
+from pizza_ordering.models import Order, OutboxEvent
+from pizza_ordering.views import OrderViewSet
+
+
+def delete_orders(ids):
+    """
+    Deletes the orders created by the benchmark with everything the API has written for them.
+    """
+    with transaction.atomic():
+        orders = Order.objects.filter(id__in=ids)
+        # the orders were counted in the customer summaries by the API
+        summary_changes = SummaryChanges()
+        for order in orders.select_for_update():
+            summary_changes.remove(order)
+        orders.delete()
+        summary_changes.save()
+        OutboxEvent.objects.filter(order_id__in=ids).delete()
+
+
+class Command(BaseCommand):
+    """
+    Compares throughput of creating orders one by one via POST /api/v1/orders/ and via POST /api/v1/orders/bulk/.
+    Requests run in autocommit like real ones, so every single POST pays for its own commit. The created orders
+    are deleted at the end, along with their outbox events and changes of customer summaries.
+    """
+    help = "Benchmark single vs bulk orders creation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000, help="Number of orders to create")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        count = options['orders']
+        orders = [{"customer_email": f"customer{i}@example.com",
+                   "order_items": [{"flavour": Order.ITEM_FLAVOURS[i % len(Order.ITEM_FLAVOURS)],
+                                    "quantity": 1 + i % 3,
+                                    "size": Order.ITEM_SIZES[i % len(Order.ITEM_SIZES)]}]}
+                  for i in range(count)]
+        factory = APIRequestFactory(HTTP_HOST='localhost')
+        ids = []
+
+        try:
+            create_view = OrderViewSet.as_view({'post': 'create'})
+            started = time.perf_counter()
+            for order in orders:
+                response = create_view(factory.post('/api/v1/orders/', order, format='json'))
+                assert response.status_code == 201, response.data
+                ids.append(response.data['id'])
+            single_elapsed = time.perf_counter() - started
+
+            bulk_view = OrderViewSet.as_view({'post': 'bulk'})
+            started = time.perf_counter()
+            response = bulk_view(factory.post('/api/v1/orders/bulk/', orders, format='json'))
+            assert response.status_code == 201, response.data
+            bulk_elapsed = time.perf_counter() - started
+            ids.extend(item['id'] for item in response.data['created'])
+        finally:
+            delete_orders(ids)
+
+        results = {'orders': count,
+                   'single_orders_per_sec': round(count / single_elapsed, 1),
+                   'bulk_orders_per_sec': round(count / bulk_elapsed, 1),
+                   'speedup': round(single_elapsed / bulk_elapsed, 1)}
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"orders: {count}")
+        self.stdout.write(f"single POST: {results['single_orders_per_sec']} orders/sec")
+        self.stdout.write(f"bulk POST:   {results['bulk_orders_per_sec']} orders/sec "
+                          f"(x{results['speedup']})")
@@ -0,0 +1,103 @@
+import json
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from pizza_ordering.benchmarking import seed_orders, summarize
+from pizza_ordering.claims import claim_orders
+from pizza_ordering.models import Order
+
+STATION_PREFIX = 'benchmark-station-'
+
+
+def run_station(index, options):
+    """
+    Claims batches of orders as station `index` until the deadline, "baking" every batch for `work` milliseconds.
+    Runs in a forked process: the database connection inherited from the parent must not be used.
+    """
+    connection.close()
+    ids, timings, empty = [], [], 0
+    deadline = time.monotonic() + options['duration']
+    try:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            with transaction.atomic():
+                claimed, _ = claim_orders(f'{STATION_PREFIX}{index}', options['batch'], options['duration'] + 60)
+            timings.append((time.perf_counter() - started) * 1000)
+            ids.extend(claimed)
+            empty += not claimed
+            time.sleep(options['work'] / 1000)
+    finally:
+        connection.close()
+    return ids, timings, empty
+
+
+class Command(BaseCommand):
+    """
+    Multi-process stress test of POST /api/v1/orders/claim/: for every number of stations `stations` processes
+    claim batches of not_in_delivery orders concurrently for `duration` seconds, spending `work` milliseconds on
+    every batch (the kitchen). Reports claimed orders per second, the speedup against the first round, claim latency
+    and the number of orders handed out twice (must be 0):
+
+        python3 ./manage.py benchmark_claims --seed 100000 --stations 1,2,4,8
+
+    Claims of every round are released after it.
+    """
+    help = "Stress test concurrent kitchen claims with several processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Number of orders to generate before benchmarking (a fifth are not_in_delivery)")
+        parser.add_argument('--stations', default='1,2,4,8', help="Comma separated numbers of concurrent stations")
+        parser.add_argument('--duration', type=float, default=5, help="Seconds every round runs")
+        parser.add_argument('--batch', type=int, default=10, help="Orders per claim")
+        parser.add_argument('--work', type=float, default=20, help="Milliseconds a station spends on a batch")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        stations = [int(number) for number in options['stations'].split(',') if number]
+        if not stations or min(stations) < 1:
+            raise CommandError("--stations must be positive numbers")
+        if options['seed']:
+            seed_orders(options['seed'])
+
+        results = []
+        for number in stations:
+            self.release_claims()
+            # forked processes must not share the connection of the parent
+            connection.close()
+            with multiprocessing.get_context('fork').Pool(number) as pool:
+                outcomes = pool.starmap(run_station, [(index, options) for index in range(number)])
+            self.release_claims()
+
+            ids = [order_id for station_ids, _, _ in outcomes for order_id in station_ids]
+            timings = [timing for _, station_timings, _ in outcomes for timing in station_timings]
+            result = dict(summarize(timings), stations=number, orders=len(ids), duplicates=len(ids) - len(set(ids)),
+                          empty_claims=sum(empty for _, _, empty in outcomes),
+                          orders_per_second=round(len(ids) / options['duration'], 1))
+            result['speedup'] = round(result['orders_per_second'] / (results or [result])[0]['orders_per_second'], 2)
+            results.append(result)
+
+        report = {'queue': Order.objects.filter(delivery_status='not_in_delivery').count(),
+                  'batch': options['batch'], 'work_ms': options['work'], 'results': results}
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"not_in_delivery orders: {report['queue']}, batch: {report['batch']}, "
+                              f"work per batch: {report['work_ms']} ms")
+            self.stdout.write(f"{'stations':>8}{'orders/s':>10}{'speedup':>9}{'p50 ms':>9}{'p95 ms':>9}"
+                              f"{'p99 ms':>9}{'empty':>7}{'duplicates':>12}")
+            for result in results:
+                self.stdout.write(f"{result['stations']:>8}{result['orders_per_second']:>10}{result['speedup']:>9}"
+                                  f"{result['p50']:>9}{result['p95']:>9}{result['p99']:>9}"
+                                  f"{result['empty_claims']:>7}{result['duplicates']:>12}")
+
+        duplicates = sum(result['duplicates'] for result in results)
+        if duplicates:
+            raise CommandError(f"{duplicates} orders were claimed by more than one station")
+
+    @staticmethod
+    def release_claims():
+        Order.objects.filter(claimed_by__startswith=STATION_PREFIX).update(claimed_by=None, claim_expires_at=None)
@@ -0,0 +1,76 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from pizza_ordering.benchmarking import measure, seed_orders, summarize
+from pizza_ordering.metrics import clear_metrics
+from pizza_ordering.models import Order
+
+
+class Command(BaseCommand):
+    """
+    Measures overhead of the orders API instrumentation (ORDERS_METRICS): the same requests are sent through the whole
+    Django stack (test client) with metrics disabled and enabled in alternating rounds, so both see the same state
+    of caches and the database.
+    """
+    help = "Benchmark overhead of ORDERS_METRICS instrumentation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Number of orders to generate before benchmarking (default: use existing orders)")
+        parser.add_argument('--rounds', type=int, default=10, help="Number of disabled/enabled rounds")
+        parser.add_argument('--repeat', type=int, default=50, help="Requests per scenario in a round")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            seed_orders(options['seed'])
+
+        client = Client(HTTP_HOST='localhost')
+        order = Order.objects.order_by('-created_at', '-id').first()
+
+        def list_request(params):
+            def call():
+                response = client.get('/api/v1/orders/', params)
+                assert response.status_code == 200, response.status_code
+            return call
+
+        def retrieve():
+            response = client.get(f'/api/v1/orders/{order.id}/')
+            assert response.status_code == 200, response.status_code
+
+        # the cached retrieve is the cheapest request, so it shows the biggest relative overhead
+        scenarios = {
+            'list': ({'BACKEND': None}, list_request({'limit': 10, 'count': 'none'})),
+            'list_100_customer': ({'BACKEND': None},
+                                  list_request({'limit': 100, 'customer_email': order.customer_email})),
+            'retrieve': ({'BACKEND': None}, retrieve),
+            'retrieve_cached': ({'BACKEND': 'lru', 'TTL': 3600, 'MAX_SIZE': 100}, retrieve),
+        }
+
+        timings = {(name, enabled): [] for name in scenarios for enabled in (False, True)}
+        for _ in range(options['rounds']):
+            for name, (cache, call) in scenarios.items():
+                for enabled in (False, True):
+                    with override_settings(ORDERS_CACHE=cache, ORDERS_METRICS={'ENABLED': enabled},
+                                           ALLOWED_HOSTS=['localhost']):
+                        timings[name, enabled].extend(measure(call, options['repeat']))
+        clear_metrics()
+
+        results = []
+        for name in scenarios:
+            disabled, enabled = summarize(timings[name, False]), summarize(timings[name, True])
+            results.append({'scenario': name, 'disabled': disabled, 'enabled': enabled,
+                            'overhead_percent': round((enabled['mean'] / disabled['mean'] - 1) * 100, 2)})
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'scenario':<20}{'off p50 ms':>12}{'on p50 ms':>12}{'off mean ms':>13}{'on mean ms':>12}"
+                          f"{'overhead %':>12}")
+        for result in results:
+            self.stdout.write(f"{result['scenario']:<20}{result['disabled']['p50']:>12}{result['enabled']['p50']:>12}"
+                              f"{result['disabled']['mean']:>13}{result['enabled']['mean']:>12}"
+                              f"{result['overhead_percent']:>12}")
@@ -0,0 +1,71 @@
+import itertools
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from pizza_ordering.models import Order
+from pizza_ordering.serializers import DEDUPLICATE_KEEP_FIRST, DEDUPLICATE_SUM, OrderSerializer, merge_order_items
+from pizza_ordering.validators import order_items_validator
+
+
+def generate_order_items(count: int):
+    """
+    Generates `count` valid order items cycling through all the flavours and sizes.
+    """
+    return [{"flavour": Order.ITEM_FLAVOURS[i % len(Order.ITEM_FLAVOURS)],
+             "quantity": 1 + i % 5,
+             "size": Order.ITEM_SIZES[(i // len(Order.ITEM_FLAVOURS)) % len(Order.ITEM_SIZES)]}
+            for i in range(count)]
+
+
+def sort_and_group(order_items):
+    """
+    Reference sort + groupby deduplication, the way it was done before merge_order_items.
+    """
+    def keyfunc(item):
+        return item['flavour'], item['size']
+    return [next(group) for _, group in itertools.groupby(sorted(order_items, key=keyfunc), key=keyfunc)]
+
+
+class Command(BaseCommand):
+    """
+    Micro-benchmark of order_items processing: per-item cost of validation, of deduplication (compared to
+    sort + groupby) and of the whole OrderSerializer.validate_order_items for orders of different sizes.
+    Generated orders consist of duplicates mostly, since there are only flavours * sizes distinct items.
+    """
+    help = "Micro-benchmark of order_items validation and deduplication"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,1000', help="Comma separated list of order sizes (items)")
+        parser.add_argument('--items', type=int, default=200000,
+                            help="Approximate number of items processed per measurement")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        serializer = OrderSerializer()
+        results = []
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            order_items = generate_order_items(size)
+            number = max(1, options['items'] // size)
+            benchmarks = (
+                ('validate', lambda: order_items_validator(order_items)),
+                ('deduplicate_sort_groupby', lambda: sort_and_group(order_items)),
+                ('deduplicate_keep_first', lambda: merge_order_items(order_items, DEDUPLICATE_KEEP_FIRST)),
+                ('deduplicate_sum', lambda: merge_order_items(order_items, DEDUPLICATE_SUM)),
+                ('validate_and_deduplicate', lambda: serializer.validate_order_items(order_items)),
+            )
+            for name, func in benchmarks:
+                # best of 3 runs
+                elapsed = min(timeit.repeat(func, number=number, repeat=3))
+                results.append({'benchmark': name,
+                                'order_size': size,
+                                'ns_per_item': round(elapsed / (number * size) * 1e9, 1)})
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'benchmark':<28}{'items':>8}{'ns/item':>12}")
+        for result in results:
+            self.stdout.write(f"{result['benchmark']:<28}{result['order_size']:>8}{result['ns_per_item']:>12}")
@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+
+from pizza_ordering.benchmarking import SUITE_ORDER_ITEMS, SUITE_URL, OutboxStandIn, summarize
+from pizza_ordering.customers import SummaryChanges
+from pizza_ordering.models import Order, OutboxEvent
+from pizza_ordering.outbox import HttpDelivery, dispatch_batch, get_settings, pending_count
+
+# every order gets created and changes delivery_status twice: three events per destination
+STATUS_CHANGES = ['ready_for_delivery', 'dispatched']
+DESTINATIONS = ('delivery_partner', 'notifications')
+
+
+def produce(options, ids, timings):
+    """
+    Creates orders and changes their delivery_status through the API at `rate` orders per second (as fast as possible,
+    when it's 0), recording latencies of the create requests. Runs in its own thread with its own connection.
+    """
+    client = Client(HTTP_HOST='localhost')
+    started = time.monotonic()
+    try:
+        for number in range(options['orders']):
+            if options['rate']:
+                time.sleep(max(0, started + number / options['rate'] - time.monotonic()))
+            request_started = time.perf_counter()
+            response = client.post(SUITE_URL, {'customer_email': f'outbox{number}@example.com',
+                                               'order_items': SUITE_ORDER_ITEMS}, content_type='application/json')
+            timings.append((time.perf_counter() - request_started) * 1000)
+            ids.append(response.json()['id'])
+            for status in STATUS_CHANGES:
+                client.patch(f'{SUITE_URL}{ids[-1]}/', {'delivery_status': status}, content_type='application/json')
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    """
+    Benchmark of the order events outbox against a local HTTP stand-in of the external services (answering after
+    `latency` milliseconds, `fail-rate` of the requests with 503). For every number of dispatcher workers, `orders`
+    orders are created and moved through two delivery_status changes with the API (at `rate` orders per second,
+    or all of them before dispatching with --rate 0) while the dispatcher delivers their events to two destinations.
+    Reports delivered events per second, retries, end-to-end lag (from the order change to its delivery) percentiles,
+    latency of the create requests and the events delivered out of order or twice (must be 0):
+
+        python3 ./manage.py benchmark_outbox --orders 1000 --rate 0 --workers 1,4,16 --latency 20
+
+    Orders of every round are deleted after it.
+    """
+    help = "Benchmark dispatching of outbox events against a local HTTP stand-in"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500, help="Orders created in every round")
+        parser.add_argument('--rate', type=float, default=0,
+                            help="Orders created per second while dispatching (0: create all of them before)")
+        parser.add_argument('--workers', default='1,4,16', help="Comma separated numbers of dispatcher workers")
+        parser.add_argument('--batch-size', type=int, default=get_settings()['BATCH_SIZE'], help="Events per batch")
+        parser.add_argument('--latency', type=float, default=20, help="Milliseconds the stand-in takes per event")
+        parser.add_argument('--fail-rate', type=float, default=0.02, help="Share of events answered with 503")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        workers = [int(number) for number in options['workers'].split(',') if number]
+        if not workers or min(workers) < 1:
+            raise CommandError("--workers must be positive numbers")
+        if pending_count():
+            raise CommandError("The outbox must be empty: the benchmark would deliver the pending events too")
+
+        results = []
+        for number in workers:
+            results.append(self.run_round(number, options))
+
+        report = {'orders': options['orders'], 'rate': options['rate'], 'batch_size': options['batch_size'],
+                  'latency_ms': options['latency'], 'fail_rate': options['fail_rate'], 'results': results}
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"orders: {report['orders']}, rate: {report['rate'] or 'all at once'}, "
+                              f"batch: {report['batch_size']}, stand-in latency: {report['latency_ms']} ms, "
+                              f"fail rate: {report['fail_rate']}")
+            self.stdout.write(f"{'workers':>7}{'events':>8}{'events/s':>10}{'retries':>9}"
+                              f"{'lag p50':>11}{'lag p95':>11}{'lag max':>11}{'create p50':>12}"
+                              f"{'out of order':>14}{'duplicates':>12}")
+            for result in results:
+                self.stdout.write(f"{result['workers']:>7}{result['delivered']:>8}{result['events_per_second']:>10}"
+                                  f"{result['retried']:>9}{result['lag_ms']['p50']:>11}{result['lag_ms']['p95']:>11}"
+                                  f"{result['lag_ms']['max']:>11}{result['create_ms']['p50']:>12}"
+                                  f"{result['out_of_order']:>14}{result['duplicates']:>12}")
+
+        out_of_order = sum(result['out_of_order'] for result in results)
+        if out_of_order:
+            raise CommandError(f"{out_of_order} events were delivered out of order")
+
+    def run_round(self, workers, options):
+        stand_in = OutboxStandIn(latency=options['latency'] / 1000, fail_rate=options['fail_rate']).start()
+        outbox = dict(get_settings(), DESTINATIONS={name: f'{stand_in.url}/{name}' for name in DESTINATIONS},
+                      BATCH_SIZE=options['batch_size'], WORKERS=workers, BACKOFF=0.05, MAX_BACKOFF=1)
+        ids, timings = [], []
+        totals = {'delivered': 0, 'retried': 0, 'failed': 0, 'lags': []}
+        try:
+            with override_settings(ALLOWED_HOSTS=['localhost'], DEBUG=False, ORDERS_OUTBOX=outbox), \
+                    ThreadPoolExecutor(max_workers=workers) as executor:
+                producer = threading.Thread(target=produce, args=(options, ids, timings))
+                producer.start()
+                if not options['rate']:
+                    producer.join()
+                delivery = HttpDelivery(outbox['DESTINATIONS'], outbox['TIMEOUT'])
+                started = time.monotonic()
+                while True:
+                    stats = dispatch_batch(delivery, executor, outbox)
+                    for key in ('delivered', 'retried', 'failed'):
+                        totals[key] += stats[key]
+                    totals['lags'].extend(stats['lags'])
+                    if not stats['fetched']:
+                        if not producer.is_alive() and not pending_count():
+                            break
+                        time.sleep(0.005)
+                elapsed = time.monotonic() - started
+        finally:
+            stand_in.stop()
+            with transaction.atomic():
+                orders = Order.objects.filter(id__in=ids)
+                # the orders were counted in the customer summaries by the API
+                summary_changes = SummaryChanges()
+                for order in orders.select_for_update():
+                    summary_changes.remove(order)
+                orders.delete()
+                summary_changes.save()
+                OutboxEvent.objects.filter(order_id__in=ids).delete()
+
+        expected = len(ids) * (1 + len(STATUS_CHANGES)) * len(DESTINATIONS)
+        if totals['delivered'] + totals['failed'] != expected:
+            raise CommandError(f"{expected} events expected, "
+                               f"{totals['delivered']} delivered, {totals['failed']} failed")
+        return {'workers': workers, 'delivered': totals['delivered'], 'retried': totals['retried'],
+                'failed': totals['failed'], 'events_per_second': round(totals['delivered'] / elapsed, 1),
+                'lag_ms': summarize(totals['lags']), 'create_ms': summarize(timings),
+                'out_of_order': stand_in.out_of_order, 'duplicates': stand_in.duplicates}
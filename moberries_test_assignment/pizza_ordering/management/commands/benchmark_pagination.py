@@ -0,0 +1,76 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from pizza_ordering.benchmarking import measure, seed_orders, summarize
+from pizza_ordering.models import Order
+from pizza_ordering.pagination import NEXT, OrderPagination
+from pizza_ordering.views import OrderViewSet
+
+
+class Command(BaseCommand):
+    """
+    Compares latency of limit/offset and cursor pagination of GET /api/v1/orders/ at different page depths.
+    """
+    help = "Benchmark offset vs cursor pagination of the orders list"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Number of orders to generate before benchmarking (default: use existing orders)")
+        parser.add_argument('--depths', default='0,1000,10000,100000',
+                            help="Comma separated list of page offsets to measure")
+        parser.add_argument('--limit', type=int, default=10, help="Page size")
+        parser.add_argument('--repeat', type=int, default=20, help="Requests per measurement")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        # measure database access, not the orders cache
+        with override_settings(ORDERS_CACHE={'BACKEND': None}):
+            self.benchmark(options)
+
+    def benchmark(self, options):
+        if options['seed']:
+            seed_orders(options['seed'])
+
+        factory = APIRequestFactory(HTTP_HOST='localhost')
+        view = OrderViewSet.as_view({'get': 'list'})
+        queryset = Order.objects.order_by(*OrderPagination.ordering)
+        total = queryset.count()
+        limit = options['limit']
+
+        def request(params):
+            def call():
+                response = view(factory.get('/api/v1/orders/', params))
+                assert response.status_code == 200, response.status_code
+            return call
+
+        results = []
+        for depth in [int(depth) for depth in options['depths'].split(',')]:
+            if depth >= total:
+                continue
+            scenarios = {
+                'offset': {'limit': limit, 'offset': depth},
+                'offset_estimated_count': {'limit': limit, 'offset': depth, 'count': 'estimate'},
+            }
+            # cursor pointing right before the row at `depth` position
+            if depth:
+                previous_row = queryset[depth - 1]
+                scenarios['cursor'] = {'limit': limit, 'cursor': OrderPagination.encode_cursor(NEXT, previous_row)}
+            else:
+                scenarios['cursor'] = {'limit': limit, 'cursor': ''}
+
+            for name, params in scenarios.items():
+                stats = summarize(measure(request(params), options['repeat']))
+                results.append(dict(stats, scenario=name, depth=depth))
+
+        if options['json']:
+            self.stdout.write(json.dumps({'orders': total, 'limit': limit, 'results': results}, indent=2))
+            return
+
+        self.stdout.write(f"orders: {total}, page size: {limit}")
+        self.stdout.write(f"{'scenario':<24}{'depth':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for result in results:
+            self.stdout.write(f"{result['scenario']:<24}{result['depth']:>10}"
+                              f"{result['p50']:>10}{result['p95']:>10}{result['p99']:>10}")
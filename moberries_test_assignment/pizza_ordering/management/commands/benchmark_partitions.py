@@ -0,0 +1,105 @@
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from pizza_ordering.benchmarking import measure, seed_orders, summarize
+from pizza_ordering.models import Order
+from pizza_ordering.partitions import convert, is_partitioned, revert
+from pizza_ordering.views import OrderViewSet
+
+
+class Command(BaseCommand):
+    """
+    Compares latency of GET /api/v1/orders/ (list, filters) and GET /api/v1/orders/{id}/ on the plain and on
+    the partitioned orders table. Historical orders could be generated before benchmarking: they are spread over
+    the months before the last day, so the recent orders (the live traffic) stay as they are.
+    """
+    help = "Benchmark orders list and filters on the plain vs monthly partitioned orders table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, default=0,
+                            help="Number of historical orders to generate before benchmarking")
+        parser.add_argument('--months', type=int, default=24, help="Number of months historical orders are spread over")
+        parser.add_argument('--repeat', type=int, default=50, help="Requests per measurement")
+        parser.add_argument('--keep', action='store_true', help="Keep the orders table partitioned")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        if options['history']:
+            span = timedelta(days=30 * options['months'])
+            seed_orders(options['history'], before=timezone.now() - timedelta(days=1),
+                        step=span / options['history'])
+
+        # measure database access, not the orders cache. List ETag aggregates all the filtered orders, whatever
+        # the table is, so it is turned off as well
+        with override_settings(ORDERS_CACHE={'BACKEND': None}, ORDERS_LIST_ETAG=False):
+            results, conversion = self.benchmark(options)
+
+        total = Order.objects.count()
+        if options['json']:
+            self.stdout.write(json.dumps({'orders': total, 'conversion_ms': conversion, 'results': results},
+                                         indent=2))
+            return
+
+        self.stdout.write(f"orders: {total}, conversion: {conversion} ms")
+        self.stdout.write(f"{'scenario':<28}{'table':>14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for result in results:
+            self.stdout.write(f"{result['scenario']:<28}{result['table']:>14}"
+                              f"{result['p50']:>10}{result['p95']:>10}{result['p99']:>10}")
+
+    def benchmark(self, options):
+        factory = APIRequestFactory(HTTP_HOST='localhost')
+        list_view = OrderViewSet.as_view({'get': 'list'})
+        detail_view = OrderViewSet.as_view({'get': 'retrieve'})
+        recent = Order.objects.order_by('-created_at').values_list('id', 'customer_email').first()
+        if recent is None:
+            recent = (1, 'customer1@example.com')
+        # pages are fetched without COUNT(*), which reads all the filtered orders, except for the first scenario
+        scenarios = {
+            'list_exact_count': {'limit': 10},
+            'list': {'limit': 10, 'count': 'none'},
+            'list_cursor': {'limit': 10, 'cursor': '', 'count': 'none'},
+            'list_offset_1000': {'limit': 10, 'offset': 1000, 'count': 'none'},
+            'filter_status': {'limit': 10, 'delivery_status': 'not_in_delivery', 'count': 'none'},
+            'filter_status_estimate': {'limit': 10, 'delivery_status': 'delivered', 'count': 'estimate'},
+            'filter_customer': {'limit': 10, 'customer_email': recent[1], 'count': 'none'},
+            'filter_flavour': {'limit': 10, 'flavour': 'fungi', 'size': 'big', 'count': 'none'},
+        }
+
+        def request(params):
+            def call():
+                response = list_view(factory.get('/api/v1/orders/', params))
+                assert response.status_code == 200, response.status_code
+            return call
+
+        def retrieve():
+            response = detail_view(factory.get(f'/api/v1/orders/{recent[0]}/'), pk=recent[0])
+            assert response.status_code == 200, response.status_code
+
+        def run(table):
+            # the same visibility map and statistics for both tables: freshly copied rows aren't vacuumed yet
+            with connection.cursor() as cursor:
+                cursor.execute(f"VACUUM ANALYZE {Order._meta.db_table}")
+            for name, params in scenarios.items():
+                yield dict(summarize(measure(request(params), options['repeat'])), scenario=name, table=table)
+            yield dict(summarize(measure(retrieve, options['repeat'])), scenario='retrieve', table=table)
+
+        was_partitioned = is_partitioned()
+        results = []
+        if not was_partitioned:
+            results.extend(run('plain'))
+            started = time.perf_counter()
+            convert()
+            conversion = round((time.perf_counter() - started) * 1000)
+        else:
+            conversion = None
+        results.extend(run('partitioned'))
+        if not was_partitioned and not options['keep']:
+            revert()
+        return results, conversion
@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from pizza_ordering.benchmarking import measure, seed_orders, summarize
+from pizza_ordering.models import Order
+from pizza_ordering.renderers import FastJSONRenderer
+from pizza_ordering.serializers import ORDER_FIELDS, OrderSerializer, orders_to_dicts
+
+
+class Command(BaseCommand):
+    """
+    Compares serialization of orders lists: OrderSerializer + JSONRenderer vs .values() rows + FastJSONRenderer.
+    Every scenario is measured with fetching from the database and without it (serialization and rendering only).
+    """
+    help = "Benchmark OrderSerializer vs .values() serialization of orders lists"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Number of orders to generate before benchmarking (default: use existing orders)")
+        parser.add_argument('--sizes', default='10,100,1000', help="Comma separated list of page sizes")
+        parser.add_argument('--repeat', type=int, default=50, help="Runs per measurement")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            seed_orders(options['seed'])
+
+        queryset = Order.objects.order_by('-created_at', '-id')
+        json_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+        results = []
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            orders = list(queryset[:size])
+            rows = list(queryset.values(*ORDER_FIELDS)[:size])
+            scenarios = {
+                'serializer': lambda: json_renderer.render(OrderSerializer(list(queryset[:size]), many=True).data),
+                'values': lambda: fast_renderer.render(orders_to_dicts(queryset.values(*ORDER_FIELDS)[:size])),
+                'serializer_no_fetch': lambda: json_renderer.render(OrderSerializer(orders, many=True).data),
+                'values_no_fetch': lambda: fast_renderer.render(orders_to_dicts(rows)),
+            }
+            for name, func in scenarios.items():
+                stats = summarize(measure(func, options['repeat']))
+                results.append(dict(stats, scenario=name, rows=size))
+
+        if options['json']:
+            self.stdout.write(json.dumps({'results': results}, indent=2))
+            return
+
+        self.stdout.write(f"{'scenario':<24}{'rows':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for result in results:
+            self.stdout.write(f"{result['scenario']:<24}{result['rows']:>8}"
+                              f"{result['p50']:>10}{result['p95']:>10}{result['p99']:>10}")
@@ -0,0 +1,89 @@
+import json
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pizza_ordering.benchmarking import SUITE_ACTIONS, SUITE_OFFSETS, compare_results, run_suite, seed_orders
+from pizza_ordering.models import Order
+
+
+class Command(BaseCommand):
+    """
+    Benchmark suite of OrderViewSet actions: list (offsets, cursor, filters), retrieve, create, put, patch and delete.
+    Reports p50/p95/p99 latency and throughput of every scenario, measured with the orders cache disabled
+    (--cached adds read scenarios served from the cache, named *_cached). Results saved with --output could be passed
+    as --baseline to a later run, which then fails if any scenario got slower by more than --max-regression percent:
+
+        python3 ./manage.py benchmark_suite --seed 100000 --output baseline.json
+        python3 ./manage.py benchmark_suite --baseline baseline.json --max-regression 20
+
+    Created orders are deleted by the delete scenario, seeded ones stay in the database.
+    """
+    help = "Benchmark all the orders API actions and compare with a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Number of orders to generate before benchmarking (default: use existing orders)")
+        parser.add_argument('--active', type=int, default=None,
+                            help="Number of the newest seeded orders spread over statuses, the rest are delivered "
+                                 "(default: all seeded orders are spread over statuses)")
+        parser.add_argument('--repeat', type=int, default=50, help="Requests per scenario")
+        parser.add_argument('--actions', default=','.join(SUITE_ACTIONS),
+                            help="Comma separated actions to benchmark")
+        parser.add_argument('--offsets', default=','.join(map(str, SUITE_OFFSETS)),
+                            help="Comma separated offsets of the list scenarios")
+        parser.add_argument('--cached', action='store_true',
+                            help="Also benchmark read scenarios with the orders cache (ORDERS_CACHE setting)")
+        parser.add_argument('--output', help="File to save the results to (JSON)")
+        parser.add_argument('--baseline', help="Results of a previous run to compare with (JSON)")
+        parser.add_argument('--max-regression', type=float, default=20,
+                            help="Allowed slowdown against the baseline in percent")
+        parser.add_argument('--metric', default='p95', choices=['p50', 'p95', 'p99', 'mean'],
+                            help="Latency metric compared with the baseline")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        actions = [action for action in options['actions'].split(',') if action]
+        unknown = set(actions) - set(SUITE_ACTIONS)
+        if unknown:
+            raise CommandError(f"Unknown actions: {sorted(unknown)}. Must be some of: {list(SUITE_ACTIONS)}")
+        offsets = [int(offset) for offset in options['offsets'].split(',') if offset]
+
+        if options['seed']:
+            seed_orders(options['seed'], active=options['active'])
+
+        results = run_suite(options['repeat'], actions, offsets, cached=options['cached'])
+        report = {'orders': Order.objects.count(),
+                  'repeat': options['repeat'],
+                  'cache': settings.ORDERS_CACHE.get('BACKEND') if options['cached'] else None,
+                  'django': django.get_version(),
+                  'results': results}
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+        regressions = []
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = compare_results(results, json.load(baseline)['results'], options['max_regression'],
+                                              options['metric'])
+            report['regressions'] = regressions
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"orders: {report['orders']}, requests per scenario: {report['repeat']}, "
+                              f"cache: {report['cache']}")
+            self.stdout.write(f"{'scenario':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+            for result in results:
+                self.stdout.write(f"{result['scenario']:<20}{result['p50']:>10}{result['p95']:>10}"
+                                  f"{result['p99']:>10}{result['throughput']:>10}")
+            for regression in regressions:
+                self.stdout.write(f"regression: {regression['scenario']} {regression['metric']} "
+                                  f"{regression['baseline']} -> {regression['current']} ms "
+                                  f"(+{regression['change_percent']}%)")
+
+        if regressions:
+            raise CommandError(f"{len(regressions)} scenarios regressed by more than {options['max_regression']}%")
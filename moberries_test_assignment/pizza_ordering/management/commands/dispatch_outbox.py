@@ -0,0 +1,81 @@
+import json
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pizza_ordering.benchmarking import summarize
+from pizza_ordering.outbox import HttpDelivery, dispatch_batch, get_settings, pending_count
+
+
+class Command(BaseCommand):
+    """
+    Dispatcher of the order events outbox (see pizza_ordering.outbox): delivers events to ORDERS_OUTBOX['DESTINATIONS']
+    in batches with a pool of worker threads until stopped (SIGTERM, SIGINT) or, with --once, until there are no
+    due events. Every --report-interval seconds reports delivered events per second, retries, failures, pending events
+    and end-to-end lag (from the order change to the delivery) percentiles. Several dispatchers could run at once.
+    """
+    help = "Deliver outbox events of orders to the external services"
+
+    def add_arguments(self, parser):
+        options = get_settings()
+        parser.add_argument('--batch-size', type=int, default=options['BATCH_SIZE'], help="Events per batch")
+        parser.add_argument('--workers', type=int, default=options['WORKERS'], help="Concurrent deliveries")
+        parser.add_argument('--poll-interval', type=float, default=options['POLL_INTERVAL'],
+                            help="Seconds to wait when there are no due events")
+        parser.add_argument('--report-interval', type=float, default=60, help="Seconds between reports")
+        parser.add_argument('--once', action='store_true', help="Stop when there are no due events")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable reports")
+
+    def handle(self, *args, **options):
+        settings = dict(get_settings(), BATCH_SIZE=options['batch_size'], WORKERS=options['workers'])
+        if not settings['DESTINATIONS']:
+            raise CommandError("No destinations in ORDERS_OUTBOX['DESTINATIONS']")
+        try:
+            delivery = HttpDelivery(settings['DESTINATIONS'], settings['TIMEOUT'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        # the batch being delivered is finished before stopping
+        stopping = []
+        handlers = {signum: signal.signal(signum, lambda *args: stopping.append(True))
+                    for signum in (signal.SIGTERM, signal.SIGINT)}
+        totals = self.empty_totals()
+        try:
+            with ThreadPoolExecutor(max_workers=settings['WORKERS'], thread_name_prefix='outbox') as executor:
+                while not stopping:
+                    stats = dispatch_batch(delivery, executor, settings)
+                    for key in ('delivered', 'retried', 'failed'):
+                        totals[key] += stats[key]
+                    totals['lags'].extend(stats['lags'])
+                    if time.monotonic() - totals['started'] >= options['report_interval']:
+                        self.report(totals, options)
+                        totals = self.empty_totals()
+                    if not stats['fetched']:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll_interval'])
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        self.report(totals, options)
+
+    @staticmethod
+    def empty_totals():
+        return {'started': time.monotonic(), 'delivered': 0, 'retried': 0, 'failed': 0, 'lags': []}
+
+    def report(self, totals, options):
+        elapsed = time.monotonic() - totals['started']
+        report = {'delivered': totals['delivered'], 'retried': totals['retried'], 'failed': totals['failed'],
+                  'pending': pending_count(),
+                  'delivered_per_second': round(totals['delivered'] / elapsed, 1) if elapsed else 0,
+                  'lag_ms': {key: value for key, value in summarize(totals['lags']).items() if key != 'count'}
+                  if totals['lags'] else None}
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+            return
+        lag = report['lag_ms']
+        self.stdout.write(f"delivered: {report['delivered']} ({report['delivered_per_second']}/s), "
+                          f"retried: {report['retried']}, failed: {report['failed']}, pending: {report['pending']}"
+                          + (f", lag ms: p50 {lag['p50']}, p95 {lag['p95']}, max {lag['max']}" if lag else ''))
@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pizza_ordering.explain import explain_order_views, index_names, seed_plans_data
+
+
+class Command(BaseCommand):
+    """
+    Prints EXPLAIN ANALYZE summary of every statement issued by OrderViewSet actions and fails if any of them reads
+    the orders table with a sequential scan. Orders could be seeded for the run, they are rolled back afterwards.
+    """
+    help = "Check query plans of the orders API for sequential scans over the orders table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Number of orders to generate for the run (default: use existing orders)")
+        parser.add_argument('--active', type=int, default=None,
+                            help="Number of the newest seeded orders left not delivered (default: 2%% of --seed)")
+        parser.add_argument('--json', action='store_true', help="Output full plans")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed']:
+                seed_plans_data(options['seed'], options['active'])
+            results = explain_order_views()
+            transaction.set_rollback(True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.stdout.write(f"{'scenario':<22}{'ms':>10}  {'plan':<14}indexes")
+            for result in results:
+                plan = result['plan']
+                indexes = ', '.join(dict.fromkeys(index_names(plan))) or '-'
+                self.stdout.write(f"{result['scenario']:<22}{plan['Actual Total Time']:>10}  {plan['Node Type']:<14}"
+                                  f"{indexes}")
+                for relation in result['seq_scans']:
+                    self.stdout.write(f"    Seq Scan on {relation}: {result['sql']}")
+
+        seq_scans = [result['scenario'] for result in results if result['seq_scans']]
+        if seq_scans:
+            raise CommandError(f"Sequential scans over orders in: {', '.join(dict.fromkeys(seq_scans))}")
@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pizza_ordering.benchmarking import summarize
+
+STATUSES = ['ready_for_delivery', 'not_in_delivery']
+
+
+class Command(BaseCommand):
+    """
+    Load test of delivery_status streams against a running server: opens N concurrent watchers
+    of GET /api/v1/orders/events/, changes delivery_status of an order with PATCH requests and measures
+    how many of the changes reached every watcher and how fast. Watchers rejected by the server
+    (503, ORDERS_EVENTS['MAX_STREAMS']) are reported and not expected to receive the changes.
+    """
+    help = "Load test Server-Sent Events streams of delivery_status changes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help="Base URL of the running server")
+        parser.add_argument('--watchers', type=int, default=100, help="Number of concurrent streams")
+        parser.add_argument('--updates', type=int, default=50, help="Number of delivery_status changes")
+        parser.add_argument('--interval', type=float, default=0.05, help="Seconds between changes")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        base_url = options['url'].rstrip('/') + '/api/v1/orders/'
+        order = self.request('POST', base_url, {
+            'customer_email': 'loadtest@example.com',
+            'order_items': [{'flavour': 'margherita', 'quantity': 1, 'size': 'big'}]})
+
+        duration = options['updates'] * options['interval'] + 5
+        received = [{} for _ in range(options['watchers'])]
+        rejected = []
+        connected = threading.Barrier(options['watchers'] + 1, timeout=30)
+        watchers = [threading.Thread(target=self.watch, daemon=True,
+                                     args=(f"{base_url}events/?timeout={duration}&customer_email=loadtest@example.com",
+                                           received[index], connected, rejected))
+                    for index in range(options['watchers'])]
+        for watcher in watchers:
+            watcher.start()
+        try:
+            connected.wait()
+        except threading.BrokenBarrierError:
+            raise CommandError("Watchers failed to connect")
+
+        sent = {}
+        for number in range(options['updates']):
+            status = STATUSES[number % len(STATUSES)]
+            sent_at = time.monotonic()
+            updated = self.request('PATCH', f"{base_url}{order['id']}/", {'delivery_status': status})
+            sent[updated['updated_at']] = sent_at
+            time.sleep(options['interval'])
+
+        # give the last events time to arrive, then stop
+        time.sleep(1)
+        self.request('DELETE', f"{base_url}{order['id']}/")
+
+        latencies = [(received_at - sent[updated_at]) * 1000
+                     for events in received for updated_at, received_at in events.items() if updated_at in sent]
+        expected = len(sent) * (options['watchers'] - len(rejected))
+        results = dict(summarize(latencies) if latencies else {},
+                       watchers=options['watchers'], rejected=len(rejected), updates=len(sent),
+                       delivered=len(latencies), expected=expected)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"watchers: {results['watchers']} ({results['rejected']} rejected), "
+                          f"updates: {results['updates']}")
+        self.stdout.write(f"delivered: {results['delivered']}/{expected}")
+        if latencies:
+            self.stdout.write(f"latency ms: p50 {results['p50']}, p95 {results['p95']}, p99 {results['p99']}")
+
+    @staticmethod
+    def request(method, url, data=None):
+        body = json.dumps(data).encode('utf-8') if data is not None else None
+        request = urllib.request.Request(url, data=body, method=method, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            content = response.read()
+        return json.loads(content) if content else None
+
+    @staticmethod
+    def watch(url, received, connected, rejected):
+        """
+        Reads the stream and records receipt time of every event by updated_at of the order.
+        """
+        request = urllib.request.Request(url, headers={'Accept': 'text/event-stream'})
+        try:
+            stream = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as exc:
+            if exc.code != 503:
+                raise
+            rejected.append(url)
+            connected.wait()
+            return
+        with stream:
+            connected.wait()
+            for line in stream:
+                if line.startswith(b'data: '):
+                    received[json.loads(line[len(b'data: '):])['updated_at']] = time.monotonic()
@@ -0,0 +1,82 @@
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pizza_ordering.benchmarking import summarize
+
+
+class Command(BaseCommand):
+    """
+    HTTP load test of a running server: `concurrency` clients with keep-alive connections send GET requests
+    to the paths in a loop for `duration` seconds. Reports throughput (requests/sec) and latency percentiles,
+    so serving profiles could be compared, e.g. runserver vs gunicorn:
+
+        DJANGO_DEBUG=1 DB_CONN_MAX_AGE=0 python3 ./manage.py runserver 0.0.0.0:8000
+        DJANGO_DEBUG=0 DJANGO_ALLOWED_HOSTS=* gunicorn moberries_test_assignment.wsgi -c gunicorn.conf.py
+        python3 ./manage.py loadtest_http --url http://localhost:8000 --concurrency 16 --duration 20
+    """
+    help = "Load test a running server with concurrent GET requests"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help="Base URL of the running server")
+        parser.add_argument('--paths', default='/api/v1/orders/,/api/v1/orders/?offset=1000',
+                            help="Comma separated paths requested in turn")
+        parser.add_argument('--concurrency', type=int, default=16, help="Number of concurrent clients")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds to run")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError("Only http:// URLs are supported")
+        paths = options['paths'].split(',')
+        timings = [[] for _ in range(options['concurrency'])]
+        errors = [0] * options['concurrency']
+        deadline = time.monotonic() + options['duration']
+
+        def client(index):
+            connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            number = 0
+            while time.monotonic() < deadline:
+                path = paths[number % len(paths)]
+                number += 1
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers={'Accept': 'application/json'})
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status != 200:
+                        errors[index] += 1
+                        continue
+                except (OSError, http.client.HTTPException):
+                    errors[index] += 1
+                    connection.close()
+                    continue
+                timings[index].append((time.perf_counter() - started) * 1000)
+            connection.close()
+
+        started = time.monotonic()
+        clients = [threading.Thread(target=client, args=(index,)) for index in range(options['concurrency'])]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        all_timings = [timing for client_timings in timings for timing in client_timings]
+        if not all_timings:
+            raise CommandError(f"No successful requests ({sum(errors)} errors)")
+        results = dict(summarize(all_timings), errors=sum(errors), concurrency=options['concurrency'],
+                       requests_per_second=round(len(all_timings) / elapsed, 1))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"concurrency: {results['concurrency']}, requests: {results['count']}, "
+                          f"errors: {results['errors']}")
+        self.stdout.write(f"requests/sec: {results['requests_per_second']}")
+        self.stdout.write(f"latency ms: p50 {results['p50']}, p95 {results['p95']}, p99 {results['p99']}")
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import resource
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pizza_ordering.benchmarking import summarize
+
+
+class Command(BaseCommand):
+    """
+    Load test of a running server with many simultaneous slow clients: `clients` keep-alive connections are opened
+    (from one event loop) and each of them polls the paths in turn every `interval` seconds for `duration` seconds,
+    like mobile clients polling their order. Reports how many clients stayed connected, errors, throughput and
+    latency percentiles, so the WSGI and the ASGI entry points could be compared:
+
+        gunicorn moberries_test_assignment.wsgi -c gunicorn.conf.py
+        uvicorn moberries_test_assignment.asgi:application --port 8000 --no-access-log
+        python3 ./manage.py loadtest_pollers --url http://localhost:8000 --paths /api/v1/orders/1/ --clients 5000
+
+    Every connection needs a file descriptor on both sides: raise `ulimit -n` of the server and of the client.
+    """
+    help = "Load test a running server with many concurrent keep-alive pollers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help="Base URL of the running server")
+        parser.add_argument('--paths', default='/api/v1/orders/', help="Comma separated paths polled in turn")
+        parser.add_argument('--clients', type=int, default=1000, help="Number of simultaneous connections")
+        parser.add_argument('--interval', type=float, default=1, help="Seconds between requests of a client")
+        parser.add_argument('--duration', type=float, default=20, help="Seconds to run")
+        parser.add_argument('--ramp-up', type=float, default=5, help="Seconds to open all the connections in")
+        parser.add_argument('--timeout', type=float, default=30, help="Seconds to wait for a response")
+        parser.add_argument('--json', action='store_true', help="Output machine-readable results")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError("Only http:// URLs are supported")
+        # a descriptor per connection
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < options['clients'] + 100:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, options['clients'] + 100), hard))
+
+        timings, stats = asyncio.run(self.run(url.hostname, url.port or 80, options['paths'].split(','), options))
+        if not timings:
+            raise CommandError(f"No successful requests ({stats['errors']} errors)")
+        results = dict(summarize(timings), clients=options['clients'], **stats,
+                       requests_per_second=round(len(timings) / options['duration'], 1))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"clients: {results['clients']}, max connected: {results['max_connected']}, "
+                          f"requests: {results['count']}, errors: {results['errors']}, "
+                          f"connect errors: {results['connect_errors']}, reconnects: {results['reconnects']}")
+        self.stdout.write(f"requests/sec: {results['requests_per_second']}")
+        self.stdout.write(f"latency ms: p50 {results['p50']}, p95 {results['p95']}, p99 {results['p99']}, "
+                          f"max {results['max']}")
+
+    async def run(self, host, port, paths, options):
+        timings = []
+        stats = {'errors': 0, 'connect_errors': 0, 'reconnects': 0, 'max_connected': 0}
+        connected = 0
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + options['ramp_up'] + options['duration']
+        measure_from = loop.time() + options['ramp_up']
+
+        async def request(reader, writer, path):
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: application/json\r\n\r\n".encode())
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionError("Connection closed by the server")
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            return int(status_line.split()[1])
+
+        async def client(index):
+            nonlocal connected
+            await asyncio.sleep(options['ramp_up'] * index / options['clients'])
+            reader = writer = None
+            reused = False
+            number = index
+            while loop.time() < deadline:
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port),
+                                                                options['timeout'])
+                        reused = False
+                        connected += 1
+                        stats['max_connected'] = max(stats['max_connected'], connected)
+                    started = time.perf_counter()
+                    status = await asyncio.wait_for(request(reader, writer, paths[number % len(paths)]),
+                                                    options['timeout'])
+                    elapsed = (time.perf_counter() - started) * 1000
+                    number += 1
+                    reused = True
+                    if status != 200:
+                        stats['errors'] += 1
+                    elif loop.time() >= measure_from:
+                        timings.append(elapsed)
+                except ConnectionError:
+                    # the server closed the idle keep-alive connection: reconnect and send the request again,
+                    # as HTTP clients do
+                    if writer is None:
+                        stats['connect_errors'] += 1
+                    else:
+                        stats['reconnects' if reused else 'errors'] += 1
+                        writer.close()
+                        connected -= 1
+                        reader = writer = None
+                        if reused:
+                            continue
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    stats['errors' if writer is not None else 'connect_errors'] += 1
+                    if writer is not None:
+                        writer.close()
+                        connected -= 1
+                    reader = writer = None
+                await asyncio.sleep(options['interval'])
+            if writer is not None:
+                writer.close()
+                connected -= 1
+
+        await asyncio.gather(*(client(index) for index in range(options['clients'])))
+        return timings, stats
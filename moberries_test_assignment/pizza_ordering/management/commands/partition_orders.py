@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pizza_ordering.partitions import (ARCHIVE_SCHEMA, PARTITIONS_AHEAD, archive_partitions, convert,
+                                       create_partitions, is_partitioned, partitions, revert)
+
+
+class Command(BaseCommand):
+    """
+    Manages monthly partitions of the orders table:
+    - convert - replaces the plain orders table with the partitioned one (run it once, in a maintenance window);
+    - create - creates partitions for the next months (run it daily, e.g. from cron);
+    - archive - detaches partitions of old months and moves them to the archive schema (or drops them);
+    - revert - replaces the partitioned orders table with a plain one;
+    - list - prints the partitions.
+    """
+    help = "Manage monthly partitions of the orders table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['convert', 'create', 'archive', 'revert', 'list'])
+        parser.add_argument('--ahead', type=int, default=PARTITIONS_AHEAD,
+                            help="Number of months after the current one to create partitions for")
+        parser.add_argument('--older-than', type=int, default=12,
+                            help="Archive partitions of the months, which ended more than that many months ago")
+        parser.add_argument('--schema', default=ARCHIVE_SCHEMA, help="Schema to move archived partitions to")
+        parser.add_argument('--drop', action='store_true', help="Drop archived partitions instead of moving them")
+
+    def handle(self, *args, **options):
+        action = options['action']
+        started = time.perf_counter()
+        try:
+            if action == 'convert':
+                convert()
+                names = [name for name, _ in partitions()]
+            elif action == 'create':
+                if not is_partitioned():
+                    raise ValueError("Orders table isn't partitioned. Run convert first.")
+                names = create_partitions(ahead=options['ahead'])
+            elif action == 'archive':
+                names = archive_partitions(options['older_than'], drop=options['drop'], schema=options['schema'])
+            elif action == 'revert':
+                revert()
+                names = []
+            else:
+                names = [name for name, _ in partitions()] if is_partitioned() else []
+        except ValueError as e:
+            raise CommandError(e)
+
+        for name in names:
+            self.stdout.write(name)
+        if action != 'list':
+            elapsed = round((time.perf_counter() - started) * 1000)
+            self.stdout.write(f"{action}: {len(names)} partitions in {elapsed} ms")
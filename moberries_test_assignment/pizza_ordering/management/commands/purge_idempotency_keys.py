@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pizza_ordering.idempotency import PURGE_BATCH_SIZE, purge_expired_keys
+
+
+class Command(BaseCommand):
+    """
+    Deletes idempotency keys of POST /api/v1/orders/ older than ORDERS_IDEMPOTENCY['TTL'] seconds. Expired keys
+    are ignored by the API anyway, the command keeps the table small. Run it hourly, e.g. from cron.
+    """
+    help = "Delete expired idempotency keys"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE, help="Keys deleted per transaction")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        deleted = purge_expired_keys(options['batch_size'])
+        self.stdout.write(f"{deleted} expired keys deleted in {round((time.perf_counter() - started) * 1000)} ms")
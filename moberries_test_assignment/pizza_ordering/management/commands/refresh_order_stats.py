@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pizza_ordering.stats import refresh_summary
+
+
+class Command(BaseCommand):
+    """
+    Refreshes OrderStats summary of orders. Incremental refresh recomputes hours with orders changed since
+    the previous refresh, so it could be run every few minutes (e.g. from cron). Full refresh recomputes everything
+    and also reflects deleted orders, run it daily.
+    """
+    help = "Refresh hourly summary of orders used by GET /api/v1/orders/stats/"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Recompute all the hours")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        buckets = refresh_summary(full=options['full'])
+        elapsed = round((time.perf_counter() - started) * 1000)
+        if buckets is None:
+            self.stdout.write(f"full refresh done in {elapsed} ms")
+        else:
+            self.stdout.write(f"{buckets} hours refreshed in {elapsed} ms")
@@ -0,0 +1,379 @@
+"""
+Per-action cost of the orders API: number of SQL queries, time spent in the database, time spent rendering
+the response, response size and total latency of every request handled by OrderViewSet.
+
+Queries are counted with execute_wrapper() of every database alias (the primary and the replicas) around the view,
+so DEBUG query logging isn't needed.
+Numbers of a request are sent back in the Server-Timing header and collected into histograms, which are exposed
+in Prometheus text format at /metrics. Histograms are kept in memory of the worker process. In a multi-process
+deployment (gunicorn workers) every process saves a snapshot of its series into ORDERS_METRICS['MULTIPROCESS_DIR']
+from a background thread every SNAPSHOT_INTERVAL seconds (when they changed), and /metrics answered by any of them
+sums up the snapshots of all the processes. Snapshots of exited processes are folded into an archive, so counters
+don't go back when workers are restarted. The directory must be local to the host (one per container) and emptied
+on start (see run_prod.sh).
+Statements executed after the view returned (e.g. fetching from a server-side cursor of a streamed export) and
+rendering of streamed responses are not measured.
+"""
+import bisect
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+DEFAULT_SETTINGS = {
+    'ENABLED': False,
+    'SERVER_TIMING': True,
+    'MULTIPROCESS_DIR': None,
+    'SNAPSHOT_INTERVAL': 1,
+}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def get_settings() -> Dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ORDERS_METRICS', {})}
+
+
+class Metric:
+    """
+    Thread-safe set of labelled series of one metric.
+    """
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def format_labels(self, values: Tuple, extra: str = '') -> str:
+        pairs = [f'{label}="{value}"' for label, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def snapshot(self) -> List:
+        """
+        Series as a JSON-serializable list of [label values, value] pairs.
+        """
+        with self.lock:
+            return json.loads(json.dumps([[list(values), value] for values, value in self.series.items()]))
+
+    def collect(self, series: Dict = None) -> List[str]:
+        """
+        Lines of the metric in text exposition format for its series (or for the given ones).
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        if series is None:
+            with self.lock:
+                series = dict(self.series)
+        for values, value in sorted(series.items()):
+            lines.extend(self.collect_series(values, value))
+        return lines
+
+    def collect_series(self, values: Tuple, value) -> Iterable[str]:
+        raise NotImplementedError
+
+    def merge(self, value, other):
+        """
+        Sum of the values of the same series from two processes.
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, values: Tuple, amount: float = 1) -> None:
+        with self.lock:
+            self.series[values] = self.series.get(values, 0) + amount
+
+    def collect_series(self, values: Tuple, value) -> Iterable[str]:
+        yield f"{self.name}{self.format_labels(values)} {value}"
+
+    def merge(self, value, other):
+        return value + other
+
+
+class Histogram(Metric):
+    """
+    Histogram with fixed buckets. Series hold non-cumulative bucket counts (the last one is +Inf), sum and count.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...], buckets: Tuple[float, ...]):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, values: Tuple, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(values)
+            if series is None:
+                series = self.series[values] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect_series(self, values: Tuple, value) -> Iterable[str]:
+        counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            le = f'le="{bound}"'
+            yield f"{self.name}_bucket{self.format_labels(values, le)} {cumulative}"
+        yield f"{self.name}_sum{self.format_labels(values)} {round(total, 6)}"
+        yield f"{self.name}_count{self.format_labels(values)} {count}"
+
+    def merge(self, value, other):
+        return [[count + other_count for count, other_count in zip(value[0], other[0])],
+                value[1] + other[1], value[2] + other[2]]
+
+
+ACTION_LABELS = ('action', 'method')
+
+REQUESTS = Counter('orders_api_requests_total', "Requests by view action, method and status code.",
+                   ('action', 'method', 'status'))
+LATENCY = Histogram('orders_api_request_duration_seconds', "Time spent in the view including rendering.",
+                    ACTION_LABELS, LATENCY_BUCKETS)
+DB_LATENCY = Histogram('orders_api_db_duration_seconds', "Time spent executing SQL queries.",
+                       ACTION_LABELS, LATENCY_BUCKETS)
+DB_QUERIES = Histogram('orders_api_db_queries', "Number of SQL queries per request.", ACTION_LABELS, QUERIES_BUCKETS)
+RENDER_LATENCY = Histogram('orders_api_render_duration_seconds', "Time spent rendering the response body.",
+                           ACTION_LABELS, LATENCY_BUCKETS)
+RESPONSE_BYTES = Histogram('orders_api_response_bytes', "Size of the response body (not streamed ones).",
+                           ACTION_LABELS, BYTES_BUCKETS)
+METRICS = (REQUESTS, LATENCY, DB_LATENCY, DB_QUERIES, RENDER_LATENCY, RESPONSE_BYTES)
+
+
+SNAPSHOT_PREFIX = 'metrics-'
+ARCHIVE_NAME = 'archive.json'
+LOCK_NAME = 'lock'
+# snapshot files are named by pid and this token, so a reused pid doesn't overwrite a snapshot of an exited process
+PROCESS_TOKEN = uuid.uuid4().hex
+
+_snapshot_lock = threading.Lock()
+_snapshot_changed = threading.Event()
+# pid of the process, which runs the snapshot thread (forked processes start their own)
+_snapshot_thread_pid = None
+
+
+def render_metrics() -> str:
+    """
+    All the metrics in Prometheus text exposition format: of the current process or, with MULTIPROCESS_DIR,
+    summed up over all the processes.
+    """
+    directory = get_settings()['MULTIPROCESS_DIR']
+    if not directory:
+        return '\n'.join(line for metric in METRICS for line in metric.collect()) + '\n'
+    merged = merge_snapshots(collect_snapshots(directory))
+    return '\n'.join(line for metric in METRICS for line in metric.collect(merged[metric.name])) + '\n'
+
+
+def clear_metrics() -> None:
+    for metric in METRICS:
+        metric.clear()
+
+
+def process_snapshot() -> Dict[str, List]:
+    return {metric.name: metric.snapshot() for metric in METRICS}
+
+
+def merge_snapshots(snapshots: Iterable[Dict[str, List]]) -> Dict[str, Dict[Tuple, object]]:
+    """
+    Sums up snapshots of several processes into series of every metric.
+    """
+    merged = {metric.name: {} for metric in METRICS}
+    metrics = {metric.name: metric for metric in METRICS}
+    for snapshot in snapshots:
+        for name, pairs in snapshot.items():
+            if name not in metrics:
+                continue
+            series = merged[name]
+            for values, value in pairs:
+                values = tuple(values)
+                series[values] = metrics[name].merge(series[values], value) if values in series else value
+    return merged
+
+
+def write_json(path: str, data) -> None:
+    # readers never see a partially written file
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+def read_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def save_snapshot(directory: str) -> None:
+    """
+    Saves series of the current process into the directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    write_json(os.path.join(directory, f'{SNAPSHOT_PREFIX}{os.getpid()}-{PROCESS_TOKEN}.json'), process_snapshot())
+
+
+def save_snapshots() -> None:
+    """
+    Body of the snapshot thread: saves the snapshot every SNAPSHOT_INTERVAL seconds, if the series changed.
+    """
+    while True:
+        time.sleep(get_settings()['SNAPSHOT_INTERVAL'])
+        directory = get_settings()['MULTIPROCESS_DIR']
+        if directory and _snapshot_changed.is_set():
+            _snapshot_changed.clear()
+            try:
+                save_snapshot(directory)
+            except OSError:
+                # the next change retries
+                _snapshot_changed.set()
+
+
+def flush_snapshot() -> None:
+    """
+    Saves changes of the series not saved yet, e.g. when the process exits (see gunicorn.conf.py).
+    """
+    directory = get_settings()['MULTIPROCESS_DIR']
+    if directory and _snapshot_changed.is_set():
+        _snapshot_changed.clear()
+        save_snapshot(directory)
+
+
+def schedule_snapshot(options: Dict) -> None:
+    """
+    Marks the series changed and starts the snapshot thread of the process, when MULTIPROCESS_DIR is set.
+    """
+    global _snapshot_thread_pid
+    if not options['MULTIPROCESS_DIR']:
+        return
+    _snapshot_changed.set()
+    if _snapshot_thread_pid != os.getpid():
+        with _snapshot_lock:
+            if _snapshot_thread_pid != os.getpid():
+                _snapshot_thread_pid = os.getpid()
+                threading.Thread(target=save_snapshots, name='metrics-snapshot', daemon=True).start()
+
+
+def collect_snapshots(directory: str) -> List[Dict[str, List]]:
+    """
+    Fresh snapshot of the current process, saved snapshots of other processes and the archive. Snapshots
+    of exited processes are folded into the archive.
+    """
+    save_snapshot(directory)
+    with open(os.path.join(directory, LOCK_NAME), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_path = os.path.join(directory, ARCHIVE_NAME)
+        archive = read_json(archive_path) or {}
+        alive, exited = [], []
+        for name in sorted(os.listdir(directory)):
+            if not name.startswith(SNAPSHOT_PREFIX) or not name.endswith('.json'):
+                continue
+            path = os.path.join(directory, name)
+            snapshot = read_json(path)
+            if snapshot is not None:
+                pid = int(name[len(SNAPSHOT_PREFIX):].split('-', 1)[0])
+                (alive if is_alive(pid) else exited).append((path, snapshot))
+        if exited:
+            merged = merge_snapshots([archive] + [snapshot for _, snapshot in exited])
+            archive = {name: [[list(values), value] for values, value in series.items()]
+                       for name, series in merged.items()}
+            write_json(archive_path, archive)
+            for path, _ in exited:
+                os.unlink(path)
+    return [archive] + [snapshot for _, snapshot in alive]
+
+
+class QueryTimer:
+    """
+    execute_wrapper() of the database connections counting queries and time spent executing them.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.queries += 1
+
+
+def server_timing(timer: QueryTimer, render: float, total: float) -> str:
+    """
+    Server-Timing header value, durations are in milliseconds.
+    """
+    return (f'db;dur={timer.duration * 1000:.3f};desc="{timer.queries} queries", '
+            f'render;dur={render * 1000:.3f}, total;dur={total * 1000:.3f}')
+
+
+class MetricsMixin:
+    """
+    Measures requests handled by the view set, when ORDERS_METRICS['ENABLED'] setting is on.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        options = get_settings()
+        if not options['ENABLED']:
+            return super(MetricsMixin, self).dispatch(request, *args, **kwargs)
+
+        started = time.perf_counter()
+        timer = QueryTimer()
+        with ExitStack() as wrappers:
+            # reads of safe requests go to a replica
+            for db_connection in connections.all():
+                wrappers.enter_context(db_connection.execute_wrapper(timer))
+            response = super(MetricsMixin, self).dispatch(request, *args, **kwargs)
+            render = 0.0
+            if not response.streaming and hasattr(response, 'render') and not response.is_rendered:
+                render_started = time.perf_counter()
+                response.render()
+                render = time.perf_counter() - render_started
+        total = time.perf_counter() - started
+
+        labels = (getattr(self, 'action', None) or 'unknown', request.method)
+        REQUESTS.inc(labels + (str(response.status_code),))
+        LATENCY.observe(labels, total)
+        DB_LATENCY.observe(labels, timer.duration)
+        DB_QUERIES.observe(labels, timer.queries)
+        RENDER_LATENCY.observe(labels, render)
+        if not response.streaming:
+            RESPONSE_BYTES.observe(labels, len(response.content))
+        if options['SERVER_TIMING']:
+            response['Server-Timing'] = server_timing(timer, render, total)
+        schedule_snapshot(options)
+        return response
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.6 on 2026-10-17 17:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizza_ordering', '0002_order_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('flavour', models.PositiveSmallIntegerField(choices=[(0, 'margherita'), (1, 'hawaii'), (2, 'fungi'), (3, 'pepperoni'), (4, 'capricciosa')])),
+                ('size', models.PositiveSmallIntegerField(choices=[(0, 'big'), (1, 'small')])),
+                ('quantity', models.PositiveIntegerField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='pizza_ordering.Order')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['flavour', 'size'], name='order_item_flavour_size_idx'),
+        ),
+    ]
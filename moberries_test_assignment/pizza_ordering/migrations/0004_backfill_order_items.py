@@ -0,0 +1,58 @@
+import json
+
+from django.db import migrations
+
+# catalogue as of this migration. Codes are indexes in Order.ITEM_FLAVOURS and Order.ITEM_SIZES
+FLAVOUR_CODES = {flavour: code for code, flavour in
+                 enumerate(["margherita", "hawaii", "fungi", "pepperoni", "capricciosa"])}
+SIZE_CODES = {size: code for code, size in enumerate(["big", "small"])}
+
+CHUNK_SIZE = 2000
+
+
+def backfill_order_items(apps, schema_editor):
+    """
+    Creates OrderItem rows for every existing order. Orders are processed in chunks by id,
+    so neither the whole table nor all the items are loaded in memory at once.
+    """
+    Order = apps.get_model('pizza_ordering', 'Order')
+    OrderItem = apps.get_model('pizza_ordering', 'OrderItem')
+    db_alias = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        chunk = list(Order.objects.using(db_alias)
+                     .filter(id__gt=last_id, items__isnull=True)
+                     .order_by('id')
+                     .values_list('id', 'order_items')[:CHUNK_SIZE])
+        if not chunk:
+            break
+
+        rows = []
+        for order_id, order_items in chunk:
+            if isinstance(order_items, str):
+                order_items = json.loads(order_items)
+            for item in order_items or []:
+                try:
+                    rows.append(OrderItem(order_id=order_id,
+                                          flavour=FLAVOUR_CODES[item['flavour']],
+                                          size=SIZE_CODES[item['size']],
+                                          quantity=item['quantity']))
+                except (KeyError, TypeError):
+                    continue
+        OrderItem.objects.using(db_alias).bulk_create(rows, batch_size=CHUNK_SIZE)
+        last_id = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+    # every chunk is committed separately. Interrupted backfill could be resumed, since orders
+    # which already have items are skipped
+    atomic = False
+
+    dependencies = [
+        ('pizza_ordering', '0003_orderitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_items, migrations.RunPython.noop),
+    ]
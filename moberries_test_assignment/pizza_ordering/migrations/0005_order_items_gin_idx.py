@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-17 17:31
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizza_ordering', '0004_backfill_order_items'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['order_items'], name='order_items_path_ops_idx', opclasses=['jsonb_path_ops']),
+        ),
+    ]
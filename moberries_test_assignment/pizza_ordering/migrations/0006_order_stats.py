@@ -0,0 +1,42 @@
+# Generated by Django 2.2.6 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizza_ordering', '0005_order_items_gin_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStats',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('bucket', models.DateTimeField()),
+                ('delivery_status', models.CharField(max_length=20)),
+                ('flavour', models.CharField(max_length=50, null=True)),
+                ('size', models.CharField(max_length=50, null=True)),
+                ('orders', models.PositiveIntegerField()),
+                ('items', models.PositiveIntegerField()),
+                ('pizzas', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrderStatsRefresh',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('watermark', models.DateTimeField(null=True)),
+                ('refreshed_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='order_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstats',
+            index=models.Index(fields=['bucket'], name='order_stats_bucket_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.6 on 2026-10-17 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizza_ordering', '0006_order_stats'),
+    ]
+
+    # new indexes are created before the ones they replace are dropped
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer_email', '-created_at', '-id'], name='order_customer_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(_negated=True, delivery_status='delivered'), fields=['-created_at', '-id'], name='order_active_created_at_idx'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='customer_email',
+            field=models.EmailField(max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='delivery_status',
+            field=models.CharField(choices=[('not_in_delivery', 'Not ready yet for delivery. Still preparing'), ('ready_for_delivery', 'All preparations finished. Ready for delivery'), ('dispatched', 'Order has been dispatched to delivery service'), ('on_its_way', 'Delivery service is currently delivering the order'), ('delivered', 'Delivered to customer')], default='not_in_delivery', max_length=20),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.6 on 2026-10-17 23:55
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizza_ordering', '0009_order_claim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('destination', models.CharField(max_length=50)),
+                ('order_id', models.IntegerField()),
+                ('event_type', models.CharField(max_length=50)),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('created_at', models.DateTimeField()),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField()),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('failed_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(condition=models.Q(failed_at__isnull=True), fields=['destination', 'order_id', 'id'], name='outbox_event_order_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.6 on 2026-10-18 00:10
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizza_ordering', '0010_outbox_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSummary',
+            fields=[
+                ('customer_email', models.EmailField(max_length=254, primary_key=True, serialize=False)),
+                ('orders', models.IntegerField()),
+                ('active_orders', models.IntegerField()),
+                ('last_order_at', models.DateTimeField(null=True)),
+                ('flavour_pizzas', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('size_pizzas', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+    ]
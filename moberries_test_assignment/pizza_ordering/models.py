@@ -1,5 +1,10 @@
+import json
+from typing import Dict, List, Optional
+
 from django.db import models
-from django.contrib.postgres.fields import JSONField
+from django.db.models import Q
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
 
 
 class Order(models.Model):
@@ -14,22 +19,221 @@ class Order(models.Model):
         ('delivered', 'Delivered to customer'),
     )
     DELIVERY_STATUSES_NO_UPDATE = ['dispatched', 'on_its_way', 'delivered']
+    # allowed delivery_status changes: forward to any later status and one step back to correct a mistake.
+    # Setting the current status again is always allowed and is a no-op
+    DELIVERY_STATUS_TRANSITIONS = {
+        'not_in_delivery': ['ready_for_delivery', 'dispatched', 'on_its_way', 'delivered'],
+        'ready_for_delivery': ['not_in_delivery', 'dispatched', 'on_its_way', 'delivered'],
+        'dispatched': ['ready_for_delivery', 'on_its_way', 'delivered'],
+        'on_its_way': ['dispatched', 'delivered'],
+        'delivered': ['on_its_way'],
+    }
     ORDER_ITEM_ATTRIBUTES = ['flavour', 'quantity', 'size']
     ITEM_FLAVOURS = ["margherita", "hawaii", "fungi", "pepperoni", "capricciosa"]
     ITEM_SIZES = ["big", "small"]
 
     id = models.AutoField(primary_key=True)
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    customer_email = models.EmailField(db_index=True)
+    customer_email = models.EmailField()
     delivery_status = models.CharField(choices=DELIVERY_STATUSES,
                                        default=DELIVERY_STATUSES[0][0],
-                                       max_length=20,
-                                       db_index=True)
+                                       max_length=20)
     order_items = JSONField(verbose_name="The content of the order")
+    # kitchen station, which the order is leased to till claim_expires_at (see pizza_ordering.claims)
+    claimed_by = models.CharField(max_length=100, null=True, blank=True)
+    claim_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the orders list goes over (created_at, id) in desc order
+            models.Index(fields=['-created_at', '-id'], name='order_created_at_id_idx'),
+            # customer's orders newest first
+            models.Index(fields=['customer_email', '-created_at', '-id'], name='order_customer_created_at_idx'),
+            # active (not delivered yet) orders newest first. Most of the orders are delivered, so the index is small
+            models.Index(fields=['-created_at', '-id'], name='order_active_created_at_idx',
+                         condition=~Q(delivery_status='delivered')),
+            # incremental refresh of OrderStats looks for orders changed since the last refresh
+            models.Index(fields=['updated_at'], name='order_updated_at_idx'),
+            # containment (@>) and json path (@?) queries over order_items
+            GinIndex(fields=['order_items'], opclasses=['jsonb_path_ops'], name='order_items_path_ops_idx'),
+        ]
 
     def __str__(self):
         """
         String representation of the order - id of the order
         """
         return f"{self.id}"
+
+
+class OrderItem(models.Model):
+    """
+    Normalized copy of Order.order_items - one row per order item. Flavour and size are stored as small integer
+    codes (indexes in Order.ITEM_FLAVOURS and Order.ITEM_SIZES). Rows are written in the same transaction
+    as the order itself and are used for analytics and filtering without parsing JSON documents.
+    """
+    FLAVOUR_CHOICES = tuple(enumerate(Order.ITEM_FLAVOURS))
+    SIZE_CHOICES = tuple(enumerate(Order.ITEM_SIZES))
+    FLAVOUR_CODES = {flavour: code for code, flavour in FLAVOUR_CHOICES}
+    SIZE_CODES = {size: code for code, size in SIZE_CHOICES}
+
+    id = models.AutoField(primary_key=True)
+    order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
+    flavour = models.PositiveSmallIntegerField(choices=FLAVOUR_CHOICES)
+    size = models.PositiveSmallIntegerField(choices=SIZE_CHOICES)
+    quantity = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['flavour', 'size'], name='order_item_flavour_size_idx'),
+        ]
+
+    def __str__(self):
+        """
+        String representation of the order item - order id, flavour and size
+        """
+        return f"{self.order_id}: {self.get_flavour_display()} {self.get_size_display()}"
+
+    def as_dict(self) -> Dict:
+        """
+        Order item in the format of Order.order_items element. Keys go in the order jsonb returns them.
+        """
+        return {'size': self.SIZE_CHOICES[self.size][1],
+                'flavour': self.FLAVOUR_CHOICES[self.flavour][1],
+                'quantity': self.quantity}
+
+    @classmethod
+    def from_order(cls, order: Order) -> List['OrderItem']:
+        """
+        Builds (unsaved) rows for every element of order.order_items.
+        Elements, which don't fit the catalogue, are skipped.
+        """
+        order_items = order.order_items
+        # orders saved bypassing the API may contain JSON-encoded string
+        if isinstance(order_items, str):
+            order_items = json.loads(order_items)
+
+        rows = []
+        for item in order_items or []:
+            try:
+                rows.append(cls(order_id=order.id,
+                                flavour=cls.FLAVOUR_CODES[item['flavour']],
+                                size=cls.SIZE_CODES[item['size']],
+                                quantity=item['quantity']))
+            except (KeyError, TypeError):
+                continue
+        return rows
+
+
+class OrderStats(models.Model):
+    """
+    Summary of orders by hour of creation (`bucket`) and delivery status, maintained by refresh_order_stats command.
+    Rows without flavour and size hold totals: number of orders, order items and pizzas. Rows with flavour and size
+    hold the same numbers for the items of that flavour and size (orders - number of orders containing them).
+    """
+    id = models.AutoField(primary_key=True)
+    bucket = models.DateTimeField()
+    delivery_status = models.CharField(max_length=20)
+    flavour = models.CharField(max_length=50, null=True)
+    size = models.CharField(max_length=50, null=True)
+    orders = models.PositiveIntegerField()
+    items = models.PositiveIntegerField()
+    pizzas = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bucket'], name='order_stats_bucket_idx'),
+        ]
+
+
+class OrderStatsRefresh(models.Model):
+    """
+    State of OrderStats (single row): orders updated after `watermark` are not summarized yet.
+    """
+    id = models.AutoField(primary_key=True)
+    watermark = models.DateTimeField(null=True)
+    refreshed_at = models.DateTimeField(null=True)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response of POST /api/v1/orders/ stored by the value of Idempotency-Key request header (see
+    pizza_ordering.idempotency). The row is inserted in the same transaction as the order, so a concurrent request
+    with the same key waits on the unique index until the order is committed and then gets the stored response.
+    """
+    MAX_KEY_LENGTH = 255
+
+    id = models.AutoField(primary_key=True)
+    key = models.CharField(max_length=MAX_KEY_LENGTH, unique=True)
+    # sha256 of the request body: the same key sent with another body is rejected
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    # rendered JSON, so the stored response keeps the order of keys (jsonb doesn't)
+    response = models.TextField(null=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # expired keys are purged by creation time
+            models.Index(fields=['created_at'], name='idempotency_key_created_at_idx'),
+        ]
+
+
+class OutboxEvent(models.Model):
+    """
+    Event about an order (creation, delivery_status change) to be delivered to an external destination
+    (ORDERS_OUTBOX['DESTINATIONS']), written in the same transaction as the order change and delivered by
+    dispatch_outbox command (see pizza_ordering.outbox). Delivered events are deleted, events failed for good are kept
+    with failed_at set.
+    """
+    id = models.BigAutoField(primary_key=True)
+    destination = models.CharField(max_length=50)
+    # not a foreign key: events of deleted orders are still delivered (and the orders table could be partitioned)
+    order_id = models.IntegerField()
+    event_type = models.CharField(max_length=50)
+    payload = JSONField()
+    created_at = models.DateTimeField()
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True, default='')
+    failed_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            # events of an order are delivered to a destination in order: the earlier pending one is looked up
+            models.Index(fields=['destination', 'order_id', 'id'], name='outbox_event_order_idx',
+                         condition=Q(failed_at__isnull=True)),
+        ]
+
+
+class CustomerSummary(models.Model):
+    """
+    Summary of the orders of a customer for GET /api/v1/customers/{email}/summary/, kept up to date in the transaction
+    of every order change made through the API and rebuilt by rebuild_customer_summaries command
+    (see pizza_ordering.customers). Customers without orders have no row.
+    """
+    customer_email = models.EmailField(primary_key=True)
+    orders = models.IntegerField()
+    # orders not delivered yet
+    active_orders = models.IntegerField()
+    last_order_at = models.DateTimeField(null=True)
+    # pizzas (sum of quantities) ordered per flavour of Order.ITEM_FLAVOURS and per size of Order.ITEM_SIZES
+    flavour_pizzas = ArrayField(models.IntegerField())
+    size_pizzas = ArrayField(models.IntegerField())
+    updated_at = models.DateTimeField()
+
+    @staticmethod
+    def favourite(pizzas: List[int], names: List[str]) -> Optional[str]:
+        """
+        Name with the most pizzas (the first one in the catalogue on a tie), None if there are no pizzas.
+        """
+        best = max(range(min(len(pizzas), len(names))), key=lambda code: (pizzas[code], -code), default=None)
+        return names[best] if best is not None and pizzas[best] > 0 else None
+
+    @property
+    def favourite_flavour(self) -> Optional[str]:
+        return self.favourite(self.flavour_pizzas, Order.ITEM_FLAVOURS)
+
+    @property
+    def favourite_size(self) -> Optional[str]:
+        return self.favourite(self.size_pizzas, Order.ITEM_SIZES)
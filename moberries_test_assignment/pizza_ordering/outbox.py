@@ -0,0 +1,263 @@
+"""
+Transactional outbox of order events for external services (delivery partner, notification service): creation
+of an order and changes of its delivery_status are written to OutboxEvent table in the transaction, which changes
+the order, one row per destination of ORDERS_OUTBOX['DESTINATIONS']. So an event exists if and only if the change
+is committed, and the API requests don't wait for the external services.
+
+dispatch_outbox command delivers the events (HTTP POST of JSON with X-Event-Id header, at least once):
+- due events are claimed in batches in a short transaction with SELECT ... FOR UPDATE SKIP LOCKED, so several
+  dispatchers could run: their next_attempt_at is moved forward by a lease, which outlasts the deliveries of the batch
+  (see lease_seconds()), so other dispatchers don't take them meanwhile. Events of a dispatcher, which has crashed,
+  are taken again after the lease expires;
+- the batch is delivered with no transaction open and no rows locked, concurrently by a bounded pool of WORKERS
+  threads (keep-alive connections). Events of an order are delivered to a destination in order: an event is claimed
+  only when no earlier event of the order is pending for the destination, so a batch holds at most one event per
+  order and destination;
+- outcomes are recorded in a second short transaction, for the events still under the lease of the dispatcher.
+  Delivered events are deleted. Failed deliveries (network errors, timeouts, 5xx, 408, 429) are retried with
+  exponential backoff (BACKOFF * 2 ** attempt seconds, MAX_BACKOFF at most), later events of the order wait for them.
+  Other 4xx responses and MAX_ATTEMPTS failures mark the event failed (failed_at), it's kept for inspection and
+  doesn't hold the next events back.
+"""
+import threading
+import math
+from datetime import datetime, timedelta
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.fields import DateTimeField
+
+from pizza_ordering import fastjson
+from pizza_ordering.events import EVENT_DELIVERY_STATUS, status_event
+from pizza_ordering.models import Order, OutboxEvent
+
+EVENT_ORDER_CREATED = 'order_created'
+
+DEFAULT_SETTINGS = {
+    'DESTINATIONS': {},
+    'BATCH_SIZE': 100,
+    'WORKERS': 8,
+    'TIMEOUT': 5,
+    'BACKOFF': 1,
+    'MAX_BACKOFF': 300,
+    'MAX_ATTEMPTS': 20,
+    'POLL_INTERVAL': 1,
+}
+
+OUTCOME_DELIVERED = 'delivered'
+OUTCOME_RETRY = 'retry'
+OUTCOME_FAILED = 'failed'
+# client errors worth retrying
+RETRY_STATUSES = (408, 429)
+# seconds a lease of claimed events lasts beyond the timeouts of their deliveries
+LEASE_MARGIN = 30
+
+
+def get_settings() -> Dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ORDERS_OUTBOX', {})}
+
+
+def record_events(events: Iterable[Tuple[int, str, Dict]], batch_size: int = None) -> int:
+    """
+    Writes events (order id, event type, payload) for every destination. Must be called in the transaction, which
+    changes the orders. Returns number of the written rows.
+    """
+    destinations = get_settings()['DESTINATIONS']
+    if not destinations:
+        return 0
+    now = timezone.now()
+    rows = [OutboxEvent(destination=destination, order_id=order_id, event_type=event_type, payload=payload,
+                        created_at=now, next_attempt_at=now)
+            for order_id, event_type, payload in events for destination in destinations]
+    OutboxEvent.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def record_orders_created(orders: Iterable[Order], batch_size: int = None) -> int:
+    to_representation = DateTimeField().to_representation
+    return record_events(((order.id, EVENT_ORDER_CREATED,
+                           {'id': order.id,
+                            'customer_email': order.customer_email,
+                            'delivery_status': order.delivery_status,
+                            'order_items': order.order_items,
+                            'created_at': to_representation(order.created_at)})
+                          for order in orders), batch_size=batch_size)
+
+
+def record_status_changes(changes: Iterable[Tuple[Order, str]]) -> int:
+    """
+    Writes delivery_status changes, `changes` are pairs of the order and its previous status.
+    """
+    return record_events((order.id, EVENT_DELIVERY_STATUS, status_event(order, previous_status)['data'])
+                         for order, previous_status in changes)
+
+
+def lease_seconds(options: Dict) -> float:
+    """
+    Seconds claimed events are leased for: WORKERS threads deliver BATCH_SIZE events in rounds, every delivery
+    takes at most two TIMEOUTs (it's sent again, when a keep-alive connection turns out to be closed).
+    """
+    return math.ceil(options['BATCH_SIZE'] / options['WORKERS']) * options['TIMEOUT'] * 2 + LEASE_MARGIN
+
+
+def claim_due_events(destinations: List[str], limit: int, leased_until: datetime) -> List[Dict]:
+    """
+    Claims at most `limit` due events, the first pending event of every order and destination, moving their
+    next_attempt_at to `leased_until`. Runs in its own short transaction.
+    """
+    table = connection.ops.quote_name(OutboxEvent._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE {table} AS c
+            SET next_attempt_at = %(leased_until)s
+            FROM (SELECT e.id
+                  FROM {table} AS e
+                  WHERE e.failed_at IS NULL AND e.next_attempt_at <= %(now)s
+                        AND e.destination = ANY(%(destinations)s)
+                        AND NOT EXISTS (SELECT 1 FROM {table} AS p
+                                        WHERE p.destination = e.destination AND p.order_id = e.order_id
+                                              AND p.failed_at IS NULL AND p.id < e.id)
+                  ORDER BY e.id
+                  LIMIT %(limit)s
+                  FOR UPDATE OF e SKIP LOCKED) AS due
+            WHERE c.id = due.id
+            RETURNING c.id, c.destination, c.order_id, c.event_type, c.payload, c.created_at, c.attempts
+        """, {'now': timezone.now(), 'leased_until': leased_until, 'destinations': destinations, 'limit': limit})
+        columns = [column.name for column in cursor.description]
+        return sorted((dict(zip(columns, row)) for row in cursor.fetchall()), key=lambda event: event['id'])
+
+
+def event_body(event: Dict) -> bytes:
+    return fastjson.dumps({'id': event['id'], 'type': event['event_type'], 'order_id': event['order_id'],
+                           'created_at': event['created_at'], 'attempt': event['attempts'] + 1,
+                           'data': event['payload']})
+
+
+def outcome(status_code: Optional[int]) -> str:
+    if status_code is not None and 200 <= status_code < 300:
+        return OUTCOME_DELIVERED
+    if status_code is not None and 400 <= status_code < 500 and status_code not in RETRY_STATUSES:
+        return OUTCOME_FAILED
+    return OUTCOME_RETRY
+
+
+class HttpDelivery:
+    """
+    POSTs events to the destinations. Every thread keeps its own keep-alive connection per destination.
+    """
+
+    def __init__(self, destinations: Dict[str, str], timeout: float):
+        self.urls = {}
+        for name, url in destinations.items():
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https') or not parts.hostname:
+                raise ValueError(f"Invalid URL of outbox destination '{name}': {url}")
+            self.urls[name] = parts
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self, destination: str) -> HTTPConnection:
+        connections = self.local.__dict__.setdefault('connections', {})
+        if destination not in connections:
+            url = self.urls[destination]
+            connection_class = HTTPSConnection if url.scheme == 'https' else HTTPConnection
+            connections[destination] = connection_class(url.hostname, url.port, timeout=self.timeout)
+        return connections[destination]
+
+    def close_connection(self, destination: str) -> None:
+        http_connection = self.local.__dict__.get('connections', {}).pop(destination, None)
+        if http_connection is not None:
+            http_connection.close()
+
+    def deliver(self, event: Dict) -> Tuple[Optional[int], str]:
+        """
+        Returns status code of the response (None, if there's no response) and error description.
+        """
+        destination = event['destination']
+        url = self.urls[destination]
+        path = (url.path or '/') + (f'?{url.query}' if url.query else '')
+        headers = {'Content-Type': 'application/json', 'X-Event-Id': str(event['id'])}
+        body = event_body(event)
+        while True:
+            http_connection = self.connection(destination)
+            reused = http_connection.sock is not None
+            try:
+                http_connection.request('POST', path, body=body, headers=headers)
+                response = http_connection.getresponse()
+                response.read()
+            except (OSError, HTTPException) as exc:
+                self.close_connection(destination)
+                if reused and isinstance(exc, (ConnectionError, HTTPException)):
+                    # the server closed the idle keep-alive connection: send again on a new one
+                    continue
+                return None, f"{type(exc).__name__}: {exc}"
+            if response.will_close:
+                self.close_connection(destination)
+            return response.status, '' if 200 <= response.status < 300 else f"HTTP {response.status}"
+
+
+def backoff(attempts: int, options: Dict) -> float:
+    """
+    Seconds to wait before the next attempt after `attempts` failed ones.
+    """
+    return min(options['MAX_BACKOFF'], options['BACKOFF'] * 2 ** (attempts - 1))
+
+
+def record_outcomes(delivered: List[int], updates: List[Tuple], leased_until: datetime) -> None:
+    """
+    Deletes delivered events and updates the others with (id, attempts, next_attempt_at, last_error, failed_at)
+    in one short transaction. Events, whose lease has expired and which could be claimed by another dispatcher since,
+    are left alone.
+    """
+    with transaction.atomic():
+        if delivered:
+            OutboxEvent.objects.filter(id__in=delivered, next_attempt_at=leased_until).delete()
+        if updates:
+            table = connection.ops.quote_name(OutboxEvent._meta.db_table)
+            values = ', '.join(['(%s::bigint, %s::integer, %s::timestamptz, %s, %s::timestamptz)'] * len(updates))
+            with connection.cursor() as cursor:
+                cursor.execute(f"""
+                    UPDATE {table} AS e
+                    SET attempts = v.attempts, next_attempt_at = v.next_attempt_at, last_error = v.last_error,
+                        failed_at = v.failed_at
+                    FROM (VALUES {values}) AS v(id, attempts, next_attempt_at, last_error, failed_at)
+                    WHERE e.id = v.id AND e.next_attempt_at = %s
+                """, [value for update in updates for value in update] + [leased_until])
+
+
+def dispatch_batch(delivery: HttpDelivery, executor, options: Dict) -> Dict:
+    """
+    Claims one batch of due events, delivers it with the executor's threads outside of any transaction and records
+    the outcomes. Returns numbers of fetched, delivered, retried and failed events and end-to-end lags (ms)
+    of the delivered ones.
+    """
+    leased_until = timezone.now() + timedelta(seconds=lease_seconds(options))
+    events = claim_due_events(list(delivery.urls), options['BATCH_SIZE'], leased_until)
+    results = list(executor.map(delivery.deliver, events))
+    now = timezone.now()
+    delivered, updates, stats = [], [], {OUTCOME_DELIVERED: 0, OUTCOME_RETRY: 0, OUTCOME_FAILED: 0}
+    lags = []
+    for event, (status_code, error) in zip(events, results):
+        result = outcome(status_code)
+        attempts = event['attempts'] + 1
+        if result == OUTCOME_RETRY and attempts >= options['MAX_ATTEMPTS']:
+            result = OUTCOME_FAILED
+        stats[result] += 1
+        if result == OUTCOME_DELIVERED:
+            delivered.append(event['id'])
+            lags.append((now - event['created_at']).total_seconds() * 1000)
+        else:
+            updates.append((event['id'], attempts, now + timedelta(seconds=backoff(attempts, options)), error,
+                            now if result == OUTCOME_FAILED else None))
+    record_outcomes(delivered, updates, leased_until)
+
+    return {'fetched': len(events), 'delivered': stats[OUTCOME_DELIVERED], 'retried': stats[OUTCOME_RETRY],
+            'failed': stats[OUTCOME_FAILED], 'lags': lags}
+
+
+def pending_count() -> int:
+    return OutboxEvent.objects.filter(failed_at__isnull=True).count()
@@ -0,0 +1,230 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATE = 'estimate'
+COUNT_NONE = 'none'
+COUNT_MODES = (COUNT_EXACT, COUNT_ESTIMATE, COUNT_NONE)
+
+MODE_OFFSET = 'offset'
+MODE_CURSOR = 'cursor'
+
+# directions encoded into cursor tokens
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def estimate_count(queryset) -> int:
+    """
+    Returns planner's estimation of the number of rows in queryset instead of running COUNT(*).
+    For unfiltered querysets table statistics (pg_class.reltuples) are used directly,
+    for filtered ones - the row estimation of EXPLAIN.
+    """
+    connection = connections[queryset.db]
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        # reltuples is -1 (or 0 on old versions of postgres) for tables which were never analyzed
+        if row and row[0] > 0:
+            return row[0]
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class OrderPagination(LimitOffsetPagination):
+    """
+    Paginator for the orders list. Supports two modes:
+
+    - offset mode (default) - classic `?limit=&offset=` pagination, fully compatible with LimitOffsetPagination;
+    - cursor mode - keyset pagination over (created_at, id), enabled by `?cursor=` query parameter
+      (empty value means the first page). Next/previous links contain opaque cursor tokens, every page
+      is fetched with an index range scan, so the depth of the page doesn't matter.
+
+    Total count calculation is controlled with `?count=exact|estimate|none` query parameter.
+    Defaults are taken from ORDERS_PAGINATION_MODE and ORDERS_PAGINATION_COUNT settings (offset mode always
+    defaults to exact count for backward compatibility, cursor mode to ORDERS_PAGINATION_COUNT).
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+    # count of the filtered orders, when the view already knows it (see get_count())
+    known_count = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.mode = self.get_mode(request)
+        self.count_mode = self.get_count_mode(request)
+
+        if self.mode == MODE_CURSOR:
+            self.limit = self.get_limit(request)
+            return self.paginate_keyset(queryset, request)
+
+        if self.count_mode == COUNT_EXACT:
+            return super(OrderPagination, self).paginate_queryset(queryset, request, view)
+
+        # offset mode without exact COUNT(*): fetch one extra row to know if there is a next page
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        self.count = estimate_count(queryset) if self.count_mode == COUNT_ESTIMATE else None
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        return rows[:self.limit]
+
+    def counts_exactly(self, request) -> bool:
+        """
+        Whether the request gets an offset page with exact COUNT(*). Only such pages count the filtered orders
+        anyway, so the view could compute list validators (which count them too) and hand the count over
+        in known_count instead of counting twice.
+        """
+        self.mode = self.get_mode(request)
+        return self.mode == MODE_OFFSET and self.get_count_mode(request) == COUNT_EXACT
+
+    def get_count(self, queryset) -> int:
+        if self.known_count is not None:
+            return self.known_count
+        return super(OrderPagination, self).get_count(queryset)
+
+    def get_mode(self, request) -> str:
+        if self.cursor_query_param in request.query_params:
+            return MODE_CURSOR
+        if self.offset_query_param in request.query_params:
+            return MODE_OFFSET
+        return getattr(settings, 'ORDERS_PAGINATION_MODE', MODE_OFFSET)
+
+    def get_count_mode(self, request) -> str:
+        count_mode = request.query_params.get(self.count_query_param)
+        if count_mode in COUNT_MODES:
+            return count_mode
+        if self.mode == MODE_OFFSET:
+            return COUNT_EXACT
+        return getattr(settings, 'ORDERS_PAGINATION_COUNT', COUNT_NONE)
+
+    def paginate_keyset(self, queryset, request):
+        """
+        Fetches one page of orders after (or before) the position stored in cursor token.
+        """
+        token = request.query_params.get(self.cursor_query_param)
+        direction, position = self.decode_cursor(token) if token else (NEXT, None)
+
+        if self.count_mode == COUNT_EXACT:
+            self.count = queryset.count()
+        elif self.count_mode == COUNT_ESTIMATE:
+            self.count = estimate_count(queryset)
+        else:
+            self.count = None
+
+        if direction == NEXT:
+            queryset = queryset.order_by(*self.ordering)
+            comparison = '<'
+        else:
+            queryset = queryset.order_by(*[field.lstrip('-') for field in self.ordering])
+            comparison = '>'
+
+        if position is not None:
+            # row comparison lets postgres do a single range scan over (created_at, id) index
+            table = queryset.model._meta.db_table
+            queryset = queryset.extra(where=[f'("{table}"."created_at", "{table}"."id") {comparison} (%s, %s)'],
+                                      params=list(position))
+
+        rows = list(queryset[:self.limit + 1])
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+
+        if direction == NEXT:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        else:
+            rows.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if self.mode == MODE_CURSOR:
+            if not self.has_next or not self.page:
+                return None
+            return self.build_cursor_link(NEXT, self.page[-1])
+
+        if self.count_mode == COUNT_EXACT:
+            return super(OrderPagination, self).get_next_link()
+
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_previous_link(self):
+        if self.mode == MODE_CURSOR:
+            if not self.has_previous or not self.page:
+                return None
+            return self.build_cursor_link(PREVIOUS, self.page[0])
+        return super(OrderPagination, self).get_previous_link()
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super(OrderPagination, self).get_paginated_response_schema(schema)
+        response_schema['properties']['count']['nullable'] = True
+        return response_schema
+
+    def build_cursor_link(self, direction: str, obj) -> str:
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(direction, obj))
+
+    @staticmethod
+    def encode_cursor(direction: str, obj) -> str:
+        """
+        Builds opaque cursor token pointing to the position of obj (model instance or values() dict).
+        """
+        if isinstance(obj, dict):
+            created_at, pk = obj['created_at'], obj['id']
+        else:
+            created_at, pk = obj.created_at, obj.pk
+        payload = json.dumps([direction, created_at.isoformat(), pk], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, token: str):
+        """
+        Returns direction and (created_at, id) position decoded from cursor token. Raises NotFound on garbage.
+        """
+        try:
+            payload = base64.urlsafe_b64decode(token.encode('ascii') + b'=' * (-len(token) % 4))
+            direction, created_at, pk = json.loads(payload.decode('ascii'))
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        if direction not in (NEXT, PREVIOUS) or created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return direction, (created_at, pk)
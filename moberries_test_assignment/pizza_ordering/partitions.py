@@ -0,0 +1,228 @@
+"""
+Monthly range partitioning of the orders table by created_at.
+
+convert() replaces the plain orders table with a table partitioned by month of creation (UTC) under the same name,
+so the ORM and the API keep working unchanged: the newest orders (the live traffic) live in a small partition,
+queries ordered by created_at read partitions in order and stop at the first page, and old months could be detached
+as a whole (archive_partitions()) instead of deleting rows. Orders of the months without a partition go to
+the default partition and are moved out of it by create_partitions().
+
+Primary key of a partitioned table must include the partition key, so it becomes (id, created_at), and foreign keys
+can't reference the orders table anymore: the foreign key of OrderItem is dropped (items are still deleted together
+with their orders by the ORM) and restored by revert().
+"""
+import re
+from datetime import datetime
+from typing import List, Tuple
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from pizza_ordering.models import Order, OrderItem
+
+ARCHIVE_SCHEMA = 'pizza_ordering_archive'
+PARTITIONS_AHEAD = 3  # months
+PARTITION_NAME_RE = re.compile(r'_y(\d{4})m(\d{2})$')
+
+
+def month_start(value: datetime) -> datetime:
+    """
+    Beginning of the month (UTC) of the value.
+    """
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    """
+    Beginning of the month, which is `months` later (or earlier) than the month.
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month: datetime, table: str = None) -> str:
+    """
+    Name of the partition for the month, e.g. pizza_ordering_order_y2019m10.
+    """
+    return f"{table or Order._meta.db_table}_y{month.year}m{month.month:02d}"
+
+
+def is_partitioned() -> bool:
+    """
+    Whether the orders table is partitioned.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [Order._meta.db_table])
+        return cursor.fetchone()[0] == 'p'
+
+
+def partitions() -> List[Tuple[str, datetime]]:
+    """
+    Monthly partitions of the orders table as (name, month) ordered by month. The default partition isn't included.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass",
+                       [Order._meta.db_table])
+        names = [name for name, in cursor.fetchall()]
+    result = []
+    for name in names:
+        match = PARTITION_NAME_RE.search(name)
+        if match:
+            result.append((name, datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)))
+    return sorted(result, key=lambda partition: partition[1])
+
+
+def index_definitions(cursor, table: str) -> List[str]:
+    """
+    CREATE INDEX statements of the table except the primary key.
+    """
+    cursor.execute("""
+        SELECT pg_get_indexdef(i.indexrelid)
+        FROM pg_index AS i
+        WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+        ORDER BY i.indexrelid
+    """, [table])
+    return [definition for definition, in cursor.fetchall()]
+
+
+def copy_table(cursor, source: str, target: str, partition_by: str = '') -> None:
+    """
+    Creates target table with columns, defaults and constraints of the source and copies rows into it.
+    Ownership of the id sequence is passed to the target, so the sequence survives dropping of the source.
+    """
+    cursor.execute(f"CREATE TABLE {target} (LIKE {source} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+                   f"INCLUDING STORAGE) {partition_by}")
+    if partition_by:
+        cursor.execute("SELECT date_trunc('month', MIN(created_at)) FROM " + source)
+        first_month = cursor.fetchone()[0]
+        create_partitions(since=first_month, cursor=cursor, table=target)
+    cursor.execute(f"INSERT INTO {target} SELECT * FROM {source}")
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [source])
+    sequence = cursor.fetchone()[0]
+    if sequence:
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {target}.id")
+
+
+def convert() -> None:
+    """
+    Replaces the plain orders table with the partitioned one: creates the default partition and monthly partitions
+    from the month of the oldest order till PARTITIONS_AHEAD months ahead, copies the orders and recreates indexes.
+    The table is locked (ACCESS EXCLUSIVE) till the end of the transaction.
+    """
+    table = Order._meta.db_table
+    legacy = f"{table}_unpartitioned"
+    with transaction.atomic(), connection.cursor() as cursor:
+        if is_partitioned():
+            raise ValueError(f"Table {table} is partitioned already.")
+        cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        indexes = index_definitions(cursor, table)
+        cursor.execute("SELECT conrelid::regclass::text, conname FROM pg_constraint "
+                       "WHERE confrelid = %s::regclass AND contype = 'f'", [table])
+        for referencing_table, constraint in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {referencing_table} DROP CONSTRAINT "{constraint}"')
+
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        copy_table(cursor, legacy, table, partition_by='PARTITION BY RANGE (created_at)')
+        cursor.execute(f"DROP TABLE {legacy}")
+
+        # indexes are created on every partition after the data is loaded
+        cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+        for definition in indexes:
+            cursor.execute(definition)
+        cursor.execute(f"ANALYZE {table}")
+
+
+def revert() -> None:
+    """
+    Replaces the partitioned orders table with a plain one holding all the orders of the attached partitions
+    and restores the foreign key of OrderItem.
+    """
+    table = Order._meta.db_table
+    legacy = f"{table}_partitioned"
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not is_partitioned():
+            raise ValueError(f"Table {table} isn't partitioned.")
+        cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        indexes = index_definitions(cursor, table)
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        copy_table(cursor, legacy, table)
+        cursor.execute(f"DROP TABLE {legacy}")
+
+        cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id)")
+        for definition in indexes:
+            cursor.execute(definition)
+        with connection.schema_editor() as editor:
+            editor.execute(editor._create_fk_sql(OrderItem, OrderItem._meta.get_field('order'),
+                                                 '_fk_%(to_table)s_%(to_column)s'))
+        cursor.execute(f"ANALYZE {table}")
+
+
+def create_partitions(ahead: int = PARTITIONS_AHEAD, since: datetime = None,
+                      cursor=None, table: str = None) -> List[str]:
+    """
+    Creates missing monthly partitions from `since` (the current month by default) till `ahead` months after
+    the current one and the default partition. Orders of the new months are moved out of the default partition.
+    Returns names of the created partitions.
+    """
+    if cursor is None:
+        with transaction.atomic(), connection.cursor() as cursor:
+            return create_partitions(ahead, since, cursor, table)
+
+    table = table or Order._meta.db_table
+    default = f"{table}_default"
+    cursor.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass", [table])
+    existing = {name for name, in cursor.fetchall()}
+    if default not in existing:
+        cursor.execute(f"CREATE TABLE {default} PARTITION OF {table} DEFAULT")
+        existing.add(default)
+
+    current = month_start(timezone.now())
+    month = month_start(since) if since is not None else current
+    created = []
+    while month <= add_months(current, ahead):
+        name = partition_name(month, table)
+        if name not in existing:
+            upper = add_months(month, 1)
+            # a partition can't be attached while the default one holds rows of its range
+            cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+                           f"INCLUDING STORAGE)")
+            cursor.execute(f"WITH moved AS (DELETE FROM {default} WHERE created_at >= %s AND created_at < %s "
+                           f"RETURNING *) INSERT INTO {name} SELECT * FROM moved", [month, upper])
+            cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                           [month, upper])
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def archive_partitions(older_than: int, drop: bool = False, schema: str = ARCHIVE_SCHEMA) -> List[str]:
+    """
+    Detaches monthly partitions, which ended more than `older_than` months before the current month. Detached
+    partitions are moved to the archive schema together with OrderItem rows of their orders (pizza_ordering_orderitem
+    table of the same month suffix) or dropped with them. Returns names of the detached partitions.
+    """
+    cutoff = add_months(month_start(timezone.now()), -older_than)
+    table, items_table = Order._meta.db_table, OrderItem._meta.db_table
+    archived = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not is_partitioned():
+            raise ValueError(f"Table {table} isn't partitioned.")
+        if not drop:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        for name, month in partitions():
+            if add_months(month, 1) > cutoff:
+                continue
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+            items_condition = f"order_id IN (SELECT id FROM {name})"
+            if drop:
+                cursor.execute(f"DELETE FROM {items_table} WHERE {items_condition}")
+                cursor.execute(f"DROP TABLE {name}")
+            else:
+                archived_items = f"{schema}.{partition_name(month, items_table)}"
+                cursor.execute(f"CREATE TABLE {archived_items} (LIKE {items_table})")
+                cursor.execute(f"WITH moved AS (DELETE FROM {items_table} WHERE {items_condition} RETURNING *) "
+                               f"INSERT INTO {archived_items} SELECT * FROM moved")
+                cursor.execute(f"ALTER TABLE {name} SET SCHEMA {schema}")
+            archived.append(name)
+    return archived
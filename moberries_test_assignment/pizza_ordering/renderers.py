@@ -0,0 +1,62 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from pizza_ordering import fastjson
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding with orjson when it's installed. Output is the same as of JSONRenderer.
+    Indented output (`Accept: application/json; indent=4`) is rendered by JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        return fastjson.dumps(data)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Renderer for Server-Sent Events endpoints. Streams are returned as StreamingHttpResponse and don't need
+    rendering, so this renderer is used for content negotiation (`Accept: text/event-stream`) and
+    for error responses, which are rendered as JSON.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return fastjson.dumps(data)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renderer for NDJSON export (`?format=ndjson`). Export is streamed as StreamingHttpResponse, so this renderer
+    is used for content negotiation and for error responses, which are rendered as JSON.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return fastjson.dumps(data) + b'\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Renderer for CSV export (`?format=csv`). Like NDJSONRenderer, renders error responses only (as JSON).
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return fastjson.dumps(data)
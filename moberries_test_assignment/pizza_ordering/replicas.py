@@ -0,0 +1,232 @@
+"""
+Read replicas: safe (GET, HEAD, OPTIONS) requests read from a streaming replica of the orders database, writes and
+everything else go to the primary ('default' alias).
+
+ReplicaRoutingMiddleware picks one replica per request (smooth weighted round-robin over the healthy replicas
+of ORDERS_REPLICAS['WEIGHTS']), so all the queries of a request see the same snapshot, and ReplicaRouter sends ORM
+reads of the request to it. Reads outside of requests (management commands), reads in a transaction and raw SQL
+(connection.cursor()) use the primary.
+
+Every replica is health-checked at most every CHECK_INTERVAL seconds per process: a replica, which can't be queried,
+isn't streaming WAL from the primary (a disconnected replica has replayed all it got, but could be hours behind) or
+replays WAL more than MAX_LAG seconds behind the primary, gets no requests until the next successful check. The role
+of the replica connections needs pg_read_all_stats to see the status of the WAL receiver.
+When no replica is healthy, reads go to the primary.
+
+Read-your-writes: a response to a write (POST, PUT, PATCH, DELETE) sets PIN_COOKIE for PIN_SECONDS. Requests with
+the cookie read from the primary and bypass the orders cache, so the client never reads its change back stale.
+A replica passing the health check could fall behind up to MAX_LAG + CHECK_INTERVAL seconds before the next check,
+which is the default of PIN_SECONDS. Other clients may read data older by the replication lag. Reads from replicas
+don't fill the orders cache, so it doesn't keep stale data for the TTL after the invalidation.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.dispatch import receiver
+
+from pizza_ordering.cache import MISSING
+
+DEFAULT_SETTINGS = {
+    'WEIGHTS': {},
+    # None: MAX_LAG + CHECK_INTERVAL
+    'PIN_SECONDS': None,
+    'PIN_COOKIE': 'orders_primary',
+    'CHECK_INTERVAL': 5,
+    'MAX_LAG': 5,
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# seconds the replica is behind the primary: 0 when it isn't a replica at all or when it streams WAL from
+# the primary and has replayed all of it (an idle primary doesn't make the replica lag), NULL when it doesn't stream
+# or hasn't replayed any transaction yet
+LAG_SQL = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def get_settings() -> Dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ORDERS_REPLICAS', {})}
+
+
+def pin_seconds(options: Dict) -> float:
+    """
+    Seconds a client reads from the primary after a write: longer than any healthy replica could stay behind it.
+    """
+    if options['PIN_SECONDS'] is not None:
+        return options['PIN_SECONDS']
+    return options['MAX_LAG'] + options['CHECK_INTERVAL']
+
+
+class ReplicaPool:
+    """
+    Weighted round-robin over healthy replicas. Thread-safe.
+    """
+
+    def __init__(self, weights: Dict[str, int], check_interval: float, max_lag: float):
+        self.weights = {alias: weight for alias, weight in weights.items() if weight > 0}
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.current = {alias: 0 for alias in self.weights}
+        self.healthy = {alias: True for alias in self.weights}
+        self.checked_at = {alias: None for alias in self.weights}
+        self.lock = threading.Lock()
+
+    def choose(self) -> Optional[str]:
+        """
+        Alias of the replica the next request should read from or None, if no replica is healthy.
+        """
+        self.refresh_health()
+        with self.lock:
+            candidates = [alias for alias in self.weights if self.healthy[alias]]
+            if not candidates:
+                return None
+            # smooth weighted round-robin: replicas are interleaved instead of being chosen in runs of their weight
+            for alias in candidates:
+                self.current[alias] += self.weights[alias]
+            chosen = max(candidates, key=lambda alias: self.current[alias])
+            self.current[chosen] -= sum(self.weights[alias] for alias in candidates)
+            return chosen
+
+    def refresh_health(self) -> None:
+        now = time.monotonic()
+        for alias in self.weights:
+            with self.lock:
+                checked_at = self.checked_at[alias]
+                if checked_at is not None and now - checked_at < self.check_interval:
+                    continue
+                # other threads don't check the replica meanwhile
+                self.checked_at[alias] = now
+            healthy = self.check(alias)
+            if healthy != self.healthy[alias]:
+                logger.warning("Replica %s is %s", alias, 'healthy again' if healthy else 'unhealthy')
+            self.healthy[alias] = healthy
+
+    def check(self, alias: str) -> bool:
+        """
+        Whether the replica could be queried, streams WAL and isn't more than max_lag seconds behind the primary.
+        """
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(LAG_SQL)
+                lag, = cursor.fetchone()
+        except DatabaseError:
+            # reconnect on the next check
+            connection.close_if_unusable_or_obsolete()
+            return False
+        return lag is not None and lag <= self.max_lag
+
+
+_pool = MISSING
+_pool_lock = threading.Lock()
+
+
+def get_replica_pool() -> Optional[ReplicaPool]:
+    """
+    Pool of the configured replicas or None, if there are none.
+    """
+    global _pool
+    if _pool is MISSING:
+        with _pool_lock:
+            if _pool is MISSING:
+                options = get_settings()
+                _pool = (ReplicaPool(options['WEIGHTS'], options['CHECK_INTERVAL'], options['MAX_LAG'])
+                         if options['WEIGHTS'] else None)
+    return _pool
+
+
+@receiver(setting_changed)
+def reset_replica_pool(setting, **kwargs):
+    global _pool
+    if setting == 'ORDERS_REPLICAS':
+        _pool = MISSING
+
+
+_state = threading.local()
+
+
+@contextmanager
+def reads_from(alias: Optional[str]):
+    """
+    ORM reads of the current thread go to the alias (the primary, if it's None) inside the block.
+    """
+    previous = getattr(_state, 'alias', None)
+    _state.alias = alias
+    try:
+        yield
+    finally:
+        _state.alias = previous
+
+
+def read_alias() -> Optional[str]:
+    """
+    Replica ORM reads of the current thread go to or None for the primary.
+    """
+    return getattr(_state, 'alias', None)
+
+
+def is_pinned(request) -> bool:
+    """
+    Whether the client has written recently and should read from the primary.
+    """
+    options = get_settings()
+    return bool(options['WEIGHTS']) and options['PIN_COOKIE'] in request.COOKIES
+
+
+class ReplicaRouter:
+    """
+    Database router sending reads chosen by ReplicaRoutingMiddleware to a replica. Migrations run on the primary
+    only, replicas get them with the replication.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = read_alias()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Sends reads of safe requests to a replica, pins clients to the primary after their writes.
+    Reads of a streamed response made after the view returned go to the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pool = get_replica_pool()
+        if pool is None:
+            return self.get_response(request)
+
+        safe = request.method in SAFE_METHODS
+        with reads_from(pool.choose() if safe and not is_pinned(request) else None):
+            response = self.get_response(request)
+
+        options = get_settings()
+        if not safe and pin_seconds(options):
+            response.set_cookie(options['PIN_COOKIE'], '1', max_age=pin_seconds(options), httponly=True)
+        return response
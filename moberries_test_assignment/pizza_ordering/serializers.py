@@ -1,12 +1,145 @@
-import itertools
-from typing import List, Dict
+from datetime import datetime, time
+from typing import List, Dict, Optional
 
-from rest_framework import serializers
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
-from pizza_ordering.models import Order
+from pizza_ordering.claims import get_settings as get_claims_settings
+from pizza_ordering.customers import SummaryChanges
+from pizza_ordering.filters import OrderFilter
+from pizza_ordering.models import CustomerSummary, Order, OrderItem
+from pizza_ordering.outbox import record_orders_created
+from pizza_ordering.stats import DIMENSIONS, STATS_SOURCES
+from pizza_ordering.validators import order_items_validator
 
+DEDUPLICATE_KEEP_FIRST = 'keep_first'
+DEDUPLICATE_SUM = 'sum'
+DEDUPLICATION_POLICIES = (DEDUPLICATE_KEEP_FIRST, DEDUPLICATE_SUM)
 
-class OrderPatchSerializer(serializers.ModelSerializer):
+ORDER_ITEMS_SOURCE_JSON = 'json'
+ORDER_ITEMS_SOURCE_ROWS = 'rows'
+
+# fields of Order in OrderSerializer output order
+ORDER_FIELDS = ('id', 'created_at', 'updated_at', 'customer_email', 'delivery_status', 'order_items')
+
+
+def merge_order_items(order_items: List[Dict], policy: str = DEDUPLICATE_KEEP_FIRST) -> List[Dict]:
+    """
+    Merges order items with the same 'flavour' and 'size' in one pass over the list.
+
+    Policies:
+    - keep_first - the first item of the same flavour and size is kept, the rest are dropped;
+    - sum - quantities of the items of the same flavour and size are summed up (input items are not mutated).
+
+    Result is sorted by flavour and size. Only distinct keys are sorted, and there are
+    at most len(ITEM_FLAVOURS) * len(ITEM_SIZES) of them.
+    """
+    merged = {}
+    if policy == DEDUPLICATE_KEEP_FIRST:
+        for item in order_items:
+            merged.setdefault((item['flavour'], item['size']), item)
+    elif policy == DEDUPLICATE_SUM:
+        for item in order_items:
+            key = (item['flavour'], item['size'])
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = dict(item)
+            else:
+                existing['quantity'] += item['quantity']
+    else:
+        raise ValueError(f"Unknown deduplication policy {policy!r}. Must be one of: {DEDUPLICATION_POLICIES}")
+
+    return [merged[key] for key in sorted(merged)]
+
+
+def parse_datetime_param(value: str) -> Optional[datetime]:
+    """
+    Parses ISO 8601 datetime or date (midnight of the current timezone). Returns None if value is invalid.
+    """
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            parsed = datetime.combine(day, time()) if day is not None else None
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def order_items_from_rows() -> bool:
+    """
+    Whether order_items should be rendered from OrderItem rows rather than from Order.order_items JSON.
+    """
+    return getattr(settings, 'ORDER_ITEMS_SOURCE', ORDER_ITEMS_SOURCE_JSON) == ORDER_ITEMS_SOURCE_ROWS
+
+
+def save_order_item_rows(orders: List[Order], replace: bool = False, batch_size: int = None) -> None:
+    """
+    Writes OrderItem rows for orders with multi-row INSERTs. With replace=True existing rows are deleted first.
+    Should be called in the same transaction the orders are saved in.
+    """
+    if replace:
+        OrderItem.objects.filter(order__in=orders).delete()
+    OrderItem.objects.bulk_create([row for order in orders for row in OrderItem.from_order(order)],
+                                  batch_size=batch_size)
+
+
+def values_serialization() -> bool:
+    """
+    Whether orders lists are serialized from .values() rows by orders_to_dicts() rather than by OrderSerializer
+    (ORDERS_VALUES_SERIALIZATION setting). Only JSON order_items and ISO 8601 datetimes are supported.
+    """
+    return (getattr(settings, 'ORDERS_VALUES_SERIALIZATION', True) and not order_items_from_rows()
+            and api_settings.DATETIME_FORMAT.lower() == ISO_8601)
+
+
+def orders_to_dicts(rows: List[Dict]) -> List[Dict]:
+    """
+    Read-only serialization of Order.objects.values(*ORDER_FIELDS) rows. Gives the same output as OrderSerializer
+    (same keys in the same order, datetimes in the current timezone in ISO 8601 with 'Z' for UTC),
+    but without per-field to_representation() calls.
+    """
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def datetime_to_str(value):
+        if value is None:
+            return None
+        if tz is not None and timezone.is_aware(value):
+            value = value.astimezone(tz)
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return [{'id': row['id'],
+             'created_at': datetime_to_str(row['created_at']),
+             'updated_at': datetime_to_str(row['updated_at']),
+             'customer_email': row['customer_email'],
+             'delivery_status': row['delivery_status'],
+             'order_items': row['order_items']}
+            for row in rows]
+
+
+class OrderRepresentationMixin:
+    """
+    Renders order_items from prefetched OrderItem rows when ORDER_ITEMS_SOURCE setting is 'rows'.
+    Orders without rows (e.g. not backfilled yet) are rendered from JSON.
+    """
+
+    def to_representation(self, instance):
+        data = super(OrderRepresentationMixin, self).to_representation(instance)
+        if order_items_from_rows():
+            rows = instance.items.all()
+            if rows:
+                data['order_items'] = [row.as_dict() for row in rows]
+        return data
+
+
+class OrderPatchSerializer(OrderRepresentationMixin, serializers.ModelSerializer):
     """
     Serializer class for PATCH method. With PATCH method user must be allowed to patch only delivery_status field.
     That's why the rest of the fields are marked as read-only
@@ -14,11 +147,11 @@ class OrderPatchSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = '__all__'
+        fields = ORDER_FIELDS
         read_only_fields = ['id', 'customer_email', 'order_items', 'created_at', 'updated_at', ]
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(OrderRepresentationMixin, serializers.ModelSerializer):
     """
     Serializer class for GET, POST, PUT and DELETE methods.
     The only writable fields are: customer_email and order_items
@@ -26,40 +159,61 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = '__all__'
+        fields = ORDER_FIELDS
         read_only_fields = ['id', 'delivery_status', 'created_at', 'updated_at', ]
         extra_kwargs = {'customer_email': {'required': True},
                         'order_items': {'required': True}}
 
-    def validate_order_items(self, order_items: List[Dict]) -> List[Dict]:
+    def create(self, validated_data):
         """
-        Validates order_items input parameter. Raises serializers.ValidationError if validation failed.
+        Creates the order together with its OrderItem rows, outbox events and customer summary in one transaction.
         """
-        # don't accept empty order_items.
-        if not order_items:
-            raise serializers.ValidationError("Empty orders are not allowed. "
-                                              "You have to specify at least 1 position in order items.")
+        with transaction.atomic():
+            order = super(OrderSerializer, self).create(validated_data)
+            save_order_item_rows([order])
+            record_orders_created([order])
+            SummaryChanges().add(order).save()
+        return order
 
-        # don't accept order_items of other types
-        if not isinstance(order_items, list):
-            raise serializers.ValidationError("Empty orders are not allowed. "
-                                              "Order items should be array.")
+    def update(self, instance, validated_data):
+        """
+        Updates changed columns of the order only and replaces its OrderItem rows and its counts in the customer
+        summary in one transaction. Nothing is written if nothing changed.
+        """
+        changed = [field for field, value in validated_data.items() if getattr(instance, field) != value]
+        if not changed:
+            return instance
+        previous = Order(customer_email=instance.customer_email, delivery_status=instance.delivery_status,
+                         order_items=instance.order_items, created_at=instance.created_at)
+        with transaction.atomic():
+            for field in changed:
+                setattr(instance, field, validated_data[field])
+            instance.save(update_fields=changed + ['updated_at'])
+            if 'order_items' in changed:
+                save_order_item_rows([instance], replace=True)
+            if 'order_items' in changed or 'customer_email' in changed:
+                SummaryChanges().remove(previous).add(instance).save()
+        return instance
 
+    def validate_order_items(self, order_items: List[Dict]) -> List[Dict]:
+        """
+        Validates order_items input parameter. Raises serializers.ValidationError if validation failed.
+        """
         # check the content of each item and deduplicate items of the same flavour and size if any
-        for item in order_items:
-            self.validate_order_item_element(item)
+        order_items_validator(order_items)
 
         # return deduplicated version of order_items
-        return list(self.deduplicate(order_items))
+        return self.deduplicate(order_items)
 
     @staticmethod
-    def deduplicate(order_items: List[Dict]):
+    def deduplicate(order_items: List[Dict], policy: str = None) -> List[Dict]:
         """
-        Generator, which removes duplicates for order items with the same 'flavour' and 'size'.
+        Removes duplicates for order items with the same 'flavour' and 'size'.
+        Duplicates are handled according to the policy (ORDER_ITEMS_DEDUPLICATION setting by default).
         """
-        soi = sorted(order_items, key=keyfunc)
-        for key, group in itertools.groupby(soi, key=keyfunc):
-            yield list(group)[0]
+        if policy is None:
+            policy = getattr(settings, 'ORDER_ITEMS_DEDUPLICATION', DEDUPLICATE_KEEP_FIRST)
+        return merge_order_items(order_items, policy)
 
     @staticmethod
     def validate_order_item_element(order_item: dict) -> None:
@@ -67,35 +221,113 @@ class OrderSerializer(serializers.ModelSerializer):
         Checks that order_item's element is valid (contains needed amount of parameters and their
         values are also valid).
         """
+        order_items_validator.validate_item(order_item)
+
+
+class OrderStatusBulkSerializer(serializers.Serializer):
+    """
+    Serializer class for PATCH method on /orders/status/. Orders are selected either by `ids` or by `filter`
+    (the same filters as the orders list has). Validated `filter` is replaced with the filtered queryset.
+    """
+    delivery_status = serializers.ChoiceField(choices=Order.DELIVERY_STATUSES)
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, required=False)
+    filter = serializers.DictField(required=False)
+
+    def validate_ids(self, ids: List[int]) -> List[int]:
+        max_items = getattr(settings, 'ORDERS_BULK_MAX_ITEMS', 10000)
+        if len(ids) > max_items:
+            raise serializers.ValidationError(f"Too many orders. At most {max_items} orders allowed per request.")
+        # keep the order of the first appearance
+        return list(dict.fromkeys(ids))
+
+    def validate_filter(self, value: Dict):
+        unknown = set(value) - set(OrderFilter.base_filters)
+        if unknown:
+            raise serializers.ValidationError(f"Unknown filters: {sorted(unknown)}")
+        if not any(value.values()):
+            raise serializers.ValidationError("Filter shouldn't be empty.")
+        filterset = OrderFilter(data=value, queryset=Order.objects.all())
+        if not filterset.is_valid():
+            raise serializers.ValidationError(filterset.errors)
+        return filterset.qs
+
+    def validate(self, attrs: Dict) -> Dict:
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError("Either ids or filter should be passed.")
+        return attrs
+
+
+class OrderStatsQuerySerializer(serializers.Serializer):
+    """
+    Serializer class for query params of GET method on /orders/stats/. Lists are comma separated.
+    """
+    group_by = serializers.CharField(required=False, default='')
+    since = serializers.CharField(required=False)
+    until = serializers.CharField(required=False)
+    delivery_status = serializers.CharField(required=False)
+    customer_email = serializers.CharField(required=False)
+    source = serializers.ChoiceField(choices=STATS_SOURCES, required=False)
+
+    def validate_group_by(self, value: str) -> List[str]:
+        dimensions = list(dict.fromkeys(name for name in value.split(',') if name))
+        unknown = [name for name in dimensions if name not in DIMENSIONS]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown dimensions: {unknown}. Must be one of: {list(DIMENSIONS)}")
+        return dimensions
+
+    def validate_since(self, value: str):
+        return self.validate_datetime(value)
+
+    def validate_until(self, value: str):
+        return self.validate_datetime(value)
 
-        # check the amount of parameters
-        if len(order_item) != len(Order.ORDER_ITEM_ATTRIBUTES):
-            raise serializers.ValidationError("Wrong order item format. "
-                                              "You have to specify exactly 3 attributes")
-
-        # check the names of parameters
-        if sorted(order_item.keys()) != sorted(Order.ORDER_ITEM_ATTRIBUTES):
-            raise serializers.ValidationError("Wrong order item format. "
-                                              f"You have to specify those attributes: {Order.ORDER_ITEM_ATTRIBUTES}")
-
-        # check 'flavour' value
-        if not order_item['flavour'] in Order.ITEM_FLAVOURS:
-            raise serializers.ValidationError("Wrong order item format. "
-                                              f"Flavour must be one of: {Order.ITEM_FLAVOURS}")
-        # check 'quantity' value
-        if not isinstance(order_item['quantity'], int):
-            raise serializers.ValidationError("Wrong order item format. "
-                                              "Quantity must be an integer")
-        # check 'quantity' > 0
-        if not order_item['quantity'] > 0:
-            raise serializers.ValidationError("Wrong order item format. Quantity must be > 0")
-
-        # check 'size' value
-        if not order_item['size'] in Order.ITEM_SIZES:
-            raise serializers.ValidationError("Wrong order item format. "
-                                              f"Size must be one of: {Order.ITEM_SIZES}")
-
-
-def keyfunc(x):
-    """ Simple function for sorting order_items"""
-    return x['flavour'], x['size']
+    @staticmethod
+    def validate_datetime(value: str):
+        parsed = parse_datetime_param(value)
+        if parsed is None:
+            raise serializers.ValidationError("ISO 8601 date or datetime is required.")
+        return parsed
+
+    def validate_delivery_status(self, value: str) -> List[str]:
+        statuses = [status for status in value.split(',') if status]
+        unknown = set(statuses) - {status for status, _ in Order.DELIVERY_STATUSES}
+        if unknown:
+            raise serializers.ValidationError(f"Unknown delivery statuses: {sorted(unknown)}")
+        return statuses
+
+
+class OrderClaimQuerySerializer(serializers.Serializer):
+    """
+    Serializer class for query params of POST method on /orders/claim/.
+    """
+    station = serializers.CharField(max_length=Order._meta.get_field('claimed_by').max_length)
+    max = serializers.IntegerField(min_value=1, required=False, default=10)
+    lease = serializers.IntegerField(min_value=1, required=False)
+    flavour = serializers.ChoiceField(choices=Order.ITEM_FLAVOURS, required=False)
+    size = serializers.ChoiceField(choices=Order.ITEM_SIZES, required=False)
+
+    def validate_max(self, value: int) -> int:
+        max_batch = get_claims_settings()['MAX_BATCH']
+        if value > max_batch:
+            raise serializers.ValidationError(f"At most {max_batch} orders could be claimed at once.")
+        return value
+
+    def validate_lease(self, value: int) -> int:
+        max_lease = get_claims_settings()['MAX_LEASE']
+        if value > max_lease:
+            raise serializers.ValidationError(f"Lease could be at most {max_lease} seconds.")
+        return value
+
+
+class CustomerSummarySerializer(serializers.ModelSerializer):
+    """
+    Serializer class for GET method on /customers/{email}/summary/.
+    """
+    favourite_flavour = serializers.ReadOnlyField()
+    favourite_size = serializers.ReadOnlyField()
+
+    class Meta:
+        model = CustomerSummary
+        fields = ['customer_email', 'orders', 'active_orders', 'last_order_at', 'favourite_flavour', 'favourite_size',
+                  'updated_at']
+        read_only_fields = fields
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from pizza_ordering.cache import invalidate_orders
+from pizza_ordering.models import Order
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_cached_order(sender, instance, **kwargs):
+    """
+    Drops cached payloads of the order (and cached list pages) on any change of the order.
+    """
+    invalidate_orders([instance.pk])
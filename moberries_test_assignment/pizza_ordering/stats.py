@@ -0,0 +1,230 @@
+"""
+Aggregated statistics of orders (number of orders, order items and pizzas) computed in the database.
+
+Live statistics unnest order_items with jsonb_array_elements and aggregate them with GROUP BY. The same numbers
+could be served from OrderStats summary table (hourly buckets), which is refreshed incrementally by refresh_order_stats
+command: only hours with orders changed since the previous refresh are recomputed. Orders deleted from the hours,
+which had no other changes, are reflected by the full refresh only.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.fields import DateTimeField
+
+from pizza_ordering.models import Order, OrderStats, OrderStatsRefresh
+
+DIMENSIONS = ('flavour', 'size', 'delivery_status', 'day', 'hour', 'customer_email')
+ITEM_DIMENSIONS = ('flavour', 'size')
+SUMMARY_DIMENSIONS = ('flavour', 'size', 'delivery_status', 'day', 'hour')
+
+SOURCE_LIVE = 'live'
+SOURCE_SUMMARY = 'summary'
+SOURCE_AUTO = 'auto'  # summary, if it was refreshed recently and could answer the query, otherwise live
+STATS_SOURCES = (SOURCE_LIVE, SOURCE_SUMMARY, SOURCE_AUTO)
+
+# orders changed within this period before the previous refresh are summarized again, since their transactions
+# could be committed after it
+REFRESH_LAG = timedelta(minutes=5)
+REFRESH_LOCK_ID = 7237001
+
+# order_items documents, which are not arrays (e.g. JSON strings saved bypassing the API), have no items
+ITEMS_JOIN = """
+    {join} LATERAL jsonb_array_elements(
+        CASE WHEN jsonb_typeof(o.order_items) = 'array' THEN o.order_items ELSE '[]'::jsonb END) AS item ON true
+"""
+QUANTITY = "CASE WHEN jsonb_typeof(item->'quantity') = 'number' THEN (item->>'quantity')::numeric END"
+# items without flavour or size are counted in totals only
+ITEM_COMPLETE = "item->>'flavour' IS NOT NULL AND item->>'size' IS NOT NULL"
+
+LIVE_EXPRESSIONS = {
+    'flavour': "item->>'flavour'",
+    'size': "item->>'size'",
+    'delivery_status': "o.delivery_status",
+    'customer_email': "o.customer_email",
+    'day': "date_trunc('day', o.created_at AT TIME ZONE %(tz)s)",
+    'hour': "date_trunc('hour', o.created_at AT TIME ZONE %(tz)s)",
+}
+SUMMARY_EXPRESSIONS = {
+    'flavour': "s.flavour",
+    'size': "s.size",
+    'delivery_status': "s.delivery_status",
+    'day': "date_trunc('day', s.bucket AT TIME ZONE %(tz)s)",
+    'hour': "date_trunc('hour', s.bucket AT TIME ZONE %(tz)s)",
+}
+
+
+def order_stats(dimensions: List[str], since: datetime = None, until: datetime = None,
+                delivery_statuses: List[str] = None, customer_email: str = None,
+                source: str = SOURCE_AUTO) -> Dict:
+    """
+    Statistics grouped by dimensions for orders created in [since, until). Returns the source the numbers were
+    taken from, time of the summary refresh (for summary source) and rows with dimensions and numbers.
+    Auto source doesn't use the summary refreshed more than ORDERS_STATS_MAX_STALENESS seconds ago.
+    """
+    state = None
+    if source != SOURCE_LIVE:
+        state = OrderStatsRefresh.objects.filter(refreshed_at__isnull=False).first()
+        if source == SOURCE_AUTO:
+            supported = (state is not None and is_fresh(state.refreshed_at)
+                         and summary_supports(dimensions, since, until, customer_email))
+            source = SOURCE_SUMMARY if supported else SOURCE_LIVE
+
+    filters = {'since': since, 'until': until, 'delivery_statuses': delivery_statuses,
+               'customer_email': customer_email}
+    if source == SOURCE_LIVE:
+        sql, params = live_query(dimensions, **filters)
+    else:
+        sql, params = summary_query(dimensions, **filters)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    tz = timezone.get_current_timezone()
+    datetime_field = DateTimeField()
+
+    def dimension_value(name, value):
+        if name == 'day':
+            return value.date().isoformat()
+        if name == 'hour':
+            return datetime_field.to_representation(timezone.make_aware(value, tz))
+        return value
+
+    results = []
+    for row in rows:
+        result = {name: dimension_value(name, value) for name, value in zip(dimensions, row)}
+        result.update(orders=int(row[-3] or 0), items=int(row[-2] or 0), pizzas=int(row[-1] or 0))
+        results.append(result)
+    return {'source': source,
+            'refreshed_at': datetime_field.to_representation(state.refreshed_at) if source == SOURCE_SUMMARY
+            and state is not None else None,
+            'results': results}
+
+
+def is_fresh(refreshed_at: datetime) -> bool:
+    max_staleness = getattr(settings, 'ORDERS_STATS_MAX_STALENESS', None)
+    return max_staleness is None or timezone.now() - refreshed_at <= timedelta(seconds=max_staleness)
+
+
+def summary_supports(dimensions: List[str], since: Optional[datetime], until: Optional[datetime],
+                     customer_email: Optional[str]) -> bool:
+    """
+    Whether the summary could answer the query: no customer dimensions, both or none of item dimensions
+    (numbers of orders per flavour or size alone could not be summed up from flavour and size rows),
+    boundaries aligned to hours.
+    """
+    if customer_email or not set(dimensions) <= set(SUMMARY_DIMENSIONS):
+        return False
+    if len(set(dimensions) & set(ITEM_DIMENSIONS)) == 1:
+        return False
+    if timezone.localtime().utcoffset().total_seconds() % 3600:
+        return False
+    return all(boundary is None or boundary.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+               == boundary for boundary in (since, until))
+
+
+def filter_conditions(alias: str, created_at: str, since, until, delivery_statuses, customer_email):
+    conditions, params = [], {}
+    if since is not None:
+        conditions.append(f"{alias}.{created_at} >= %(since)s")
+        params['since'] = since
+    if until is not None:
+        conditions.append(f"{alias}.{created_at} < %(until)s")
+        params['until'] = until
+    if delivery_statuses:
+        conditions.append(f"{alias}.delivery_status = ANY(%(delivery_statuses)s)")
+        params['delivery_statuses'] = list(delivery_statuses)
+    if customer_email:
+        conditions.append(f"{alias}.customer_email = %(customer_email)s")
+        params['customer_email'] = customer_email
+    return conditions, params
+
+
+def group_by_clause(expressions: List[str]) -> str:
+    positions = ', '.join(str(position) for position in range(1, len(expressions) + 1))
+    return f"GROUP BY {positions} ORDER BY {positions}" if expressions else ''
+
+
+def live_query(dimensions: List[str], **filters):
+    expressions = [LIVE_EXPRESSIONS[name] for name in dimensions]
+    by_item = bool(set(dimensions) & set(ITEM_DIMENSIONS))
+    conditions, params = filter_conditions('o', 'created_at', **filters)
+    if by_item:
+        conditions.append(ITEM_COMPLETE)
+    params['tz'] = timezone.get_current_timezone_name()
+    sql = f"""
+        SELECT {''.join(f'{expression}, ' for expression in expressions)}
+               COUNT(DISTINCT o.id), COUNT(item), COALESCE(SUM({QUANTITY}), 0)
+        FROM {Order._meta.db_table} AS o
+        {ITEMS_JOIN.format(join='JOIN' if by_item else 'LEFT JOIN')}
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        {group_by_clause(expressions)}
+    """
+    return sql, params
+
+
+def summary_query(dimensions: List[str], **filters):
+    expressions = [SUMMARY_EXPRESSIONS[name] for name in dimensions]
+    by_item = bool(set(dimensions) & set(ITEM_DIMENSIONS))
+    conditions, params = filter_conditions('s', 'bucket', **filters)
+    conditions.append(f"s.flavour IS {'NOT ' if by_item else ''}NULL")
+    params['tz'] = timezone.get_current_timezone_name()
+    sql = f"""
+        SELECT {''.join(f'{expression}, ' for expression in expressions)}
+               SUM(s.orders), SUM(s.items), SUM(s.pizzas)
+        FROM {OrderStats._meta.db_table} AS s
+        WHERE {' AND '.join(conditions)}
+        {group_by_clause(expressions)}
+    """
+    return sql, params
+
+
+def refresh_summary(full: bool = False) -> int:
+    """
+    Recomputes OrderStats for hours with orders changed since the previous refresh (or for all the hours,
+    when full or never refreshed). Concurrent refreshes wait for each other. Returns number of recomputed hours
+    (None for the full refresh).
+    """
+    stats_table, orders_table = OrderStats._meta.db_table, Order._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [REFRESH_LOCK_ID])
+        state = OrderStatsRefresh.objects.first() or OrderStatsRefresh()
+        started_at = timezone.now()
+
+        # date_trunc() goes by the session time zone, which is UTC for Django connections
+        if full or state.watermark is None:
+            buckets = None
+            cursor.execute(f"DELETE FROM {stats_table}")
+            bucket_join, params = '', {}
+        else:
+            cursor.execute(f"SELECT DISTINCT date_trunc('hour', created_at) FROM {orders_table} WHERE updated_at > %s",
+                           [state.watermark - REFRESH_LAG])
+            buckets = [bucket for bucket, in cursor.fetchall()]
+            cursor.execute(f"DELETE FROM {stats_table} WHERE bucket = ANY(%s)", [buckets])
+            bucket_join = """JOIN unnest(%(buckets)s::timestamptz[]) AS b(bucket)
+                             ON o.created_at >= b.bucket AND o.created_at < b.bucket + interval '1 hour'"""
+            params = {'buckets': buckets}
+
+        if buckets is None or buckets:
+            insert = f"""
+                INSERT INTO {stats_table} (bucket, delivery_status, flavour, size, orders, items, pizzas)
+                SELECT date_trunc('hour', o.created_at), o.delivery_status, {{item_columns}},
+                       COUNT(DISTINCT o.id), COUNT(item), COALESCE(SUM({QUANTITY}), 0)
+                FROM {orders_table} AS o
+                {bucket_join}
+                {{items_join}}
+                {{where}}
+                GROUP BY {{group_by}}
+            """
+            cursor.execute(insert.format(item_columns='NULL, NULL', items_join=ITEMS_JOIN.format(join='LEFT JOIN'),
+                                         where='', group_by='1, 2'), params)
+            cursor.execute(insert.format(item_columns="item->>'flavour', item->>'size'",
+                                         items_join=ITEMS_JOIN.format(join='JOIN'),
+                                         where=f'WHERE {ITEM_COMPLETE}', group_by='1, 2, 3, 4'), params)
+
+        state.watermark = state.refreshed_at = started_at
+        state.save()
+    return len(buckets) if buckets is not None else None
@@ -1,8 +1,58 @@
+import asyncio
+import importlib
+import csv
+import io
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from functools import partial
-
-from django.test import TestCase, Client
-
-from pizza_ordering.models import Order
+from unittest import mock
+
+import psycopg2
+from django.apps import apps
+from django.core.management import CommandError, call_command
+from django.core.management.base import SystemCheckError
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connection
+from django.test import TestCase, Client, SimpleTestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+
+from pizza_ordering import fastjson
+from pizza_ordering.asgi import OrdersASGIApplication
+from pizza_ordering.benchmarking import SUITE_ACTIONS, OutboxStandIn, compare_results, run_suite, seed_orders
+from pizza_ordering.cache import DjangoCache, LRUCache, OrderCache, get_order_cache, reset_order_cache
+from pizza_ordering.checks import check_order_items_deduplication
+from pizza_ordering.conditional import order_validators, parse_order_etag
+from pizza_ordering.customers import SummaryChanges, rebuild_summaries
+from pizza_ordering.events import InProcessBroker, format_event, get_broker, status_event
+from pizza_ordering.explain import (explain_analyze, explain_order_views, index_names, order_view_scenarios,
+                                    seed_plans_data, sequential_scans)
+from pizza_ordering.filters import OrderFilter
+from pizza_ordering.idempotency import get_front_cache, purge_expired_keys
+from pizza_ordering.metrics import Histogram, clear_metrics
+from pizza_ordering.models import (CustomerSummary, IdempotencyKey, Order, OrderItem, OrderStats, OrderStatsRefresh,
+                                   OutboxEvent)
+from pizza_ordering.outbox import (EVENT_DELIVERY_STATUS, EVENT_ORDER_CREATED, HttpDelivery, backoff, claim_due_events,
+                                   dispatch_batch, get_settings as get_outbox_settings, lease_seconds, pending_count,
+                                   record_orders_created, record_status_changes)
+from pizza_ordering.parsers import FastJSONParser
+from pizza_ordering.partitions import (ARCHIVE_SCHEMA, PARTITIONS_AHEAD, add_months, archive_partitions, convert,
+                                       create_partitions, is_partitioned, month_start, partition_name, partitions,
+                                       revert)
+from pizza_ordering.renderers import FastJSONRenderer
+from pizza_ordering.replicas import ReplicaPool, ReplicaRouter, reads_from
+from pizza_ordering.serializers import (DEDUPLICATE_KEEP_FIRST, DEDUPLICATE_SUM, ORDER_FIELDS, OrderSerializer,
+                                        merge_order_items, orders_to_dicts)
+from pizza_ordering.stats import refresh_summary
+from pizza_ordering.transitions import allowed_sources
 
 
 class OrdersApiBaseTestCase(TestCase):
@@ -10,6 +60,10 @@ class OrdersApiBaseTestCase(TestCase):
     def setUp(self):
         # initialize test client
         self.client = Client()
+        # cached payloads of the previous tests are not valid, since their data is rolled back
+        order_cache = get_order_cache()
+        if order_cache is not None:
+            order_cache.clear()
 
 
 class GetOrdersBaseTestCase(OrdersApiBaseTestCase):
@@ -135,6 +189,138 @@ class GetOrdersBaseTestCase(OrdersApiBaseTestCase):
         self.assertListEqual(response_emails, email_to_check)
 
 
+class GetOrdersFilterByOrderItemsTestCase(OrdersApiBaseTestCase):
+    """Tests for filtering GET /api/v1/orders/ by the content of order_items """
+    def setUp(self):
+        super(GetOrdersFilterByOrderItemsTestCase, self).setUp()
+        self.url = '/api/v1/orders/'
+        self.hawaii_big = Order.objects.create(
+            customer_email="test1@moberries.com",
+            order_items=[{"flavour": "hawaii", "quantity": 3, "size": "big"},
+                         {"flavour": "fungi", "quantity": 1, "size": "small"}])
+        self.hawaii_small = Order.objects.create(
+            customer_email="test2@moberries.com",
+            order_items=[{"flavour": "hawaii", "quantity": 1, "size": "small"},
+                         {"flavour": "fungi", "quantity": 5, "size": "big"}])
+        self.hawaii_big_delivered = Order.objects.create(
+            customer_email="test3@moberries.com",
+            delivery_status="delivered",
+            order_items=[{"flavour": "hawaii", "quantity": 1, "size": "big"}])
+
+    def get_ids(self, query):
+        response = self.client.get(f'{self.url}?{query}')
+        self.assertEqual(response.status_code, 200)
+        return {order['id'] for order in response.json()['results']}
+
+    def test_filter_by_flavour(self):
+        self.assertSetEqual(self.get_ids('flavour=hawaii'),
+                            {self.hawaii_big.id, self.hawaii_small.id, self.hawaii_big_delivered.id})
+        self.assertSetEqual(self.get_ids('flavour=pepperoni'), set())
+
+    def test_filter_by_flavour_and_size_matches_same_item(self):
+        # "hawaii small" + "fungi big" order must not match "hawaii big"
+        self.assertSetEqual(self.get_ids('flavour=hawaii&size=big'),
+                            {self.hawaii_big.id, self.hawaii_big_delivered.id})
+
+    def test_filter_by_flavour_size_and_delivery_status(self):
+        self.assertSetEqual(self.get_ids('flavour=hawaii&size=big&delivery_status=not_in_delivery'),
+                            {self.hawaii_big.id})
+
+    def test_filter_by_min_quantity(self):
+        self.assertSetEqual(self.get_ids('min_quantity=3'), {self.hawaii_big.id, self.hawaii_small.id})
+        self.assertSetEqual(self.get_ids('flavour=hawaii&min_quantity=2'), {self.hawaii_big.id})
+        self.assertSetEqual(self.get_ids('flavour=fungi&size=big&min_quantity=5'), {self.hawaii_small.id})
+        for min_quantity in ('1.5', '0', 'many'):
+            self.assertEqual(self.client.get(self.url, {'flavour': 'hawaii', 'min_quantity': min_quantity}).status_code,
+                             400)
+
+    def test_filter_by_wrong_flavour(self):
+        response = self.client.get(f'{self.url}?flavour=test')
+        self.assertEqual(response.status_code, 400)
+
+    def test_filter_by_order_items_uses_gin_index(self):
+        queryset = OrderFilter.filter_by_order_item(Order.objects.all(), flavour="hawaii", size="big",
+                                                    min_quantity=2)
+        with connection.cursor() as cursor:
+            # the table is tiny, so make sequential scans unattractive for the planner
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = queryset.explain()
+
+        self.assertIn('order_items_path_ops_idx', plan)
+        self.assertNotIn('Seq Scan', plan)
+
+
+class GetOrdersCursorPaginationTestCase(OrdersApiBaseTestCase):
+    """Tests for keyset (cursor) pagination of GET /api/v1/orders/ method """
+    def setUp(self):
+        super(GetOrdersCursorPaginationTestCase, self).setUp()
+        self.url = '/api/v1/orders/'
+        self.order_items = [{"flavour": "hawaii", "quantity": 2, "size": "small"}]
+        # pre-create 5 orders
+        self.orders = [Order.objects.create(customer_email=f"test{i}@moberries.com",
+                                            order_items=self.order_items)
+                       for i in range(5)]
+
+    def test_cursor_pagination_walks_all_orders(self):
+        # Issue GET requests following "next" links
+        ids = []
+        url = f'{self.url}?cursor=&limit=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(order['id'] for order in response.json()['results'])
+            url = response.json()['next']
+
+        # check that every order was returned exactly once, newest first
+        self.assertListEqual(ids, [order.id for order in reversed(self.orders)])
+
+    def test_cursor_pagination_previous_link(self):
+        first_page = self.client.get(f'{self.url}?cursor=&limit=2').json()
+        self.assertIsNone(first_page['previous'])
+
+        second_page = self.client.get(first_page['next']).json()
+        self.assertIsNotNone(second_page['previous'])
+
+        # check that "previous" link of the second page leads back to the first page
+        response = self.client.get(second_page['previous'])
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(response.json()['results'], first_page['results'])
+
+    def test_cursor_pagination_skips_count_by_default(self):
+        response = self.client.get(f'{self.url}?cursor=')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['count'])
+
+        # exact count could be requested explicitly
+        response = self.client.get(f'{self.url}?cursor=&count=exact')
+        self.assertEqual(response.json()['count'], 5)
+
+    def test_offset_pagination_estimated_count(self):
+        response = self.client.get(f'{self.url}?limit=2&count=estimate')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.json()['count'], int)
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertIsNotNone(response.json()['next'])
+
+    def test_offset_pagination_without_count(self):
+        response = self.client.get(f'{self.url}?limit=2&offset=4&count=none')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['count'])
+        self.assertEqual(len(response.json()['results']), 1)
+        # check that there is no next page after the last order
+        self.assertIsNone(response.json()['next'])
+
+    def test_cursor_pagination_respects_filters(self):
+        response = self.client.get(f'{self.url}?cursor=&customer_email=test1@moberries.com')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual(response.json()['results'][0]['id'], self.orders[1].id)
+
+    def test_cursor_pagination_invalid_cursor(self):
+        response = self.client.get(f'{self.url}?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
 class PostOrdersBaseTestCase(OrdersApiBaseTestCase):
     """Tests for POST /api/v1/orders/ method """
     def setUp(self):
@@ -255,6 +441,24 @@ class PostOrdersBaseTestCase(OrdersApiBaseTestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn(b'Quantity must be > 0"', response.content)
 
+    def test_post_orders_negative_unhashable_flavour_value(self):
+        response = self.post(data={"customer_email": "test@moberries.com",
+                                   "order_items": [{"flavour": ["hawaii"],
+                                                    "size": Order.ITEM_SIZES[0],
+                                                    "quantity": 3}]})
+
+        # check arrays are not accepted as flavour
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'Flavour must be one of', response.content)
+
+    def test_post_orders_negative_order_item_not_object(self):
+        response = self.post(data={"customer_email": "test@moberries.com",
+                                   "order_items": ["abc"]})
+
+        # check order item of other type is prohibited
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'You have to specify those attributes', response.content)
+
     def test_post_orders_order_items_deduplication(self):
         response = self.post(data={
             "customer_email": "test@moberries.com",
@@ -281,6 +485,142 @@ class PostOrdersBaseTestCase(OrdersApiBaseTestCase):
         # check we have 2 order_items rather than 3 (was in initial request)
         self.assertEqual(len(response.json()['order_items']), 2)
 
+    @override_settings(ORDER_ITEMS_DEDUPLICATION=DEDUPLICATE_SUM)
+    def test_post_orders_order_items_sum_quantities(self):
+        response = self.post(data={
+            "customer_email": "test@moberries.com",
+            "order_items": [
+                {"flavour": Order.ITEM_FLAVOURS[0], "size": Order.ITEM_SIZES[0], "quantity": 2},
+                # duplicate for the first item. Quantities will be summed up.
+                {"flavour": Order.ITEM_FLAVOURS[0], "size": Order.ITEM_SIZES[0], "quantity": 4},
+            ]
+        })
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['order_items']), 1)
+        self.assertEqual(response.json()['order_items'][0]['quantity'], 6)
+
+
+class PostOrdersBulkTestCase(OrdersApiBaseTestCase):
+    """Tests for POST /api/v1/orders/bulk/ method """
+    def setUp(self):
+        super(PostOrdersBulkTestCase, self).setUp()
+        self.url = '/api/v1/orders/bulk/'
+        self.valid_order = {"customer_email": "test@moberries.com",
+                            "order_items": [{"flavour": "hawaii", "quantity": 2, "size": "small"}]}
+
+    def test_post_orders_bulk_positive(self):
+        response = self.client.post(self.url, data=[self.valid_order] * 3, content_type='application/json')
+
+        # Check that the response is 201 Created and all the orders were saved
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['created']), 3)
+        self.assertListEqual(response.json()['errors'], [])
+        self.assertEqual(Order.objects.count(), 3)
+
+    def test_post_orders_bulk_reports_errors_by_index(self):
+        invalid_order = {"customer_email": "test", "order_items": []}
+        response = self.client.post(self.url, data=[self.valid_order, invalid_order, self.valid_order],
+                                    content_type='application/json')
+
+        # Check that valid orders were saved and the invalid one was reported
+        self.assertEqual(response.status_code, 201)
+        self.assertListEqual([created['index'] for created in response.json()['created']], [0, 2])
+        self.assertEqual(len(response.json()['errors']), 1)
+        error = response.json()['errors'][0]
+        self.assertEqual(error['index'], 1)
+        self.assertIn('customer_email', error['errors'])
+        self.assertIn('order_items', error['errors'])
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_post_orders_bulk_deduplicates_order_items(self):
+        order = {"customer_email": "test@moberries.com",
+                 "order_items": [{"flavour": "hawaii", "quantity": 2, "size": "small"},
+                                 {"flavour": "hawaii", "quantity": 4, "size": "small"}]}
+        response = self.client.post(self.url, data=[order], content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        saved_order = Order.objects.get(id=response.json()['created'][0]['id'])
+        self.assertEqual(len(saved_order.order_items), 1)
+
+    def test_post_orders_bulk_ndjson(self):
+        body = "\n".join(json.dumps(order) for order in [self.valid_order, self.valid_order]) + "\n"
+        response = self.client.post(self.url, data=body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['created']), 2)
+
+    def test_post_orders_bulk_negative_all_invalid(self):
+        response = self.client.post(self.url, data=[{"customer_email": "test"}], content_type='application/json')
+
+        # check nothing is saved when there are no valid orders
+        self.assertEqual(response.status_code, 400)
+        self.assertListEqual(response.json()['created'], [])
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_post_orders_bulk_negative_not_array(self):
+        response = self.client.post(self.url, data=self.valid_order, content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'Bulk orders should be non-empty array', response.content)
+
+    def test_post_orders_bulk_negative_broken_ndjson(self):
+        response = self.client.post(self.url, data='{"customer_email": "test"}\n{broken',
+                                    content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'line 2', response.content)
+
+
+class MergeOrderItemsTestCase(SimpleTestCase):
+    """Tests for deduplication of order items """
+    def setUp(self):
+        self.order_items = [
+            {"flavour": "hawaii", "quantity": 2, "size": "small"},
+            {"flavour": "fungi", "quantity": 1, "size": "big"},
+            # duplicate of the first item
+            {"flavour": "hawaii", "quantity": 3, "size": "small"},
+            # same flavour, but another size
+            {"flavour": "hawaii", "quantity": 5, "size": "big"},
+        ]
+
+    def test_merge_keep_first(self):
+        merged = merge_order_items(self.order_items, DEDUPLICATE_KEEP_FIRST)
+
+        # check that the first of duplicates is kept and items are sorted by flavour and size
+        self.assertListEqual(merged, [{"flavour": "fungi", "quantity": 1, "size": "big"},
+                                      {"flavour": "hawaii", "quantity": 5, "size": "big"},
+                                      {"flavour": "hawaii", "quantity": 2, "size": "small"}])
+
+    def test_merge_sum(self):
+        merged = merge_order_items(self.order_items, DEDUPLICATE_SUM)
+
+        # check that quantities of duplicates are summed up
+        self.assertListEqual(merged, [{"flavour": "fungi", "quantity": 1, "size": "big"},
+                                      {"flavour": "hawaii", "quantity": 5, "size": "big"},
+                                      {"flavour": "hawaii", "quantity": 5, "size": "small"}])
+        # check that input items are left untouched
+        self.assertEqual(self.order_items[0]["quantity"], 2)
+
+    def test_merge_many_duplicates(self):
+        merged = merge_order_items(self.order_items * 1000, DEDUPLICATE_SUM)
+
+        self.assertEqual(len(merged), 3)
+        self.assertEqual(merged[2]["quantity"], 5000)
+
+    def test_merge_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            merge_order_items(self.order_items, "test")
+
+    def test_unknown_policy_setting_checked(self):
+        self.assertEqual(check_order_items_deduplication(None), [])
+        with override_settings(ORDER_ITEMS_DEDUPLICATION='summ'):
+            errors = check_order_items_deduplication(None)
+            self.assertEqual([error.id for error in errors], ['pizza_ordering.E001'])
+            # reported on startup and by manage.py check
+            with self.assertRaises(SystemCheckError):
+                call_command('check', stdout=io.StringIO())
+
 
 class GetOrderByIdBaseTestCase(OrdersApiBaseTestCase):
     """Tests for GET /api/v1/orders/{order_id}/ method """
@@ -458,3 +798,2198 @@ class DeleteOrderByIdBaseTestCase(OrdersApiBaseTestCase):
         # check that order vanished from DB
         response = self.client.get(path=f"{self.url}{order.id}/")
         self.assertEqual(response.status_code, 404)
+
+
+class OrderItemRowsTestCase(OrdersApiBaseTestCase):
+    """Tests for OrderItem rows, which duplicate order_items JSON """
+    def setUp(self):
+        super(OrderItemRowsTestCase, self).setUp()
+        self.url = '/api/v1/orders/'
+        self.order_items = [{"flavour": "hawaii", "quantity": 2, "size": "small"},
+                            {"flavour": "fungi", "quantity": 9, "size": "big"}]
+
+    def get_rows(self, order_id):
+        return [row.as_dict() for row in OrderItem.objects.filter(order_id=order_id).order_by('id')]
+
+    def test_post_order_creates_rows(self):
+        response = self.client.post(self.url, content_type='application/json',
+                                    data={"customer_email": "test@moberries.com", "order_items": self.order_items})
+        self.assertEqual(response.status_code, 201)
+
+        # check rows are the same as order_items (deduplicated and sorted)
+        self.assertListEqual(self.get_rows(response.json()['id']), response.json()['order_items'])
+
+    def test_put_order_replaces_rows(self):
+        order_id = self.client.post(self.url, content_type='application/json',
+                                    data={"customer_email": "test@moberries.com",
+                                          "order_items": self.order_items}).json()['id']
+        order_items_updated = [{"flavour": "pepperoni", "quantity": 1, "size": "big"}]
+
+        response = self.client.put(f"{self.url}{order_id}/", content_type='application/json',
+                                   data={"customer_email": "test@moberries.com", "order_items": order_items_updated})
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(self.get_rows(order_id), order_items_updated)
+
+    def test_post_orders_bulk_creates_rows(self):
+        response = self.client.post(f'{self.url}bulk/', content_type='application/json',
+                                    data=[{"customer_email": "test@moberries.com",
+                                           "order_items": self.order_items}] * 2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(OrderItem.objects.count(), 4)
+
+    def test_delete_order_deletes_rows(self):
+        order_id = self.client.post(self.url, content_type='application/json',
+                                    data={"customer_email": "test@moberries.com",
+                                          "order_items": self.order_items}).json()['id']
+        self.client.delete(f"{self.url}{order_id}/")
+        self.assertFalse(OrderItem.objects.filter(order_id=order_id).exists())
+
+    def test_render_order_items_from_rows(self):
+        order_id = self.client.post(self.url, content_type='application/json',
+                                    data={"customer_email": "test@moberries.com",
+                                          "order_items": self.order_items}).json()['id']
+        from_json = self.client.get(f"{self.url}{order_id}/").json()
+        list_from_json = self.client.get(self.url).json()
+
+        # check responses are the same regardless of order_items source
+        with override_settings(ORDER_ITEMS_SOURCE='rows'):
+            self.assertEqual(self.client.get(f"{self.url}{order_id}/").json(), from_json)
+            self.assertEqual(self.client.get(self.url).json(), list_from_json)
+
+    def test_backfill_order_items(self):
+        # pre-create orders bypassing serializer, so they don't have rows
+        order = Order.objects.create(customer_email="test@moberries.com", order_items=self.order_items)
+        legacy_order = Order.objects.create(customer_email="test@moberries.com",
+                                            order_items=json.dumps(self.order_items))
+
+        migration = importlib.import_module('pizza_ordering.migrations.0004_backfill_order_items')
+        with connection.schema_editor() as schema_editor:
+            migration.backfill_order_items(apps, schema_editor)
+
+        self.assertEqual(len(self.get_rows(order.id)), 2)
+        self.assertEqual(len(self.get_rows(legacy_order.id)), 2)
+
+
+class OrdersCacheTestCase(OrdersApiBaseTestCase):
+    """Tests for caching of GET /api/v1/orders/ and GET /api/v1/orders/{order_id}/ methods """
+    def setUp(self):
+        super(OrdersCacheTestCase, self).setUp()
+        self.url = '/api/v1/orders/'
+        self.order = Order.objects.create(customer_email="test1@moberries.com",
+                                          order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+
+    def test_retrieve_cached(self):
+        response = self.client.get(f"{self.url}{self.order.id}/")
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        # check the second request is served from cache with the same payload
+        cached_response = self.client.get(f"{self.url}{self.order.id}/")
+        self.assertEqual(cached_response['X-Cache'], 'HIT')
+        self.assertEqual(cached_response.json(), response.json())
+
+    def test_retrieve_invalidated_on_patch(self):
+        self.client.get(f"{self.url}{self.order.id}/")
+        self.client.patch(f"{self.url}{self.order.id}/", data={"delivery_status": "delivered"},
+                          content_type='application/json')
+
+        response = self.client.get(f"{self.url}{self.order.id}/")
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['delivery_status'], 'delivered')
+
+    def test_retrieve_cached_by_canonical_id(self):
+        self.client.get(f"{self.url}0{self.order.id}/")
+        self.assertEqual(self.client.get(f"{self.url}{self.order.id}/")['X-Cache'], 'HIT')
+
+        # check the entry filled through a non-canonical id is invalidated too
+        self.client.patch(f"{self.url}{self.order.id}/", data={"delivery_status": "delivered"},
+                          content_type='application/json')
+        response = self.client.get(f"{self.url}0{self.order.id}/")
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['delivery_status'], 'delivered')
+
+        self.assertEqual(self.client.get(f"{self.url}abc/").status_code, 404)
+
+    def test_retrieve_invalidated_on_delete(self):
+        self.client.get(f"{self.url}{self.order.id}/")
+        self.client.delete(f"{self.url}{self.order.id}/")
+
+        response = self.client.get(f"{self.url}{self.order.id}/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_list_cached_by_normalized_query(self):
+        response = self.client.get(f"{self.url}?limit=5&customer_email=test1@moberries.com")
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        # check the order of query params doesn't matter
+        cached_response = self.client.get(f"{self.url}?customer_email=test1@moberries.com&limit=5")
+        self.assertEqual(cached_response['X-Cache'], 'HIT')
+        self.assertEqual(cached_response.json(), response.json())
+
+    def test_list_invalidated_on_create(self):
+        self.assertEqual(self.client.get(self.url).json()['count'], 1)
+        self.client.post(self.url, content_type='application/json',
+                         data={"customer_email": "test2@moberries.com",
+                               "order_items": [{"flavour": "hawaii", "quantity": 2, "size": "small"}]})
+
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_list_invalidated_on_bulk_create(self):
+        self.client.get(self.url)
+        self.client.post(f"{self.url}bulk/", content_type='application/json',
+                         data=[{"customer_email": "test2@moberries.com",
+                                "order_items": [{"flavour": "hawaii", "quantity": 2, "size": "small"}]}])
+
+        self.assertEqual(self.client.get(self.url).json()['count'], 2)
+
+    def test_cache_stats(self):
+        self.client.get(f"{self.url}{self.order.id}/")
+        self.client.get(f"{self.url}{self.order.id}/")
+
+        stats = self.client.get(f"{self.url}cache-stats/").json()
+        self.assertTrue(stats['enabled'])
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    @override_settings(ORDERS_CACHE={'BACKEND': 'django', 'CACHE_ALIAS': 'default'})
+    def test_django_cache_backend(self):
+        get_order_cache().clear()
+        self.client.get(f"{self.url}{self.order.id}/")
+        self.assertEqual(self.client.get(f"{self.url}{self.order.id}/")['X-Cache'], 'HIT')
+
+        self.client.patch(f"{self.url}{self.order.id}/", data={"delivery_status": "delivered"},
+                          content_type='application/json')
+        self.assertEqual(self.client.get(f"{self.url}{self.order.id}/")['X-Cache'], 'MISS')
+
+    def test_order_not_stored_after_concurrent_invalidation(self):
+        order_cache = OrderCache(DjangoCache('default', ttl=60), 'test')
+        order_cache.clear()
+        generation = order_cache.generation()
+        set_value = order_cache.backend.cache.set
+
+        def set_during_write(*args):
+            # a writer increments the generation between the reader's check and its set, the writer's delete
+            # of the key could come before the set
+            set_value(*args)
+            order_cache.invalidate([])
+
+        with mock.patch.object(order_cache.backend.cache, 'set', side_effect=set_during_write):
+            order_cache.set_order(1, {'data': {}}, generation)
+        self.assertIsNone(order_cache.get_order(1))
+
+        order_cache.set_order(1, {'data': {}}, order_cache.generation())
+        self.assertEqual(order_cache.get_order(1), {'data': {}})
+
+    @override_settings(ORDERS_CACHE={'BACKEND': None})
+    def test_cache_disabled(self):
+        response = self.client.get(f"{self.url}{self.order.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('X-Cache'))
+
+
+class LRUCacheTestCase(SimpleTestCase):
+    """Tests for in-process LRU cache """
+    def test_max_size_eviction(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # touch 'a', so 'b' becomes the least recently used one
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl_expiration(self):
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_counters_are_not_evicted(self):
+        cache = LRUCache(max_size=1, ttl=60)
+        cache.incr('generation')
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        self.assertEqual(cache.get_counter('generation'), 1)
+
+    def test_set_if_counter(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set_if_counter('a', 1, 'generation', 0)
+        cache.incr('generation')
+        cache.set_if_counter('b', 2, 'generation', 0)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+
+
+class ConditionalRequestsTestCase(OrdersApiBaseTestCase):
+    """Tests for ETag/Last-Modified support of the orders API """
+    def setUp(self):
+        super(ConditionalRequestsTestCase, self).setUp()
+        self.url = '/api/v1/orders/'
+        self.order = Order.objects.create(customer_email="test1@moberries.com",
+                                          order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        self.order_url = f"{self.url}{self.order.id}/"
+
+    def test_retrieve_not_modified(self):
+        response = self.client.get(self.order_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        # check unchanged order gives 304 with empty body (both for cached and not cached payload)
+        for _ in range(2):
+            response_not_modified = self.client.get(self.order_url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response_not_modified.status_code, 304)
+            self.assertEqual(response_not_modified.content, b'')
+            self.assertEqual(response_not_modified['ETag'], response['ETag'])
+            get_order_cache().clear()
+
+    def test_retrieve_modified(self):
+        etag = self.client.get(self.order_url)['ETag']
+        self.client.patch(self.order_url, data={"delivery_status": "delivered"}, content_type='application/json')
+
+        response = self.client.get(self.order_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_retrieve_if_modified_since(self):
+        last_modified = self.client.get(self.order_url)['Last-Modified']
+
+        response = self.client.get(self.order_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_not_modified(self):
+        response = self.client.get(f"{self.url}?delivery_status=not_in_delivery")
+        etag = response['ETag']
+
+        response = self.client.get(f"{self.url}?delivery_status=not_in_delivery", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # check another page of the list has another ETag
+        self.assertNotEqual(self.client.get(f"{self.url}?offset=1")['ETag'], etag)
+
+    def test_list_modified_on_create_and_delete(self):
+        etag = self.client.get(self.url)['ETag']
+        order = Order.objects.create(customer_email="test2@moberries.com",
+                                     order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(self.url)['ETag']
+        order.delete()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_patch_if_match(self):
+        etag = self.client.get(self.order_url)['ETag']
+        response = self.client.patch(self.order_url, data={"delivery_status": "ready_for_delivery"},
+                                     content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        new_etag = response['ETag']
+        self.assertNotEqual(new_etag, etag)
+
+        # check update based on the old version of the order is rejected
+        response = self.client.patch(self.order_url, data={"delivery_status": "not_in_delivery"},
+                                     content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.delivery_status, "ready_for_delivery")
+
+    def test_patch_if_match_without_reading_order(self):
+        etag = self.client.get(self.order_url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.order_url, data={"delivery_status": "ready_for_delivery"},
+                                         content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # check the version is checked by the UPDATE itself
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('SELECT')])
+
+    def test_order_etag_holds_exact_updated_at(self):
+        for microsecond in (0, 1, 123457, 999999):
+            updated_at = timezone.now().replace(microsecond=microsecond)
+            etag, _ = order_validators(self.order.id, updated_at)
+            self.assertEqual(parse_order_etag(etag, self.order.id), updated_at)
+        self.assertIsNone(parse_order_etag(etag, self.order.id + 1))
+        self.assertIsNone(parse_order_etag(f'W/{etag}', self.order.id))
+        self.assertIsNone(parse_order_etag('*', self.order.id))
+
+    def test_list_etag_reuses_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(len([query for query in queries.captured_queries if 'COUNT(' in query['sql']]), 1)
+
+    def test_list_etag_skipped_without_exact_count(self):
+        for query in ('cursor=', 'count=none', 'count=estimate', 'cursor=&count=exact'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f"{self.url}?{query}")
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header('ETag'))
+            self.assertFalse([query for query in queries.captured_queries if 'MAX(' in query['sql']])
+
+    def test_put_if_match(self):
+        data = {"customer_email": "test1@moberries.com",
+                "order_items": [{"flavour": "fungi", "quantity": 1, "size": "big"}]}
+        response = self.client.put(self.order_url, data=data, content_type='application/json',
+                                   HTTP_IF_MATCH='"outdated"')
+        self.assertEqual(response.status_code, 412)
+
+        etag = self.client.get(self.order_url)['ETag']
+        response = self.client.put(self.order_url, data=data, content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class OrderEventsTestCase(OrdersApiBaseTestCase):
+    """Tests for GET /api/v1/orders/events/ and /api/v1/orders/{order_id}/events/ methods """
+    def setUp(self):
+        super(OrderEventsTestCase, self).setUp()
+        self.url = '/api/v1/orders/'
+        self.order = Order.objects.create(customer_email="test1@moberries.com",
+                                          order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+
+    def read_stream(self, response):
+        return ''.join(chunk.decode('utf-8') for chunk in response.streaming_content)
+
+    def change_status(self, order, delivery_status):
+        previous_status = order.delivery_status
+        order.delivery_status = delivery_status
+        order.save()
+        get_broker().dispatch(status_event(order, previous_status))
+
+    def test_order_events(self):
+        other_order = Order.objects.create(customer_email="test2@moberries.com",
+                                           order_items=[{"flavour": "fungi", "quantity": 1, "size": "big"}])
+        response = self.client.get(f"{self.url}{self.order.id}/events/?timeout=0.2",
+                                   HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        self.change_status(other_order, "ready_for_delivery")
+        self.change_status(self.order, "ready_for_delivery")
+        content = self.read_stream(response)
+
+        # check the current status is sent first and only events of the order are streamed
+        messages = [json.loads(line[len('data: '):]) for line in content.splitlines() if line.startswith('data: ')]
+        self.assertEqual([(message['id'], message['delivery_status'], message['previous_status'])
+                          for message in messages],
+                         [(self.order.id, "not_in_delivery", None),
+                          (self.order.id, "ready_for_delivery", "not_in_delivery")])
+        self.assertIn('event: delivery_status', content)
+        # check the subscription is closed with the stream
+        self.assertFalse(get_broker().subscriptions)
+
+    def test_order_events_not_found(self):
+        response = self.client.get(f"{self.url}0/events/")
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(get_broker().subscriptions)
+
+    def test_events_filtered(self):
+        other_order = Order.objects.create(customer_email="test2@moberries.com",
+                                           order_items=[{"flavour": "fungi", "quantity": 1, "size": "big"}])
+        response = self.client.get(f"{self.url}events/",
+                                   {'timeout': 0.2, 'customer_email': "test1@moberries.com",
+                                    'delivery_status': "ready_for_delivery,delivered"})
+        self.assertEqual(response.status_code, 200)
+
+        self.change_status(other_order, "ready_for_delivery")
+        self.change_status(self.order, "ready_for_delivery")
+        self.change_status(self.order, "dispatched")
+        content = self.read_stream(response)
+
+        self.assertEqual(content.count('event: delivery_status'), 1)
+        self.assertIn(f'"id": {self.order.id}, "customer_email": "test1@moberries.com", '
+                      f'"delivery_status": "ready_for_delivery"', content)
+
+    def test_events_heartbeat(self):
+        with override_settings(ORDERS_EVENTS={'HEARTBEAT': 0.05, 'MAX_DURATION': 0.2}):
+            # check timeout is capped by MAX_DURATION
+            response = self.client.get(f"{self.url}events/?timeout=100")
+            started_at = time.monotonic()
+            content = self.read_stream(response)
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assertTrue(content.startswith('retry: '))
+        self.assertIn(': keep-alive', content)
+
+    def test_events_max_streams(self):
+        with override_settings(ORDERS_EVENTS={'MAX_STREAMS': 1, 'MAX_DURATION': 0.1}):
+            streaming = get_broker().subscribe()
+            response = self.client.get(f"{self.url}events/")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '3')
+            self.assertEqual(get_broker().subscriptions, {streaming})
+
+            get_broker().unsubscribe(streaming)
+            response = self.client.get(f"{self.url}events/")
+            self.assertEqual(response.status_code, 200)
+            self.read_stream(response)
+
+    def test_events_invalid_params(self):
+        response = self.client.get(f"{self.url}events/?delivery_status=lost")
+        self.assertEqual(response.status_code, 400)
+        for timeout in ('soon', 'nan', 'inf', '-1', '0'):
+            response = self.client.get(f"{self.url}events/?timeout={timeout}")
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(get_broker().subscriptions)
+
+
+class OrderEventsPublishTestCase(TransactionTestCase):
+    """Tests for delivery_status events published on PATCH /api/v1/orders/{order_id}/ """
+    def setUp(self):
+        order_cache = get_order_cache()
+        if order_cache is not None:
+            order_cache.clear()
+        self.order = Order.objects.create(customer_email="test1@moberries.com",
+                                          order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        self.subscription = get_broker().subscribe()
+
+    def tearDown(self):
+        get_broker().unsubscribe(self.subscription)
+
+    def test_patch_publishes_event(self):
+        response = self.client.patch(f"/api/v1/orders/{self.order.id}/", data={"delivery_status": "delivered"},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        event = self.subscription.get(timeout=1)
+        self.assertEqual(event['data']['id'], self.order.id)
+        self.assertEqual(event['data']['delivery_status'], "delivered")
+        self.assertEqual(event['data']['previous_status'], "not_in_delivery")
+
+    def test_patch_same_status_not_published(self):
+        self.client.patch(f"/api/v1/orders/{self.order.id}/", data={"delivery_status": "not_in_delivery"},
+                          content_type='application/json')
+        self.assertIsNone(self.subscription.get(timeout=0.1))
+
+
+class InProcessBrokerTestCase(SimpleTestCase):
+    """Tests for the in-process events broker """
+    def test_dispatch_to_matching_subscriptions(self):
+        broker = InProcessBroker()
+        everything = broker.subscribe()
+        delivered = broker.subscribe(lambda event: event['data']['delivery_status'] == "delivered")
+        event = {'event_id': '1-1', 'type': 'delivery_status', 'data': {'id': 1, 'delivery_status': "dispatched"}}
+        broker.dispatch(event)
+
+        self.assertEqual(everything.get(timeout=0), event)
+        self.assertIsNone(delivered.get(timeout=0))
+
+        broker.unsubscribe(everything)
+        broker.dispatch(event)
+        self.assertIsNone(everything.get(timeout=0))
+
+    def test_slow_subscription_drops_events(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe()
+        subscription.events.maxsize = 1
+        broker.dispatch({'data': {}})
+        broker.dispatch({'data': {}})
+        self.assertEqual(subscription.dropped, 1)
+
+    def test_format_event(self):
+        self.assertEqual(format_event({'event_id': '1-1', 'type': 'delivery_status', 'data': {'id': 1}}),
+                         'id: 1-1\nevent: delivery_status\ndata: {"id": 1}\n\n')
+
+
+class DeliveryStatusTransitionsTestCase(OrdersApiBaseTestCase):
+    """Tests for delivery_status transitions applied by PATCH /api/v1/orders/{order_id}/ """
+    def setUp(self):
+        super(DeliveryStatusTransitionsTestCase, self).setUp()
+        self.url = '/api/v1/orders/'
+        self.order = Order.objects.create(customer_email="test1@moberries.com", delivery_status="delivered",
+                                          order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        self.order_url = f"{self.url}{self.order.id}/"
+
+    def patch(self, url, delivery_status, **extra):
+        return self.client.patch(url, data={"delivery_status": delivery_status},
+                                 content_type='application/json', **extra)
+
+    def test_allowed_sources(self):
+        self.assertEqual(allowed_sources("delivered"),
+                         ["delivered", "not_in_delivery", "ready_for_delivery", "dispatched", "on_its_way"])
+        self.assertEqual(allowed_sources("not_in_delivery"), ["not_in_delivery", "ready_for_delivery"])
+
+    def test_transition_single_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch(self.order_url, "on_its_way")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['delivery_status'], "on_its_way")
+        self.assertEqual([query['sql'].split()[0] for query in queries.captured_queries
+                          if 'pizza_ordering_order' in query['sql']], ['UPDATE'])
+        # check order_items are not rewritten
+        self.assertNotIn('order_items =', queries.captured_queries[-1]['sql'])
+
+    def test_transition_not_allowed(self):
+        response = self.patch(self.order_url, "not_in_delivery")
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("'delivered'", response.json()['detail'])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.delivery_status, "delivered")
+
+    def test_transition_same_status(self):
+        response = self.patch(self.order_url, "delivered")
+        self.assertEqual(response.status_code, 200)
+        updated_at = self.order.updated_at
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.updated_at, updated_at)
+
+    def test_transition_order_not_found(self):
+        self.assertEqual(self.patch(f"{self.url}0/", "delivered").status_code, 404)
+        self.assertEqual(self.patch(f"{self.url}abc/", "delivered").status_code, 404)
+
+    def test_transition_invalid_status(self):
+        self.assertEqual(self.patch(self.order_url, "lost").status_code, 400)
+
+    def test_transition_invalidates_cache(self):
+        self.client.get(self.order_url)
+        self.patch(self.order_url, "on_its_way")
+        response = self.client.get(self.order_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['delivery_status'], "on_its_way")
+
+    def test_put_writes_changed_columns_only(self):
+        order = Order.objects.create(customer_email="test1@moberries.com",
+                                     order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        data = {"customer_email": "test2@moberries.com",
+                "order_items": [{"flavour": "hawaii", "quantity": 2, "size": "small"}]}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(f"{self.url}{order.id}/", data=data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"customer_email" =', updates[0])
+        self.assertNotIn('"order_items" =', updates[0])
+        self.assertNotIn('"delivery_status" =', updates[0])
+
+
+class DeliveryStatusConcurrencyTestCase(TransactionTestCase):
+    """Tests for concurrent PATCH /api/v1/orders/{order_id}/ requests """
+    threads = 20
+
+    def setUp(self):
+        order_cache = get_order_cache()
+        if order_cache is not None:
+            order_cache.clear()
+        self.order = Order.objects.create(customer_email="test1@moberries.com", delivery_status="ready_for_delivery",
+                                          order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        self.subscription = get_broker().subscribe()
+
+    def tearDown(self):
+        get_broker().unsubscribe(self.subscription)
+
+    def test_parallel_patches(self):
+        # half of the requests deliver the order, the other half try to move it back to the kitchen,
+        # which is allowed until the order is delivered
+        statuses = ["delivered", "not_in_delivery"] * (self.threads // 2)
+        responses = [None] * self.threads
+        start = threading.Barrier(self.threads)
+
+        def patch(index):
+            try:
+                start.wait()
+                responses[index] = Client().patch(f"/api/v1/orders/{self.order.id}/",
+                                                  data={"delivery_status": statuses[index]},
+                                                  content_type='application/json').status_code
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=patch, args=(index,)) for index in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertTrue(set(responses) <= {200, 409}, responses)
+        # check every attempt to deliver succeeded and nothing was moved back once delivered
+        self.assertEqual([code for code, status in zip(responses, statuses) if status == "delivered"],
+                         [200] * (self.threads // 2))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.delivery_status, "delivered")
+
+        # check every published change is an allowed transition from the status the order really had
+        events = []
+        while True:
+            event = self.subscription.get(timeout=0)
+            if event is None:
+                break
+            events.append(event['data'])
+        self.assertTrue(events)
+        for event in events:
+            self.assertIn(event['delivery_status'],
+                          Order.DELIVERY_STATUS_TRANSITIONS[event['previous_status']])
+        self.assertEqual(sum(1 for event in events if event['delivery_status'] == "delivered"), 1)
+
+
+class PatchOrdersStatusTestCase(OrdersApiBaseTestCase):
+    """Tests for PATCH /api/v1/orders/status/ method """
+    def setUp(self):
+        super(PatchOrdersStatusTestCase, self).setUp()
+        self.url = '/api/v1/orders/status/'
+        order_items = [{"flavour": "hawaii", "quantity": 2, "size": "small"}]
+        self.orders = {status: Order.objects.create(customer_email="test1@moberries.com", delivery_status=status,
+                                                    order_items=order_items)
+                       for status in ["ready_for_delivery", "dispatched", "delivered"]}
+        self.other = Order.objects.create(customer_email="test2@moberries.com", delivery_status="ready_for_delivery",
+                                          order_items=order_items)
+
+    def patch(self, data):
+        return self.client.patch(self.url, data=data, content_type='application/json')
+
+    def test_patch_by_ids(self):
+        missing_id = self.other.id + 1000
+        ids = [order.id for order in self.orders.values()] + [missing_id]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch({"delivery_status": "on_its_way", "ids": ids})
+        self.assertEqual(response.status_code, 200)
+        # check the whole change is done with one statement (customer summaries are upserted separately)
+        self.assertEqual(len([query for query in queries.captured_queries if 'UPDATE' in query['sql']
+                              and CustomerSummary._meta.db_table not in query['sql']]), 1)
+
+        results = {result['id']: (result['result'], result['previous_status']) for result in response.json()['results']}
+        self.assertEqual(results, {
+            self.orders["ready_for_delivery"].id: ("updated", "ready_for_delivery"),
+            self.orders["dispatched"].id: ("updated", "dispatched"),
+            self.orders["delivered"].id: ("updated", "delivered"),
+            missing_id: ("not_found", None),
+        })
+        self.assertEqual(Order.objects.filter(delivery_status="on_its_way").count(), 3)
+        self.assertEqual(Order.objects.get(id=self.other.id).delivery_status, "ready_for_delivery")
+
+    def test_patch_conflicts_and_unchanged(self):
+        ids = [order.id for order in self.orders.values()]
+        response = self.patch({"delivery_status": "ready_for_delivery", "ids": ids})
+        results = {result['id']: result['result'] for result in response.json()['results']}
+        self.assertEqual(results, {self.orders["ready_for_delivery"].id: "unchanged",
+                                   self.orders["dispatched"].id: "updated",
+                                   self.orders["delivered"].id: "conflict"})
+        self.assertEqual(Order.objects.get(id=self.orders["delivered"].id).delivery_status, "delivered")
+
+    def test_patch_by_filter(self):
+        response = self.patch({"delivery_status": "dispatched",
+                               "filter": {"customer_email": "test1@moberries.com",
+                                          "delivery_status": "ready_for_delivery"}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [{'id': self.orders["ready_for_delivery"].id,
+                                                       'result': 'updated', 'previous_status': 'ready_for_delivery'}])
+        self.assertEqual(Order.objects.get(id=self.other.id).delivery_status, "ready_for_delivery")
+
+    def test_patch_invalidates_cache(self):
+        order = self.orders["dispatched"]
+        self.client.get(f"/api/v1/orders/{order.id}/")
+        self.patch({"delivery_status": "delivered", "ids": [order.id]})
+        response = self.client.get(f"/api/v1/orders/{order.id}/")
+        self.assertEqual(response.json()['delivery_status'], "delivered")
+
+    def test_patch_many_ids(self):
+        Order.objects.bulk_create([Order(customer_email=f"bulk{index}@moberries.com",
+                                         order_items=[{"flavour": "fungi", "quantity": 1, "size": "big"}])
+                                   for index in range(2000)])
+        ids = list(Order.objects.filter(customer_email__startswith="bulk").values_list('id', flat=True))
+        response = self.patch({"delivery_status": "ready_for_delivery", "ids": ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2000)
+        self.assertEqual(Order.objects.filter(customer_email__startswith="bulk",
+                                              delivery_status="ready_for_delivery").count(), 2000)
+
+    def test_patch_invalid(self):
+        self.assertEqual(self.patch({"delivery_status": "lost", "ids": [1]}).status_code, 400)
+        self.assertEqual(self.patch({"delivery_status": "delivered"}).status_code, 400)
+        self.assertEqual(self.patch({"delivery_status": "delivered", "ids": [1],
+                                     "filter": {"delivery_status": "dispatched"}}).status_code, 400)
+        self.assertEqual(self.patch({"delivery_status": "delivered", "filter": {}}).status_code, 400)
+        self.assertEqual(self.patch({"delivery_status": "delivered", "filter": {"colour": "red"}}).status_code, 400)
+        self.assertEqual(self.patch({"delivery_status": "delivered",
+                                     "filter": {"delivery_status": "lost"}}).status_code, 400)
+
+    def test_patch_filter_too_many(self):
+        with override_settings(ORDERS_BULK_MAX_ITEMS=2):
+            response = self.patch({"delivery_status": "delivered", "filter": {"customer_email": "test1@moberries.com"}})
+        self.assertEqual(response.status_code, 400)
+        # check nothing was changed
+        self.assertEqual(Order.objects.get(id=self.orders["dispatched"].id).delivery_status, "dispatched")
+
+
+class FastSerializationTestCase(OrdersApiBaseTestCase):
+    """Tests for .values() serialization of orders and orjson rendering/parsing """
+    def setUp(self):
+        super(FastSerializationTestCase, self).setUp()
+        self.url = '/api/v1/orders/'
+        Order.objects.create(customer_email="test1@moberries.com",
+                             order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        # order_items stored as JSON string, unicode and line separator in values
+        Order.objects.create(customer_email="t\u00e9st\u20282@moberries.com", delivery_status="delivered",
+                             order_items="""[{"flavour": "fungi", "quantity": 9, "size": "big"}]""")
+        # timestamp without microseconds
+        order = Order.objects.create(customer_email="test3@moberries.com",
+                                     order_items=[{"flavour": "pepperoni", "quantity": 1, "size": "big"}])
+        Order.objects.filter(id=order.id).update(created_at="2019-10-20T10:00:00Z")
+
+    def render_both(self):
+        queryset = Order.objects.order_by('id')
+        expected = JSONRenderer().render(OrderSerializer(queryset, many=True).data)
+        actual = FastJSONRenderer().render(orders_to_dicts(queryset.values(*ORDER_FIELDS)))
+        return expected, actual
+
+    def test_same_output_as_serializer(self):
+        expected, actual = self.render_both()
+        self.assertEqual(actual, expected)
+
+    def test_same_output_without_orjson(self):
+        with mock.patch.object(fastjson, 'orjson', None):
+            expected, actual = self.render_both()
+        self.assertEqual(actual, expected)
+
+    def test_same_output_in_another_timezone(self):
+        with override_settings(TIME_ZONE='Europe/Berlin'):
+            expected, actual = self.render_both()
+        self.assertEqual(actual, expected)
+        self.assertIn(b'+02:00', actual)
+
+    def test_list_same_response(self):
+        # check the API gives the same bytes with both serialization paths (offset and cursor pagination)
+        for query in ['', '?limit=2&offset=1', '?cursor=']:
+            with override_settings(ORDERS_VALUES_SERIALIZATION=False):
+                get_order_cache().clear()
+                expected = self.client.get(f"{self.url}{query}").content
+            get_order_cache().clear()
+            self.assertEqual(self.client.get(f"{self.url}{query}").content, expected)
+
+    def test_renderer_indent(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json; indent=2')
+        self.assertIn(b'\n  "', response.content)
+
+    def test_parser(self):
+        stream = io.BytesIO('{"customer_email": "t\u00e9st@moberries.com", "order_items": []}'.encode('utf-8'))
+        self.assertEqual(FastJSONParser().parse(stream), {"customer_email": "t\u00e9st@moberries.com",
+                                                          "order_items": []})
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"quantity": NaN}'))
+        with mock.patch.object(fastjson, 'orjson', None), self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"quantity": NaN}'))
+
+    def test_post_malformed_json(self):
+        response = self.client.post(self.url, data='{"customer_email": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportOrdersTestCase(OrdersApiBaseTestCase):
+    """Tests for GET /api/v1/orders/export/ method """
+    def setUp(self):
+        super(ExportOrdersTestCase, self).setUp()
+        self.url = '/api/v1/orders/export/'
+        self.first = Order.objects.create(customer_email="test1@moberries.com",
+                                          order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"},
+                                                       {"flavour": "fungi", "quantity": 1, "size": "big"}])
+        self.second = Order.objects.create(customer_email="test2@moberries.com", delivery_status="delivered",
+                                           order_items="""[{"flavour": "pepperoni", "quantity": 3, "size": "big"}]""")
+        Order.objects.filter(id=self.first.id).update(created_at="2019-10-20T10:00:00Z")
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_export_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = self.read(response).splitlines()
+        # check every order is exported in the same shape as the API gives it
+        self.assertEqual([json.loads(line) for line in lines],
+                         [self.client.get(f"/api/v1/orders/{order.id}/").json()
+                          for order in [self.first, self.second]])
+
+    def test_export_csv(self):
+        response = self.client.get(f"{self.url}?format=csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(io.StringIO(self.read(response))))
+        self.assertEqual(rows[0], ['id', 'created_at', 'updated_at', 'customer_email', 'delivery_status',
+                                   'flavour', 'size', 'quantity'])
+        self.assertEqual([(row[0], row[3], row[5], row[6], row[7]) for row in rows[1:]], [
+            (str(self.first.id), "test1@moberries.com", "hawaii", "small", "2"),
+            (str(self.first.id), "test1@moberries.com", "fungi", "big", "1"),
+            (str(self.second.id), "test2@moberries.com", "pepperoni", "big", "3"),
+        ])
+
+    def test_export_csv_accept_header(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='text/csv')
+        self.assertTrue(self.read(response).startswith('id,created_at'))
+
+    def test_export_filters(self):
+        lines = self.read(self.client.get(f"{self.url}?delivery_status=delivered")).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.second.id])
+
+        lines = self.read(self.client.get(f"{self.url}?since=2019-10-21")).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.second.id])
+
+        lines = self.read(self.client.get(f"{self.url}?since=2019-10-20T09:00:00Z")).splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_export_empty(self):
+        self.assertEqual(self.read(self.client.get(f"{self.url}?customer_email=nobody@moberries.com")), '')
+        content = self.read(self.client.get(f"{self.url}?format=csv&customer_email=nobody@moberries.com"))
+        self.assertEqual(content.splitlines(), [','.join(['id', 'created_at', 'updated_at', 'customer_email',
+                                                          'delivery_status', 'flavour', 'size', 'quantity'])])
+
+    def test_export_invalid_since(self):
+        response = self.client.get(f"{self.url}?since=yesterday")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('since', json.loads(response.content))
+
+    @tag('slow')
+    def test_export_bounded_memory(self):
+        """
+        Exports a million orders and checks resident memory of the process doesn't grow with their number.
+        Takes a couple of minutes, could be skipped with `manage.py test --exclude-tag slow`.
+        """
+        rows = 1000000
+        seed_orders(rows)
+
+        def rss():
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * 4096
+
+        try:
+            baseline = rss()
+        except OSError:
+            self.skipTest("Resident memory size is available on Linux only")
+
+        for format_ in ['ndjson', 'csv']:
+            peak, lines = baseline, 0
+            response = self.client.get(f"{self.url}?format={format_}")
+            for number, chunk in enumerate(response.streaming_content):
+                lines += chunk.count(b'\n')
+                if number % 50 == 0:
+                    peak = max(peak, rss())
+            # ndjson: line per order (+2 created in setUp), csv: header and 2 lines per order (+3)
+            self.assertEqual(lines, rows + 2 if format_ == 'ndjson' else 2 * rows + 4)
+            self.assertLess(peak - baseline, 64 * 1024 * 1024, format_)
+
+
+class OrderStatsTestCase(OrdersApiBaseTestCase):
+    """Tests for GET /api/v1/orders/stats/ method """
+    def setUp(self):
+        super(OrderStatsTestCase, self).setUp()
+        self.url = '/api/v1/orders/stats/'
+        Order.objects.create(customer_email="test1@moberries.com",
+                             order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"},
+                                          {"flavour": "hawaii", "quantity": 1, "size": "big"}])
+        Order.objects.create(customer_email="test1@moberries.com", delivery_status="delivered",
+                             order_items=[{"flavour": "hawaii", "quantity": 3, "size": "small"}])
+        order = Order.objects.create(customer_email="test2@moberries.com",
+                                     order_items=[{"flavour": "fungi", "quantity": 4, "size": "big"}])
+        Order.objects.filter(id=order.id).update(created_at="2019-10-20T10:30:00Z", updated_at="2019-10-20T10:30:00Z")
+        # JSON string order_items have no items
+        Order.objects.create(customer_email="test3@moberries.com",
+                             order_items="""[{"flavour": "fungi", "quantity": 9, "size": "big"}]""")
+
+    def get_stats(self, query=''):
+        response = self.client.get(f"{self.url}?{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_totals(self):
+        stats = self.get_stats()
+        self.assertEqual(stats['source'], 'live')
+        self.assertEqual(stats['results'], [{'orders': 4, 'items': 4, 'pizzas': 10}])
+
+    def test_group_by_flavour_and_size(self):
+        self.assertEqual(self.get_stats('group_by=flavour,size')['results'], [
+            {'flavour': 'fungi', 'size': 'big', 'orders': 1, 'items': 1, 'pizzas': 4},
+            {'flavour': 'hawaii', 'size': 'big', 'orders': 1, 'items': 1, 'pizzas': 1},
+            {'flavour': 'hawaii', 'size': 'small', 'orders': 2, 'items': 2, 'pizzas': 5},
+        ])
+        # check an order is counted once per flavour
+        self.assertEqual(self.get_stats('group_by=flavour')['results'], [
+            {'flavour': 'fungi', 'orders': 1, 'items': 1, 'pizzas': 4},
+            {'flavour': 'hawaii', 'orders': 2, 'items': 3, 'pizzas': 6},
+        ])
+
+    def test_group_by_status_and_day_with_filters(self):
+        self.assertEqual(self.get_stats('group_by=day,delivery_status&until=2019-10-21')['results'], [
+            {'day': '2019-10-20', 'delivery_status': 'not_in_delivery', 'orders': 1, 'items': 1, 'pizzas': 4},
+        ])
+        self.assertEqual(self.get_stats('group_by=hour&since=2019-10-20&until=2019-10-21')['results'], [
+            {'hour': '2019-10-20T10:00:00Z', 'orders': 1, 'items': 1, 'pizzas': 4},
+        ])
+        self.assertEqual(self.get_stats('group_by=customer_email&delivery_status=delivered')['results'], [
+            {'customer_email': 'test1@moberries.com', 'orders': 1, 'items': 1, 'pizzas': 3},
+        ])
+
+    def test_summary_same_as_live(self):
+        refresh_summary()
+        queries = ['', 'group_by=flavour,size', 'group_by=delivery_status,day', 'group_by=hour,flavour,size',
+                   'delivery_status=delivered,not_in_delivery&since=2019-10-20T10:00:00Z']
+        for query in queries:
+            live = self.get_stats(f'{query}&source=live')
+            summary = self.get_stats(query)
+            self.assertEqual(summary['source'], 'summary', query)
+            self.assertIsNotNone(summary['refreshed_at'])
+            self.assertEqual(summary['results'], live['results'], query)
+
+    def test_summary_not_used_for_unsupported_queries(self):
+        refresh_summary()
+        for query in ['group_by=flavour', 'group_by=customer_email', 'customer_email=test1@moberries.com',
+                      'since=2019-10-20T10:15:00Z']:
+            self.assertEqual(self.get_stats(query)['source'], 'live', query)
+
+    def test_stale_summary_not_used(self):
+        refresh_summary()
+        OrderStatsRefresh.objects.update(refreshed_at=timezone.now() - timedelta(seconds=61))
+        with override_settings(ORDERS_STATS_MAX_STALENESS=60):
+            self.assertEqual(self.get_stats()['source'], 'live')
+            # check explicit summary source is still served
+            self.assertEqual(self.get_stats('source=summary')['source'], 'summary')
+        with override_settings(ORDERS_STATS_MAX_STALENESS=None):
+            self.assertEqual(self.get_stats()['source'], 'summary')
+
+    def test_incremental_refresh(self):
+        refresh_summary()
+        summary_rows = OrderStats.objects.count()
+        order = Order.objects.filter(delivery_status="delivered").first()
+        self.client.patch(f"/api/v1/orders/{order.id}/", data={"delivery_status": "on_its_way"},
+                          content_type='application/json')
+        Order.objects.create(customer_email="test4@moberries.com",
+                             order_items=[{"flavour": "pepperoni", "quantity": 1, "size": "big"}])
+
+        # check only the hour of the recent orders is recomputed, not the one of 2019
+        self.assertEqual(refresh_summary(), 1)
+        self.assertTrue(OrderStats.objects.filter(bucket__lt="2019-10-21").exists())
+        self.assertNotEqual(OrderStats.objects.count(), summary_rows)
+        query = 'group_by=delivery_status,flavour,size'
+        self.assertEqual(self.get_stats(query)['results'], self.get_stats(f'{query}&source=live')['results'])
+
+    def test_invalid_params(self):
+        for query in ['group_by=colour', 'since=yesterday', 'delivery_status=lost', 'source=cache']:
+            self.assertEqual(self.client.get(f"{self.url}?{query}").status_code, 400, query)
+
+
+class OrderPartitioningTestCase(TransactionTestCase):
+    """Tests for monthly partitioning of the orders table """
+    def setUp(self):
+        order_cache = get_order_cache()
+        if order_cache is not None:
+            order_cache.clear()
+        self.url = '/api/v1/orders/'
+        now = timezone.now()
+        self.old_month = add_months(month_start(now), -14)
+        self.orders = []
+        for created_at, email in [(self.old_month + timedelta(days=3), "test1@moberries.com"),
+                                  (add_months(month_start(now), -2), "test2@moberries.com"),
+                                  (now, "test3@moberries.com")]:
+            order = Order.objects.create(customer_email=email,
+                                         order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+            OrderItem.objects.bulk_create(OrderItem.from_order(order))
+            Order.objects.filter(id=order.id).update(created_at=created_at)
+            self.orders.append(order)
+        convert()
+
+    def tearDown(self):
+        if is_partitioned():
+            revert()
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {ARCHIVE_SCHEMA} CASCADE")
+
+    def test_convert(self):
+        self.assertTrue(is_partitioned())
+        months = [month for _, month in partitions()]
+        self.assertEqual(months[0], self.old_month)
+        self.assertEqual(months[-1], add_months(month_start(timezone.now()), PARTITIONS_AHEAD))
+        self.assertEqual(len(months), 14 + PARTITIONS_AHEAD + 1)
+
+    def test_api_on_partitioned_table(self):
+        response = self.client.post(self.url, data={"customer_email": "test4@moberries.com",
+                                                    "order_items": [{"flavour": "fungi", "quantity": 1,
+                                                                     "size": "big"}]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        new_id = response.json()['id']
+        self.assertGreater(new_id, self.orders[-1].id)
+
+        response = self.client.get(self.url)
+        self.assertEqual([order['id'] for order in response.json()['results']],
+                         [new_id] + [order.id for order in reversed(self.orders)])
+        response = self.client.get(f"{self.url}?customer_email=test1@moberries.com")
+        self.assertEqual([order['id'] for order in response.json()['results']], [self.orders[0].id])
+
+        response = self.client.patch(f"{self.url}{self.orders[0].id}/", data={"delivery_status": "delivered"},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get(id=self.orders[0].id).delivery_status, "delivered")
+
+        self.assertEqual(self.client.delete(f"{self.url}{new_id}/").status_code, 204)
+        self.assertFalse(OrderItem.objects.filter(order_id=new_id).exists())
+
+    def test_create_partitions_moves_orders_from_default(self):
+        far_month = add_months(month_start(timezone.now()), PARTITIONS_AHEAD + 2)
+        order = Order.objects.create(customer_email="test4@moberries.com",
+                                     order_items=[{"flavour": "fungi", "quantity": 1, "size": "big"}])
+        Order.objects.filter(id=order.id).update(created_at=far_month)
+
+        created = create_partitions(ahead=PARTITIONS_AHEAD + 2)
+        self.assertEqual(created, [partition_name(add_months(far_month, -1)), partition_name(far_month)])
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {partition_name(far_month)}")
+            self.assertEqual(cursor.fetchall(), [(order.id,)])
+        self.assertEqual(create_partitions(ahead=PARTITIONS_AHEAD + 2), [])
+
+    def test_archive_partitions(self):
+        # partitions of the months ended more than 12 months ago: the one of the old order and the next one
+        archived = archive_partitions(older_than=12)
+        self.assertEqual(archived, [partition_name(self.old_month), partition_name(add_months(self.old_month, 1))])
+        self.assertEqual(self.client.get(self.url).json()['count'], 2)
+        self.assertFalse(OrderItem.objects.filter(order_id=self.orders[0].id).exists())
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {ARCHIVE_SCHEMA}.{partition_name(self.old_month)}")
+            self.assertEqual(cursor.fetchall(), [(self.orders[0].id,)])
+            cursor.execute(f"SELECT order_id FROM {ARCHIVE_SCHEMA}."
+                           f"{partition_name(self.old_month, OrderItem._meta.db_table)}")
+            self.assertEqual(cursor.fetchall(), [(self.orders[0].id,)])
+
+    def test_revert(self):
+        revert()
+        self.assertFalse(is_partitioned())
+        self.assertEqual(Order.objects.count(), 3)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+                           [OrderItem._meta.db_table])
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class QueryPlansTestCase(OrdersApiBaseTestCase):
+    """Tests for query plans of OrderViewSet actions on a large table """
+    @classmethod
+    def setUpTestData(cls):
+        seed_plans_data(50000)
+
+    def test_no_sequential_scans(self):
+        results = explain_order_views()
+        self.assertEqual({result['scenario'] for result in results},
+                         {name for name, _, _, _ in order_view_scenarios()})
+        for result in results:
+            self.assertEqual(result['seq_scans'], [], f"{result['scenario']}: {result['sql']}")
+
+    def test_hot_queries_use_composite_and_partial_indexes(self):
+        results = explain_order_views()
+        indexes = {}
+        for result in results:
+            indexes.setdefault(result['scenario'], set()).update(index_names(result['plan']))
+        self.assertIn('order_customer_created_at_idx', indexes['list_customer_cursor'])
+        self.assertIn('order_active_created_at_idx', indexes['list_active_status'])
+
+    def test_sequential_scans_detected(self):
+        plan = explain_analyze(f"SELECT * FROM {Order._meta.db_table} WHERE order_items::text LIKE '%%fungi%%'")
+        self.assertEqual(sequential_scans(plan), [Order._meta.db_table])
+
+
+class MetricsTestCase(OrdersApiBaseTestCase):
+    """Tests for instrumentation of the orders API: Server-Timing header and /metrics """
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        clear_metrics()
+        self.order = Order.objects.create(customer_email="test1@moberries.com",
+                                          order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+
+    def test_disabled_by_default(self):
+        response = self.client.get('/api/v1/orders/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(ORDERS_METRICS={'ENABLED': True}, ORDERS_CACHE={'BACKEND': None})
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/v1/orders/{self.order.id}/')
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        self.assertRegex(timing,
+                         r'^db;dur=\d+\.\d{3};desc="(\d+) queries", render;dur=\d+\.\d{3}, total;dur=\d+\.\d{3}$')
+        self.assertIn(f'desc="{len(context.captured_queries)} queries"', timing)
+
+    @override_settings(ORDERS_METRICS={'ENABLED': True})
+    def test_queries_of_every_alias_counted(self):
+        replica = mock.MagicMock()
+        with mock.patch('pizza_ordering.metrics.connections') as connections:
+            connections.all.return_value = [connection, replica]
+            self.client.get(f'/api/v1/orders/{self.order.id}/')
+        timer, = replica.execute_wrapper.call_args[0]
+        # a query executed on the replica
+        timer(mock.Mock(), 'SELECT 1', None, False, {})
+        self.assertEqual(timer.queries, 2)
+
+    @override_settings(ORDERS_METRICS={'ENABLED': True, 'SERVER_TIMING': False})
+    def test_metrics_endpoint(self):
+        self.client.get('/api/v1/orders/')
+        self.client.get('/api/v1/orders/')
+        response = self.client.get(f'/api/v1/orders/{self.order.id + 1}/')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('Server-Timing', response)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.decode().splitlines()
+        self.assertIn('orders_api_requests_total{action="list",method="GET",status="200"} 2', lines)
+        self.assertIn('orders_api_requests_total{action="retrieve",method="GET",status="404"} 1', lines)
+        self.assertIn('# TYPE orders_api_request_duration_seconds histogram', lines)
+        self.assertIn('orders_api_request_duration_seconds_bucket{action="list",method="GET",le="+Inf"} 2', lines)
+        self.assertIn('orders_api_request_duration_seconds_count{action="list",method="GET"} 2', lines)
+        self.assertTrue(any(line.startswith('orders_api_response_bytes_sum{action="list",method="GET"}')
+                            for line in lines))
+
+    def test_multiprocess_metrics(self):
+        # a worker process, which is running, and one, which has exited
+        other = subprocess.Popen(['sleep', '60'])
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        snapshot = {'orders_api_requests_total': [[['list', 'GET', '200'], 3]],
+                    'orders_api_db_queries': [[['list', 'GET'], [[0, 0, 3, 0, 0, 0, 0, 0, 0, 0], 6, 3]]]}
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(ORDERS_METRICS={'ENABLED': True, 'MULTIPROCESS_DIR': directory}):
+            try:
+                for process in (other, exited):
+                    with open(os.path.join(directory, f'metrics-{process.pid}-token.json'), 'w') as file:
+                        json.dump(snapshot, file)
+                self.client.get('/api/v1/orders/')
+                lines = self.client.get('/metrics').content.decode().splitlines()
+            finally:
+                other.kill()
+                other.wait()
+            self.assertIn('orders_api_requests_total{action="list",method="GET",status="200"} 7', lines)
+            self.assertIn('orders_api_db_queries_count{action="list",method="GET"} 7', lines)
+            # check the snapshot of the exited process is folded into the archive and still counted
+            self.assertFalse(os.path.exists(os.path.join(directory, f'metrics-{exited.pid}-token.json')))
+            self.assertTrue(os.path.exists(os.path.join(directory, 'archive.json')))
+            lines = self.client.get('/metrics').content.decode().splitlines()
+            self.assertIn('orders_api_requests_total{action="list",method="GET",status="200"} 7', lines)
+
+    def test_histogram_buckets(self):
+        histogram = Histogram('test_seconds', "Test.", ('action',), (0.1, 1))
+        for value in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(('list',), value)
+        self.assertEqual(histogram.collect()[2:], [
+            'test_seconds_bucket{action="list",le="0.1"} 2',
+            'test_seconds_bucket{action="list",le="1"} 3',
+            'test_seconds_bucket{action="list",le="+Inf"} 4',
+            'test_seconds_sum{action="list"} 2.65',
+            'test_seconds_count{action="list"} 4',
+        ])
+
+
+class BenchmarkSuiteTestCase(OrdersApiBaseTestCase):
+    """Tests for the benchmark suite of OrderViewSet actions """
+    # p95 latency budgets in milliseconds of the slow test, generous enough for a loaded CI runner
+    BUDGETS = {'list': 250, 'retrieve': 50, 'create': 100, 'put': 100, 'patch': 100, 'delete': 100}
+
+    def test_all_actions_measured(self):
+        seed_orders(200)
+        results = run_suite(repeat=3, offsets=[0, 100], warmup=1)
+        self.assertEqual([result['scenario'] for result in results],
+                         ['list_offset_0', 'list_offset_100', 'list_cursor', 'list_customer', 'list_status',
+                          'list_flavour', 'retrieve', 'create', 'put', 'patch', 'delete'])
+        self.assertEqual({result['action'] for result in results}, set(SUITE_ACTIONS))
+        for result in results:
+            self.assertEqual(result['count'], 3)
+            self.assertLessEqual(result['p50'], result['p95'])
+            self.assertLessEqual(result['p95'], result['p99'])
+            self.assertGreater(result['throughput'], 0)
+        # orders created by the suite are deleted by it
+        self.assertEqual(Order.objects.count(), 200)
+
+    def test_cached_scenarios_separate(self):
+        seed_orders(10)
+        results = run_suite(repeat=3, actions=['retrieve', 'patch'], warmup=1, cached=True)
+        # writes are measured once, reads with the cache get their own scenarios
+        self.assertEqual([result['scenario'] for result in results], ['retrieve', 'patch', 'retrieve_cached'])
+        self.assertEqual([result['action'] for result in results], ['retrieve', 'patch', 'retrieve'])
+
+    def test_writes_without_create(self):
+        results = run_suite(repeat=4, actions=['patch', 'delete'])
+        self.assertEqual([result['scenario'] for result in results], ['patch', 'delete'])
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_compare_results(self):
+        baseline = [{'scenario': 'list_offset_0', 'p95': 10.0}, {'scenario': 'retrieve', 'p95': 2.0}]
+        results = [{'scenario': 'list_offset_0', 'p95': 11.0}, {'scenario': 'retrieve', 'p95': 3.0},
+                   {'scenario': 'create', 'p95': 50.0}]
+        self.assertEqual(compare_results(results, baseline, max_regression=20), [
+            {'scenario': 'retrieve', 'metric': 'p95', 'baseline': 2.0, 'current': 3.0, 'change_percent': 50.0},
+        ])
+        self.assertEqual(compare_results(results, baseline, max_regression=60), [])
+
+    @tag('slow', 'benchmark')
+    def test_latency_budgets(self):
+        """
+        Runs the whole suite on ORDERS_BENCHMARK_ORDERS orders (100000 by default) and checks p95 latency
+        of every action fits its budget.
+        """
+        seed_orders(int(os.environ.get('ORDERS_BENCHMARK_ORDERS', 100000)))
+        for result in run_suite(repeat=50):
+            self.assertLess(result['p95'], self.BUDGETS[result['action']], result['scenario'])
+
+
+class IdempotencyKeyTestCase(OrdersApiBaseTestCase):
+    """Tests for POST /api/v1/orders/ with Idempotency-Key header """
+    def setUp(self):
+        super(IdempotencyKeyTestCase, self).setUp()
+        # stored responses of the previous tests are not valid, since their data is rolled back
+        front_cache = get_front_cache()
+        if front_cache is not None:
+            front_cache.clear()
+        self.data = {"customer_email": "test@moberries.com",
+                     "order_items": [{"flavour": "hawaii", "quantity": 2, "size": "small"}]}
+
+    def post(self, key, data=None):
+        return self.client.post('/api/v1/orders/', data=data or self.data, content_type='application/json',
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeated_request_replayed(self):
+        first = self.post('key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        second = self.post('key-1')
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(Order.objects.count(), 1)
+
+        # then the stored response is taken from the in-process cache without queries (it's put there on commit
+        # of the first request, tests run in a transaction, so it's put by the second one here)
+        with CaptureQueriesContext(connection) as context:
+            third = self.post('key-1')
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(third.content, first.content)
+
+        # another key creates another order
+        self.assertNotIn('Idempotent-Replayed', self.post('key-2'))
+        self.assertEqual(Order.objects.count(), 2)
+
+    @override_settings(ORDERS_IDEMPOTENCY={'CACHE_SIZE': 0})
+    def test_replayed_from_database(self):
+        first = self.post('key-1')
+        with CaptureQueriesContext(connection) as context:
+            second = self.post('key-1')
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.content, first.content)
+        self.assertFalse(any(query['sql'].startswith('INSERT INTO "pizza_ordering_order"')
+                             for query in context.captured_queries))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_with_another_request(self):
+        self.post('key-1')
+        response = self.post('key-1', dict(self.data, customer_email="other@moberries.com"))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_request_not_stored(self):
+        response = self.post('key-1', {"customer_email": "test"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        # the client fixes the request and retries with the same key
+        response = self.post('key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_invalid_key(self):
+        self.assertEqual(self.post('').status_code, 400)
+        self.assertEqual(self.post('k' * 256).status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    @override_settings(ORDERS_IDEMPOTENCY={'TTL': 60, 'CACHE_SIZE': 0})
+    def test_expired_key_taken_over_and_purged(self):
+        self.post('key-1')
+        self.post('key-2')
+        IdempotencyKey.objects.filter(key='key-1').update(created_at=timezone.now() - timedelta(minutes=2))
+
+        response = self.post('key-1')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Order.objects.count(), 3)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        self.post('key-3')
+        self.assertEqual(purge_expired_keys(batch_size=1), 2)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['key-3'])
+
+
+class IdempotencyKeyConcurrencyTestCase(TransactionTestCase):
+    """Tests for concurrent POST /api/v1/orders/ requests with the same Idempotency-Key """
+    threads = 20
+
+    def setUp(self):
+        front_cache = get_front_cache()
+        if front_cache is not None:
+            front_cache.clear()
+
+    def test_parallel_duplicates(self):
+        data = {"customer_email": "test@moberries.com",
+                "order_items": [{"flavour": "hawaii", "quantity": 2, "size": "small"}]}
+        responses = [None] * self.threads
+        start = threading.Barrier(self.threads)
+
+        def post(index):
+            try:
+                start.wait()
+                responses[index] = Client().post('/api/v1/orders/', data=data, content_type='application/json',
+                                                 HTTP_IDEMPOTENCY_KEY=f'key-{index % 2}')
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=post, args=(index,)) for index in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        # one order per key, every request with the key got the same response
+        self.assertEqual(Order.objects.count(), 2)
+        for key in range(2):
+            keyed = responses[key::2]
+            self.assertEqual({response.status_code for response in keyed}, {201})
+            self.assertEqual(sum(1 for response in keyed if 'Idempotent-Replayed' not in response), 1)
+            self.assertEqual(len({response.content for response in keyed}), 1)
+
+
+def wait_listening(order_cache, listening=True):
+    """
+    Waits for the invalidation listener of the orders cache to start (or stop) listening.
+    """
+    deadline = time.monotonic() + 5
+    while order_cache.listener.listening != listening:
+        if time.monotonic() > deadline:
+            raise AssertionError("The orders cache invalidation listener didn't start listening")
+        time.sleep(0.01)
+
+
+@override_settings(ORDERS_CACHE={'INVALIDATION': 'postgres'})
+class AsgiApplicationTestCase(TransactionTestCase):
+    """Tests for the ASGI entry point: cached reads on the event loop, the rest in the thread pool """
+    def setUp(self):
+        # pool threads close their connections after every request, so the test database could be dropped
+        patcher = mock.patch.dict(connection.settings_dict, {'CONN_MAX_AGE': 0})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        wsgi_application = get_wsgi_application()
+        self.wsgi_application = mock.Mock(side_effect=wsgi_application)
+        self.application = OrdersASGIApplication(self.wsgi_application, threads=2)
+        self.addCleanup(self.application.executor.shutdown)
+        self.order = Order.objects.create(customer_email="test1@moberries.com",
+                                          order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        self.client = Client()
+        # a new cache, which listens after the order was committed, so its invalidation doesn't come late
+        reset_order_cache('ORDERS_CACHE')
+        order_cache = get_order_cache()
+        if order_cache is not None and order_cache.listener is not None:
+            wait_listening(order_cache)
+
+    def call(self, method, path, query='', headers=None, body=b''):
+        """
+        Sends the request to the ASGI application. Returns status, headers and body.
+        """
+        scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+                 'query_string': query.encode(), 'root_path': '', 'server': ('testserver', 80),
+                 'client': ('127.0.0.1', 50000),
+                 'headers': [(name.encode(), value.encode())
+                             for name, value in dict({'host': 'testserver'}, **(headers or {})).items()]}
+        requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        messages = []
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            # the client stays connected
+            await asyncio.sleep(3600)
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.application(scope, receive, send))
+        self.assertEqual(messages[0]['type'], 'http.response.start')
+        self.assertFalse(messages[-1].get('more_body'))
+        return (messages[0]['status'], {name.decode(): value.decode() for name, value in messages[0]['headers']},
+                b''.join(message.get('body', b'') for message in messages[1:]))
+
+    def test_retrieve_cached_on_event_loop(self):
+        path = f'/api/v1/orders/{self.order.id}/'
+        status, headers, body = self.call('GET', path)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['x-cache'], 'MISS')
+        self.assertEqual(self.wsgi_application.call_count, 1)
+
+        status, headers, cached_body = self.call('GET', path)
+        self.assertEqual(self.wsgi_application.call_count, 1)
+        self.assertEqual(status, 200)
+        self.assertEqual(cached_body, body)
+        # the same response as the view gives for a cached order
+        response = self.client.get(path)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(cached_body, response.content)
+        self.assertEqual(headers, {name.lower(): value for name, value in response.items()})
+
+        status, headers, body = self.call('GET', path, headers={'if-none-match': headers['etag']})
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(headers, {name.lower(): value for name, value in
+                                   self.client.get(path, HTTP_IF_NONE_MATCH=headers['etag']).items()})
+        self.assertEqual(self.wsgi_application.call_count, 1)
+
+    def test_retrieve_cached_by_canonical_id_on_event_loop(self):
+        self.call('GET', f'/api/v1/orders/{self.order.id}/')
+        status, headers, body = self.call('GET', f'/api/v1/orders/0{self.order.id}/')
+        self.assertEqual(self.wsgi_application.call_count, 1)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['x-cache'], 'HIT')
+
+    def test_list_cached_on_event_loop(self):
+        self.call('GET', '/api/v1/orders/', 'limit=1')
+        status, headers, body = self.call('GET', '/api/v1/orders/', 'limit=1')
+        self.assertEqual(self.wsgi_application.call_count, 1)
+        self.assertEqual(status, 200)
+        response = self.client.get('/api/v1/orders/', {'limit': 1})
+        self.assertEqual(body, response.content)
+        self.assertEqual(headers, {name.lower(): value for name, value in response.items()})
+
+        # another page isn't cached yet
+        self.call('GET', '/api/v1/orders/', 'limit=2')
+        self.assertEqual(self.wsgi_application.call_count, 2)
+
+    def test_not_plain_json_requests_handled_by_view(self):
+        path = f'/api/v1/orders/{self.order.id}/'
+        self.call('GET', path)
+        self.call('GET', path, headers={'accept': 'application/json; indent=4'})
+        self.call('GET', path, 'format=json')
+        self.assertEqual(self.wsgi_application.call_count, 3)
+
+        status, _, _ = self.call('GET', path, headers={'host': 'example.com'})
+        self.assertEqual(status, 400)
+
+    def test_invalidated_by_writes_of_other_processes(self):
+        path = f'/api/v1/orders/{self.order.id}/'
+        self.call('GET', path)
+        # a write of another process, which notifies the cache in its transaction
+        with psycopg2.connect(**connection.get_connection_params()) as conn, conn.cursor() as cursor:
+            cursor.execute("UPDATE pizza_ordering_order SET customer_email = %s WHERE id = %s",
+                           ['test2@moberries.com', self.order.id])
+            cursor.execute("SELECT pg_notify('orders_cache', %s)", [json.dumps([self.order.id])])
+        conn.close()
+        order_cache = get_order_cache()
+        deadline = time.monotonic() + 5
+        while order_cache.get_order(self.order.id) is not None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        status, headers, body = self.call('GET', path)
+        self.assertEqual(headers['x-cache'], 'MISS')
+        self.assertEqual(json.loads(body)['customer_email'], 'test2@moberries.com')
+
+    def test_not_read_while_not_listening(self):
+        path = f'/api/v1/orders/{self.order.id}/'
+        self.call('GET', path)
+        order_cache = get_order_cache()
+        order_cache.listener.stop()
+        self.addCleanup(reset_order_cache, 'ORDERS_CACHE')
+        wait_listening(order_cache, listening=False)
+        status, headers, _ = self.call('GET', path)
+        self.assertEqual(self.wsgi_application.call_count, 2)
+        self.assertEqual(headers['x-cache'], 'MISS')
+
+    @override_settings(ORDERS_CACHE={})
+    def test_without_invalidation_handled_by_view(self):
+        path = f'/api/v1/orders/{self.order.id}/'
+        self.call('GET', path)
+        status, headers, _ = self.call('GET', path)
+        # the view still answers from the cache of its process
+        self.assertEqual(self.wsgi_application.call_count, 2)
+        self.assertEqual(headers['x-cache'], 'HIT')
+
+    @override_settings(ORDERS_CACHE={'BACKEND': None})
+    def test_without_cache(self):
+        for _ in range(2):
+            status, headers, body = self.call('GET', f'/api/v1/orders/{self.order.id}/')
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body)['id'], self.order.id)
+        self.assertEqual(self.wsgi_application.call_count, 2)
+
+    def test_writes_and_streams_in_thread_pool(self):
+        body = json.dumps({"customer_email": "test2@moberries.com",
+                           "order_items": [{"flavour": "fungi", "quantity": 1, "size": "big"}]}).encode()
+        status, _, content = self.call('POST', '/api/v1/orders/', headers={'content-type': 'application/json',
+                                                                          'content-length': str(len(body))},
+                                       body=body)
+        self.assertEqual(status, 201)
+        self.assertEqual(Order.objects.get(id=json.loads(content)['id']).customer_email, "test2@moberries.com")
+
+        with mock.patch('pizza_ordering.asgi.STREAM_BUFFER', 1):
+            status, headers, content = self.call('GET', '/api/v1/orders/export/', 'format=csv')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'text/csv; charset=utf-8')
+        self.assertEqual(content, b''.join(self.client.get('/api/v1/orders/export/?format=csv').streaming_content))
+
+        status, _, content = self.call('HEAD', f'/api/v1/orders/{self.order.id}/')
+        self.assertEqual(status, 200)
+        self.assertEqual(content, b'')
+
+    @override_settings(ORDERS_EVENTS={'BROKER': 'inprocess', 'HEARTBEAT': 0.1, 'MAX_DURATION': 60})
+    def test_stream_stopped_on_disconnect(self):
+        scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                 'path': f'/api/v1/orders/{self.order.id}/events/', 'query_string': b'', 'root_path': '',
+                 'headers': [(b'host', b'testserver'), (b'accept', b'text/event-stream')]}
+        messages = []
+        received = []
+
+        async def receive():
+            received.append(None)
+            if len(received) == 1:
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await asyncio.sleep(0.3)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        started = time.monotonic()
+        asyncio.run(self.application(scope, receive, send))
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn(b'event: delivery_status', b''.join(message.get('body', b'') for message in messages[1:]))
+
+
+class OrderClaimTestCase(OrdersApiBaseTestCase):
+    """Tests for kitchen claims: POST /api/v1/orders/claim/ and DELETE /api/v1/orders/{id}/claim/ """
+    def setUp(self):
+        super(OrderClaimTestCase, self).setUp()
+        now = timezone.now()
+        items = [[{"flavour": "hawaii", "quantity": 2, "size": "small"}],
+                 [{"flavour": "fungi", "quantity": 1, "size": "big"},
+                  {"flavour": "hawaii", "quantity": 1, "size": "small"}],
+                 [{"flavour": "fungi", "quantity": 3, "size": "big"}],
+                 [{"flavour": "margherita", "quantity": 1, "size": "big"}]]
+        self.orders = []
+        for index, order_items in enumerate(items):
+            order = Order.objects.create(customer_email=f"test{index}@moberries.com", order_items=order_items)
+            # the first order is the oldest one
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(minutes=10 - index))
+            self.orders.append(order.pk)
+        Order.objects.create(customer_email="ready@moberries.com", delivery_status='ready_for_delivery',
+                             order_items=[{"flavour": "fungi", "quantity": 1, "size": "big"}])
+
+    def claim(self, query):
+        return self.client.post(f'/api/v1/orders/claim/?{query}')
+
+    def test_oldest_orders_claimed_once(self):
+        response = self.claim('station=oven-1&max=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['station'], 'oven-1')
+        self.assertEqual([order['id'] for order in response.data['orders']], self.orders[:3])
+        self.assertEqual(set(response.data['orders'][0]), set(ORDER_FIELDS))
+
+        # claimed orders aren't handed out again, orders in other statuses are never handed out
+        response = self.claim('station=oven-2&max=3')
+        self.assertEqual([order['id'] for order in response.data['orders']], self.orders[3:])
+        self.assertEqual(self.claim('station=oven-3').data['orders'], [])
+
+    def test_items_grouped(self):
+        groups = self.claim('station=oven-1&max=3').data['groups']
+        self.assertEqual(groups, [
+            {'flavour': 'fungi', 'size': 'big', 'quantity': 4, 'order_ids': self.orders[1:3]},
+            {'flavour': 'hawaii', 'size': 'small', 'quantity': 3, 'order_ids': self.orders[:2]},
+        ])
+
+    def test_claim_by_flavour_and_size(self):
+        response = self.claim('station=oven-1&flavour=fungi&size=big')
+        self.assertEqual([order['id'] for order in response.data['orders']], self.orders[1:3])
+        response = self.claim('station=oven-2&flavour=hawaii')
+        self.assertEqual([order['id'] for order in response.data['orders']], self.orders[:1])
+
+    def test_expired_lease_claimed_again(self):
+        self.claim('station=oven-1&max=1&lease=60')
+        Order.objects.filter(pk=self.orders[0]).update(claim_expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.claim('station=oven-2&max=1')
+        self.assertEqual([order['id'] for order in response.data['orders']], self.orders[:1])
+        self.assertEqual(Order.objects.get(pk=self.orders[0]).claimed_by, 'oven-2')
+
+    def test_release(self):
+        self.claim('station=oven-1&max=1')
+        url = f'/api/v1/orders/{self.orders[0]}/claim/'
+        self.assertEqual(self.client.delete(f'{url}?station=oven-2').status_code, 409)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(self.client.delete(f'{url}?station=oven-1').status_code, 204)
+        self.assertEqual(self.client.delete(f'{url}?station=oven-1').status_code, 404)
+        # the released order is handed out again
+        response = self.claim('station=oven-2&max=1')
+        self.assertEqual([order['id'] for order in response.data['orders']], self.orders[:1])
+
+    @override_settings(ORDERS_CLAIMS={'MAX_BATCH': 5, 'MAX_LEASE': 60})
+    def test_invalid_query(self):
+        for query in ['max=1', 'station=oven-1&max=6', 'station=oven-1&max=0', 'station=oven-1&lease=61',
+                      'station=oven-1&flavour=salami', 'station=oven-1&size=medium']:
+            with self.subTest(query=query):
+                self.assertEqual(self.claim(query).status_code, 400)
+        self.assertFalse(Order.objects.filter(claimed_by__isnull=False).exists())
+
+    def test_claim_not_exposed(self):
+        self.claim('station=oven-1&max=1')
+        response = self.client.get(f'/api/v1/orders/{self.orders[0]}/')
+        self.assertNotIn('claimed_by', response.data)
+        self.assertNotIn('claim_expires_at', response.data)
+
+
+class OrderClaimConcurrencyTestCase(TransactionTestCase):
+    """Tests for concurrent POST /api/v1/orders/claim/ requests of several stations """
+    threads = 6
+
+    def test_parallel_claims_disjoint(self):
+        Order.objects.bulk_create(Order(customer_email=f"test{index}@moberries.com",
+                                        order_items=[{"flavour": "hawaii", "quantity": 1, "size": "small"}])
+                                  for index in range(40))
+        claimed = [[] for _ in range(self.threads)]
+        start = threading.Barrier(self.threads)
+
+        def claim(index):
+            try:
+                client = Client()
+                start.wait()
+                while True:
+                    response = client.post(f'/api/v1/orders/claim/?station=oven-{index}&max=3')
+                    if not response.json()['orders']:
+                        break
+                    claimed[index].extend(order['id'] for order in response.json()['orders'])
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=claim, args=(index,)) for index in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        # every order is handed out exactly once
+        ids = [order_id for station_ids in claimed for order_id in station_ids]
+        self.assertEqual(sorted(ids), sorted(Order.objects.values_list('id', flat=True)))
+        for index, station_ids in enumerate(claimed):
+            self.assertEqual(Order.objects.filter(id__in=station_ids).exclude(claimed_by=f'oven-{index}').count(), 0)
+
+
+class ReplicaRouterTestCase(SimpleTestCase):
+    """Tests for choosing a read replica (weighted round-robin over healthy replicas) and routing reads to it """
+    def test_weighted_round_robin(self):
+        pool = ReplicaPool({'replica1': 2, 'replica2': 1, 'replica3': 0}, check_interval=60, max_lag=5)
+        with mock.patch.object(ReplicaPool, 'check', return_value=True):
+            chosen = [pool.choose() for _ in range(6)]
+        # replicas are interleaved, not chosen in runs of their weight
+        self.assertEqual(chosen, ['replica1', 'replica2', 'replica1'] * 2)
+
+    def test_unhealthy_replicas_skipped(self):
+        pool = ReplicaPool({'replica1': 1, 'replica2': 1}, check_interval=60, max_lag=5)
+        with mock.patch.object(ReplicaPool, 'check', side_effect=lambda alias: alias == 'replica2') as check, \
+                self.assertLogs('pizza_ordering.replicas', 'WARNING'):
+            self.assertEqual({pool.choose() for _ in range(4)}, {'replica2'})
+        # replicas are checked once per interval
+        self.assertEqual(check.call_count, 2)
+
+        pool = ReplicaPool({'replica1': 1}, check_interval=0, max_lag=5)
+        with mock.patch.object(ReplicaPool, 'check', side_effect=[False, True]), \
+                self.assertLogs('pizza_ordering.replicas', 'WARNING') as logs:
+            self.assertIsNone(pool.choose())
+            self.assertEqual(pool.choose(), 'replica1')
+        self.assertEqual(logs.output, ['WARNING:pizza_ordering.replicas:Replica replica1 is unhealthy',
+                                       'WARNING:pizza_ordering.replicas:Replica replica1 is healthy again'])
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Order))
+        with reads_from('replica1'):
+            self.assertEqual(router.db_for_read(Order), 'replica1')
+            self.assertEqual(router.db_for_write(Order), 'default')
+            # reads of a transaction see its writes only on the primary
+            with mock.patch.object(connection, 'in_atomic_block', True):
+                self.assertIsNone(router.db_for_read(Order))
+        self.assertFalse(router.allow_migrate('replica1', 'pizza_ordering'))
+        self.assertTrue(router.allow_migrate('default', 'pizza_ordering'))
+
+
+class ReplicaRoutingTestCase(OrdersApiBaseTestCase):
+    """Tests for routing reads to replicas and pinning clients to the primary after writes """
+    def setUp(self):
+        super(ReplicaRoutingTestCase, self).setUp()
+        # the primary plays the replica, so the queries could run
+        override = override_settings(ORDERS_REPLICAS={'WEIGHTS': {'default': 1}, 'PIN_SECONDS': 5})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.order = Order.objects.create(customer_email="test@moberries.com",
+                                          order_items=[{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+
+    def test_safe_requests_read_from_replica(self):
+        with mock.patch.object(ReplicaPool, 'choose', return_value='default') as choose:
+            self.assertEqual(self.client.get('/api/v1/orders/').status_code, 200)
+            self.assertEqual(choose.call_count, 1)
+            response = self.client.patch(f'/api/v1/orders/{self.order.pk}/', data={'delivery_status': 'dispatched'},
+                                         content_type='application/json')
+            self.assertEqual(choose.call_count, 1)
+        self.assertEqual(response.cookies['orders_primary']['max-age'], 5)
+
+    @override_settings(ORDERS_REPLICAS={'WEIGHTS': {'default': 1}, 'MAX_LAG': 5, 'CHECK_INTERVAL': 3})
+    def test_pin_outlasts_replica_lag(self):
+        response = self.client.patch(f'/api/v1/orders/{self.order.pk}/', data={'delivery_status': 'dispatched'},
+                                     content_type='application/json')
+        self.assertEqual(response.cookies['orders_primary']['max-age'], 8)
+
+    def test_pinned_client_reads_primary_bypassing_cache(self):
+        url = f'/api/v1/orders/{self.order.pk}/'
+        # reads from the replica don't fill the cache
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.client.patch(url, data={'delivery_status': 'dispatched'}, content_type='application/json')
+
+        with mock.patch.object(ReplicaPool, 'choose', return_value=None) as choose:
+            response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertEqual(response.data['delivery_status'], 'dispatched')
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+            # until the pin expires, then the cache filled from the primary is read
+            self.client.cookies.pop('orders_primary')
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        self.assertEqual(choose.call_count, 1)
+
+    @override_settings(ORDERS_REPLICAS={})
+    def test_no_replicas(self):
+        response = self.client.patch(f'/api/v1/orders/{self.order.pk}/', data={'delivery_status': 'dispatched'},
+                                     content_type='application/json')
+        self.assertNotIn('orders_primary', response.cookies)
+
+    def test_health_check(self):
+        pool = ReplicaPool({'default': 1}, check_interval=5, max_lag=5)
+        # the primary isn't in recovery
+        self.assertTrue(pool.check('default'))
+        # the broken connection is dropped (the test one is kept, it holds the test transaction)
+        with mock.patch.object(connection, 'cursor', side_effect=OperationalError), \
+                mock.patch.object(connection, 'close_if_unusable_or_obsolete') as close:
+            self.assertFalse(pool.check('default'))
+        close.assert_called_once_with()
+
+    def test_health_check_of_standby(self):
+        pool = ReplicaPool({'default': 1}, check_interval=5, max_lag=5)
+        with connection.cursor() as cursor:
+            # the primary plays a standby: recovery functions and the WAL receiver are shadowed by a schema
+            # searched before pg_catalog
+            cursor.execute("""
+                CREATE SCHEMA standby;
+                CREATE TABLE standby.state (status text, receive_lsn pg_lsn, replay_lsn pg_lsn, replay_at timestamptz);
+                CREATE FUNCTION standby.pg_is_in_recovery() RETURNS boolean AS 'SELECT true' LANGUAGE sql;
+                CREATE FUNCTION standby.pg_last_wal_receive_lsn() RETURNS pg_lsn
+                    AS 'SELECT receive_lsn FROM standby.state' LANGUAGE sql;
+                CREATE FUNCTION standby.pg_last_wal_replay_lsn() RETURNS pg_lsn
+                    AS 'SELECT replay_lsn FROM standby.state' LANGUAGE sql;
+                CREATE FUNCTION standby.pg_last_xact_replay_timestamp() RETURNS timestamptz
+                    AS 'SELECT replay_at FROM standby.state' LANGUAGE sql;
+                CREATE VIEW standby.pg_stat_wal_receiver AS SELECT status FROM standby.state WHERE status IS NOT NULL;
+                SET LOCAL search_path = standby, pg_catalog, public;
+            """)
+
+            def check(status, receive_lsn, replay_lsn, behind):
+                cursor.execute("TRUNCATE standby.state")
+                cursor.execute("INSERT INTO standby.state VALUES (%s, %s, %s, now() - %s * interval '1 second')",
+                               [status, receive_lsn, replay_lsn, behind])
+                return pool.check('default')
+
+            self.assertTrue(check('streaming', '0/10', '0/10', 3600))
+            self.assertTrue(check('streaming', '0/20', '0/10', 1))
+            self.assertFalse(check('streaming', '0/20', '0/10', 60))
+            # no transaction replayed yet
+            self.assertFalse(check('streaming', '0/20', '0/10', None))
+            # the WAL receiver is disconnected: all the received WAL is replayed, but the primary could be far ahead
+            self.assertFalse(check(None, '0/10', '0/10', 3600))
+            self.assertFalse(check('waiting', '0/10', '0/10', 0))
+
+
+class OutboxTestCase(OrdersApiBaseTestCase):
+    """Tests for the outbox of order events: recording with the order changes and dispatching to the destinations """
+    def setUp(self):
+        super(OutboxTestCase, self).setUp()
+        self.stand_in = OutboxStandIn().start()
+        self.addCleanup(self.stand_in.stop)
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(self.executor.shutdown)
+        override = override_settings(ORDERS_OUTBOX={
+            'DESTINATIONS': {'partner': f'{self.stand_in.url}/partner', 'notifications': f'{self.stand_in.url}/notify'},
+            'BACKOFF': 1, 'MAX_BACKOFF': 300, 'MAX_ATTEMPTS': 3})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.options = get_outbox_settings()
+        self.delivery = HttpDelivery(self.options['DESTINATIONS'], timeout=5)
+        self.order_items = [{"flavour": "hawaii", "quantity": 2, "size": "small"}]
+
+    def create_order(self):
+        response = self.client.post('/api/v1/orders/', data={"customer_email": "test@moberries.com",
+                                                             "order_items": self.order_items},
+                                    content_type='application/json')
+        return response.data['id']
+
+    def patch(self, pk, delivery_status):
+        return self.client.patch(f'/api/v1/orders/{pk}/', data={'delivery_status': delivery_status},
+                                 content_type='application/json')
+
+    def dispatch(self):
+        return dispatch_batch(self.delivery, self.executor, self.options)
+
+    def test_events_recorded_with_order_changes(self):
+        pk = self.create_order()
+        events = OutboxEvent.objects.order_by('id')
+        self.assertEqual(sorted(events.values_list('destination', 'order_id', 'event_type')),
+                         [('notifications', pk, EVENT_ORDER_CREATED), ('partner', pk, EVENT_ORDER_CREATED)])
+        self.assertEqual(events[0].payload['order_items'], self.order_items)
+
+        self.assertEqual(self.patch(pk, 'dispatched').status_code, 200)
+        event = events.filter(event_type=EVENT_DELIVERY_STATUS).first()
+        self.assertEqual((event.payload['delivery_status'], event.payload['previous_status']),
+                         ('dispatched', 'not_in_delivery'))
+        # rejected and no-op changes record nothing
+        self.assertEqual(self.patch(pk, 'not_in_delivery').status_code, 409)
+        self.patch(pk, 'dispatched')
+        self.assertEqual(events.count(), 4)
+
+        response = self.client.post('/api/v1/orders/bulk/', data=[{"customer_email": "test@moberries.com",
+                                                                   "order_items": self.order_items}] * 2,
+                                    content_type='application/json')
+        ids = [item['id'] for item in response.data['created']]
+        self.assertEqual(events.filter(order_id__in=ids, event_type=EVENT_ORDER_CREATED).count(), 4)
+        self.client.patch('/api/v1/orders/status/', data={'delivery_status': 'ready_for_delivery', 'ids': ids},
+                          content_type='application/json')
+        self.assertEqual(events.filter(order_id__in=ids, event_type=EVENT_DELIVERY_STATUS).count(), 4)
+
+    def test_no_destinations(self):
+        with override_settings(ORDERS_OUTBOX={'DESTINATIONS': {}}):
+            self.patch(self.create_order(), 'dispatched')
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_dispatch_in_order(self):
+        pk = self.create_order()
+        self.patch(pk, 'ready_for_delivery')
+        self.patch(pk, 'dispatched')
+
+        # one event per order and destination at a time
+        stats = self.dispatch()
+        self.assertEqual((stats['fetched'], stats['delivered'], len(stats['lags'])), (2, 2, 2))
+        self.assertEqual({event['type'] for event in self.stand_in.events}, {EVENT_ORDER_CREATED})
+        while self.dispatch()['fetched']:
+            pass
+        self.assertEqual(pending_count(), 0)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+        received = [(event['path'], event['type'], event['data'].get('delivery_status'))
+                    for event in self.stand_in.events]
+        for path in ('/partner', '/notify'):
+            self.assertEqual([event[1:] for event in received if event[0] == path],
+                             [(EVENT_ORDER_CREATED, 'not_in_delivery'), (EVENT_DELIVERY_STATUS, 'ready_for_delivery'),
+                              (EVENT_DELIVERY_STATUS, 'dispatched')])
+        self.assertEqual((self.stand_in.out_of_order, self.stand_in.duplicates), (0, 0))
+
+    def test_retry_holds_later_events(self):
+        pk = self.create_order()
+        self.patch(pk, 'dispatched')
+        self.stand_in.fail_rate = 1
+        started = timezone.now()
+        self.assertEqual(self.dispatch()['retried'], 2)
+        created = OutboxEvent.objects.filter(event_type=EVENT_ORDER_CREATED)
+        for event in created:
+            self.assertEqual((event.attempts, event.last_error, event.failed_at), (1, 'HTTP 503', None))
+            self.assertGreaterEqual(event.next_attempt_at, started + timedelta(seconds=1))
+        # the status change waits for the creation to be delivered
+        self.assertEqual(self.dispatch()['fetched'], 0)
+
+        self.stand_in.fail_rate = 0
+        created.update(next_attempt_at=timezone.now())
+        self.assertEqual(self.dispatch()['delivered'], 2)
+        self.assertEqual(self.dispatch()['delivered'], 2)
+        self.assertEqual(self.stand_in.failures, 2)
+        self.assertEqual(self.stand_in.out_of_order, 0)
+
+    def test_failed_events_kept(self):
+        pk = self.create_order()
+        self.patch(pk, 'dispatched')
+        # client errors aren't retried
+        with mock.patch.object(HttpDelivery, 'deliver', return_value=(400, 'HTTP 400')):
+            self.assertEqual(self.dispatch()['failed'], 2)
+        self.assertEqual(OutboxEvent.objects.filter(failed_at__isnull=False).count(), 2)
+        self.assertEqual(pending_count(), 2)
+
+        # MAX_ATTEMPTS failures fail the event
+        OutboxEvent.objects.filter(failed_at__isnull=True).update(attempts=2)
+        with mock.patch.object(HttpDelivery, 'deliver', return_value=(None, 'ConnectionRefusedError')):
+            self.assertEqual(self.dispatch()['failed'], 2)
+        self.assertEqual(pending_count(), 0)
+        self.assertEqual(set(OutboxEvent.objects.values_list('attempts', 'last_error')),
+                         {(1, 'HTTP 400'), (3, 'ConnectionRefusedError')})
+
+    def test_delivered_outside_transaction_under_lease(self):
+        pk = self.create_order()
+        savepoints = len(connection.savepoint_ids)
+        claimed = []
+
+        def deliver(event):
+            # no transaction is held and other dispatchers can't claim the event meanwhile
+            self.assertEqual(len(connection.savepoint_ids), savepoints)
+            claimed.extend(claim_due_events(['partner', 'notifications'], 10, timezone.now()))
+            leased_until = OutboxEvent.objects.get(id=event['id']).next_attempt_at
+            self.assertGreaterEqual(leased_until, timezone.now() + timedelta(seconds=lease_seconds(self.options) - 5))
+            return 204, ''
+
+        # deliveries run in the thread, which has claimed them
+        with mock.patch.object(HttpDelivery, 'deliver', side_effect=deliver):
+            self.assertEqual(dispatch_batch(self.delivery, mock.Mock(map=map), self.options)['delivered'], 2)
+        self.assertEqual(claimed, [])
+        self.assertFalse(OutboxEvent.objects.filter(order_id=pk).exists())
+
+    def test_expired_lease_outcome_not_recorded(self):
+        self.create_order()
+        later = timezone.now() + timedelta(hours=1)
+
+        def deliver(event):
+            # the lease has expired and another dispatcher has claimed the event
+            OutboxEvent.objects.filter(id=event['id']).update(next_attempt_at=later)
+            return (204, '') if event['destination'] == 'partner' else (503, 'HTTP 503')
+
+        with mock.patch.object(HttpDelivery, 'deliver', side_effect=deliver):
+            dispatch_batch(self.delivery, mock.Mock(map=map), self.options)
+        self.assertEqual(set(OutboxEvent.objects.values_list('attempts', 'next_attempt_at', 'last_error')),
+                         {(0, later, '')})
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+        self.assertEqual(lease_seconds(dict(self.options, BATCH_SIZE=100, WORKERS=8, TIMEOUT=5)), 13 * 10 + 30)
+
+    def test_delivery(self):
+        event = {'id': 1, 'destination': 'partner', 'order_id': 2, 'event_type': EVENT_ORDER_CREATED,
+                 'payload': {'id': 2}, 'created_at': timezone.now(), 'attempts': 0}
+        self.assertEqual(self.delivery.deliver(event), (204, ''))
+        # the keep-alive connection is reused
+        self.assertEqual(self.delivery.deliver(dict(event, id=2)), (204, ''))
+        self.assertEqual([received['id'] for received in self.stand_in.events], [1, 2])
+
+        stopped = OutboxStandIn().start()
+        stopped.stop()
+        status_code, error = HttpDelivery({'partner': stopped.url}, timeout=5).deliver(event)
+        self.assertIsNone(status_code)
+        self.assertIn('ConnectionRefusedError', error)
+
+        with self.assertRaises(ValueError):
+            HttpDelivery({'partner': 'ftp://example.com'}, timeout=5)
+
+    def test_backoff(self):
+        self.assertEqual([backoff(attempts, self.options) for attempts in (1, 2, 3, 9)], [1, 2, 4, 256])
+        self.assertEqual(backoff(20, self.options), 300)
+
+    def test_dispatch_command(self):
+        self.patch(self.create_order(), 'dispatched')
+        out = io.StringIO()
+        call_command('dispatch_outbox', once=True, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['delivered'], report['pending']), (4, 0))
+        self.assertEqual(len(self.stand_in.events), 4)
+
+        with override_settings(ORDERS_OUTBOX={'DESTINATIONS': {}}), self.assertRaises(CommandError):
+            call_command('dispatch_outbox', once=True, stdout=out)
+
+
+class OutboxConcurrencyTestCase(TransactionTestCase):
+    """Tests for several dispatchers delivering the outbox at once """
+    threads = 4
+
+    def test_parallel_dispatchers_keep_order(self):
+        stand_in = OutboxStandIn().start()
+        self.addCleanup(stand_in.stop)
+        outbox = {'DESTINATIONS': {'partner': f'{stand_in.url}/partner'}, 'BATCH_SIZE': 5}
+        with override_settings(ORDERS_OUTBOX=outbox):
+            order_items = [{"flavour": "hawaii", "quantity": 1, "size": "small"}]
+            orders = Order.objects.bulk_create(Order(customer_email=f"test{index}@moberries.com",
+                                                     order_items=order_items) for index in range(10))
+            record_orders_created(orders)
+            for previous_status, delivery_status in [('not_in_delivery', 'ready_for_delivery'),
+                                                     ('ready_for_delivery', 'dispatched'),
+                                                     ('dispatched', 'delivered')]:
+                record_status_changes((Order(id=order.id, customer_email=order.customer_email,
+                                             delivery_status=delivery_status, updated_at=timezone.now()),
+                                       previous_status) for order in orders)
+            options = get_outbox_settings()
+            start = threading.Barrier(self.threads)
+
+            def dispatch():
+                try:
+                    delivery = HttpDelivery(options['DESTINATIONS'], timeout=5)
+                    with ThreadPoolExecutor(max_workers=2) as executor:
+                        start.wait()
+                        while dispatch_batch(delivery, executor, options)['fetched'] or pending_count():
+                            pass
+                finally:
+                    connection.close()
+
+            dispatchers = [threading.Thread(target=dispatch) for _ in range(self.threads)]
+            for dispatcher in dispatchers:
+                dispatcher.start()
+            for dispatcher in dispatchers:
+                dispatcher.join()
+
+        self.assertEqual(len(stand_in.events), 40)
+        self.assertEqual((stand_in.out_of_order, stand_in.duplicates), (0, 0))
+        for order in orders:
+            self.assertEqual([event['data'].get('delivery_status') for event in stand_in.events
+                              if event['order_id'] == order.id],
+                             ['not_in_delivery', 'ready_for_delivery', 'dispatched', 'delivered'])
+
+
+class CustomerSummaryTestCase(OrdersApiBaseTestCase):
+    """Tests for GET /api/v1/customers/{email}/summary/ and maintenance of the customer summaries """
+    def setUp(self):
+        super(CustomerSummaryTestCase, self).setUp()
+        self.url = '/api/v1/customers/'
+
+    def create(self, customer_email, order_items):
+        response = self.client.post('/api/v1/orders/', data={"customer_email": customer_email,
+                                                             "order_items": order_items},
+                                    content_type='application/json')
+        return response.data
+
+    def summary(self, customer_email):
+        return self.client.get(f'{self.url}{customer_email}/summary/')
+
+    def rows(self):
+        return list(CustomerSummary.objects.order_by('customer_email').values(
+            'customer_email', 'orders', 'active_orders', 'last_order_at', 'flavour_pizzas', 'size_pizzas'))
+
+    def test_summary_follows_orders(self):
+        first = self.create("test+1@moberries.com", [{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        second = self.create("test+1@moberries.com", [{"flavour": "fungi", "quantity": 1, "size": "big"},
+                                                      {"flavour": "hawaii", "quantity": 1, "size": "big"}])
+        response = self.summary("test+1@moberries.com")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({key: response.data[key] for key in ('customer_email', 'orders', 'active_orders',
+                                                              'last_order_at', 'favourite_flavour', 'favourite_size')},
+                         {'customer_email': "test+1@moberries.com", 'orders': 2, 'active_orders': 2,
+                          'last_order_at': second['created_at'], 'favourite_flavour': 'hawaii',
+                          'favourite_size': 'big'})
+
+        self.client.patch(f"/api/v1/orders/{first['id']}/", data={'delivery_status': 'delivered'},
+                          content_type='application/json')
+        self.client.put(f"/api/v1/orders/{second['id']}/",
+                        data={"customer_email": "test+1@moberries.com",
+                              "order_items": [{"flavour": "fungi", "quantity": 5, "size": "small"}]},
+                        content_type='application/json')
+        response = self.summary("test+1@moberries.com")
+        self.assertEqual((response.data['orders'], response.data['active_orders']), (2, 1))
+        self.assertEqual((response.data['favourite_flavour'], response.data['favourite_size']), ('fungi', 'small'))
+
+        # the order moves to another customer
+        self.client.put(f"/api/v1/orders/{second['id']}/",
+                        data={"customer_email": "other@moberries.com", "order_items": [
+                            {"flavour": "fungi", "quantity": 5, "size": "small"}]},
+                        content_type='application/json')
+        response = self.summary("test+1@moberries.com")
+        self.assertEqual((response.data['orders'], response.data['active_orders']), (1, 0))
+        self.assertEqual(response.data['last_order_at'], first['created_at'])
+        self.assertEqual(response.data['favourite_flavour'], 'hawaii')
+        self.assertEqual(self.summary("other@moberries.com").data['orders'], 1)
+
+        self.client.delete(f"/api/v1/orders/{first['id']}/")
+        self.assertEqual(self.summary("test+1@moberries.com").status_code, 404)
+
+    def test_bulk_changes(self):
+        response = self.client.post('/api/v1/orders/bulk/', data=[
+            {"customer_email": f"test{index % 2}@moberries.com",
+             "order_items": [{"flavour": "margherita", "quantity": 1 + index, "size": "small"}]}
+            for index in range(5)], content_type='application/json')
+        ids = [item['id'] for item in response.data['created']]
+        self.client.patch('/api/v1/orders/status/', data={'delivery_status': 'delivered', 'ids': ids[:3]},
+                          content_type='application/json')
+        self.assertEqual([(row['customer_email'], row['orders'], row['active_orders'], row['flavour_pizzas'][0])
+                          for row in self.rows()],
+                         [("test0@moberries.com", 3, 1, 9), ("test1@moberries.com", 2, 1, 6)])
+
+    def test_lookup_single_query(self):
+        self.create("test@moberries.com", [{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.summary("test@moberries.com").status_code, 200)
+        self.assertEqual(self.summary("nobody@moberries.com").status_code, 404)
+
+    def test_rebuild_matches_incremental(self):
+        orders = [self.create(f"test{index % 3}@moberries.com",
+                              [{"flavour": Order.ITEM_FLAVOURS[index % 5], "quantity": 1 + index % 4,
+                                "size": Order.ITEM_SIZES[index % 2]}])
+                  for index in range(12)]
+        for order in orders[:4]:
+            self.client.patch(f"/api/v1/orders/{order['id']}/", data={'delivery_status': 'dispatched'},
+                              content_type='application/json')
+        for order in orders[4:6]:
+            self.client.delete(f"/api/v1/orders/{order['id']}/")
+        incremental = self.rows()
+        self.assertEqual(len(incremental), 3)
+
+        CustomerSummary.objects.update(orders=0, flavour_pizzas=[])
+        CustomerSummary.objects.create(customer_email="gone@moberries.com", orders=1, active_orders=0,
+                                       flavour_pizzas=[], size_pizzas=[], updated_at=timezone.now())
+        self.assertEqual(rebuild_summaries(chunk_size=2), 3)
+        self.assertEqual(self.rows(), incremental)
+
+    def test_orders_bypassing_api(self):
+        # JSON-encoded order items, the way some orders were saved
+        order = Order.objects.create(customer_email="test@moberries.com",
+                                     order_items='[{"flavour": "fungi", "quantity": 3, "size": "big"}]')
+        self.assertEqual(self.summary("test@moberries.com").status_code, 404)
+        self.assertEqual(rebuild_summaries(), 1)
+        self.assertEqual(self.summary("test@moberries.com").data['favourite_flavour'], 'fungi')
+        self.assertEqual(self.rows()[0]['flavour_pizzas'], [0, 0, 3, 0, 0])
+
+        # counting out an order, which was never counted in, doesn't leave negative rows
+        SummaryChanges().remove(order).remove(order).save()
+        self.assertFalse(CustomerSummary.objects.exists())
+
+    def test_rebuild_command(self):
+        self.create("test@moberries.com", [{"flavour": "hawaii", "quantity": 2, "size": "small"}])
+        out = io.StringIO()
+        call_command('rebuild_customer_summaries', chunk_size=10, stdout=out)
+        self.assertTrue(out.getvalue().startswith('1 customer summaries rebuilt'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_customer_summaries', chunk_size=0, stdout=out)
+
+
+class CustomerSummaryConcurrencyTestCase(TransactionTestCase):
+    """Tests for concurrent order changes of the same customer and a rebuild running meanwhile """
+    threads = 6
+
+    def test_parallel_orders_counted_once(self):
+        start = threading.Barrier(self.threads + 1)
+
+        def create(index):
+            try:
+                client = Client()
+                start.wait()
+                for number in range(5):
+                    response = client.post('/api/v1/orders/', data={
+                        "customer_email": f"test{number % 2}@moberries.com",
+                        "order_items": [{"flavour": "hawaii", "quantity": 1, "size": "small"}]},
+                        content_type='application/json')
+                    if number == 4:
+                        client.delete(f"/api/v1/orders/{response.data['id']}/")
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=create, args=(index,)) for index in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        start.wait()
+        # rebuilds race with the order changes
+        for _ in range(3):
+            rebuild_summaries(chunk_size=1)
+        for worker in workers:
+            worker.join()
+
+        rows = dict(CustomerSummary.objects.values_list('customer_email', 'orders'))
+        self.assertEqual(rows, {"test0@moberries.com": 2 * self.threads, "test1@moberries.com": 2 * self.threads})
+        incremental = list(CustomerSummary.objects.order_by('customer_email').values_list(
+            'customer_email', 'orders', 'active_orders', 'last_order_at', 'flavour_pizzas', 'size_pizzas'))
+        rebuild_summaries()
+        self.assertEqual(list(CustomerSummary.objects.order_by('customer_email').values_list(
+            'customer_email', 'orders', 'active_orders', 'last_order_at', 'flavour_pizzas', 'size_pizzas')),
+            incremental)
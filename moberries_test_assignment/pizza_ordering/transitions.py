@@ -0,0 +1,102 @@
+"""
+delivery_status transitions over the graph declared in Order.DELIVERY_STATUS_TRANSITIONS.
+
+A transition is applied with one conditional UPDATE: the row is changed only if its current status allows
+the transition, so there is no read-modify-write and concurrent transitions can't overwrite each other.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from django.db import connection
+from django.utils import timezone
+
+from pizza_ordering.models import Order
+
+RESULT_UPDATED = 'updated'
+RESULT_UNCHANGED = 'unchanged'  # already in the status
+RESULT_CONFLICT = 'conflict'  # transition from the current status isn't allowed
+RESULT_NOT_FOUND = 'not_found'
+
+
+def allowed_sources(delivery_status: str) -> List[str]:
+    """
+    Statuses the order could be moved to `delivery_status` from (including itself).
+    """
+    return [delivery_status] + [source for source, targets in Order.DELIVERY_STATUS_TRANSITIONS.items()
+                                if delivery_status in targets]
+
+
+def transition_delivery_status(pk: int, delivery_status: str, updated_at: datetime = None) -> Optional[Order]:
+    """
+    Moves the order to `delivery_status` if the transition is allowed from its current status
+    (and if the order still has `updated_at`, when it's given). Returns the updated order with its previous status
+    in `previous_status` attribute or None if the order doesn't exist or the transition isn't allowed.
+    Setting the same status doesn't change updated_at.
+    """
+    table = Order._meta.db_table
+    sql = f"""
+        UPDATE {table} AS o
+        SET delivery_status = %(status)s,
+            updated_at = CASE WHEN previous.delivery_status = %(status)s THEN o.updated_at ELSE %(now)s END
+        FROM (SELECT id, delivery_status FROM {table} WHERE id = %(id)s FOR UPDATE) AS previous
+        WHERE o.id = previous.id AND previous.delivery_status = ANY(%(sources)s)
+              {'AND o.updated_at = %(updated_at)s' if updated_at is not None else ''}
+        RETURNING o.*, previous.delivery_status AS previous_status
+    """
+    params = {'id': pk, 'status': delivery_status, 'now': timezone.now(),
+              'sources': allowed_sources(delivery_status), 'updated_at': updated_at}
+    orders = list(Order.objects.raw(sql, params))
+    return orders[0] if orders else None
+
+
+def bulk_transition_delivery_status(delivery_status: str, ids: Iterable[int] = None, queryset=None,
+                                    limit: int = None) -> List[Dict]:
+    """
+    Moves orders with the ids (or orders of the queryset) to `delivery_status` with one statement. Orders are locked
+    in id order, so concurrent calls don't deadlock, and are changed only if the transition is allowed
+    from their current status. With `limit`, at most limit + 1 orders are touched, so the caller could detect
+    an overflow and roll the transaction back.
+
+    Returns one row per found order (ordered by id): id, customer_email, previous_status, result (one of RESULT_*)
+    and updated_at, which is None if the order wasn't changed.
+    """
+    table = Order._meta.db_table
+    if ids is not None:
+        condition, condition_params = 'id = ANY(%s)', [list(ids)]
+    else:
+        subquery, condition_params = queryset.order_by().values('id').query.sql_with_params()
+        condition = f'id IN ({subquery})'
+
+    sql = f"""
+        WITH target AS (
+            SELECT id, customer_email, delivery_status FROM {table}
+            WHERE {condition}
+            ORDER BY id {'LIMIT %s' if limit is not None else ''}
+            FOR UPDATE
+        ), updated AS (
+            UPDATE {table} AS o
+            SET delivery_status = %s, updated_at = %s
+            FROM target
+            WHERE o.id = target.id AND target.delivery_status = ANY(%s) AND target.delivery_status <> %s
+            RETURNING o.id, o.updated_at
+        )
+        SELECT target.id, target.customer_email, target.delivery_status, updated.updated_at
+        FROM target LEFT JOIN updated ON updated.id = target.id
+        ORDER BY target.id
+    """
+    params = list(condition_params)
+    if limit is not None:
+        params.append(limit + 1)
+    params += [delivery_status, timezone.now(), allowed_sources(delivery_status), delivery_status]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    def result(previous_status, updated_at):
+        if updated_at is not None:
+            return RESULT_UPDATED
+        return RESULT_UNCHANGED if previous_status == delivery_status else RESULT_CONFLICT
+
+    return [{'id': order_id, 'customer_email': customer_email, 'previous_status': previous_status,
+             'updated_at': updated_at, 'result': result(previous_status, updated_at)}
+            for order_id, customer_email, previous_status, updated_at in rows]
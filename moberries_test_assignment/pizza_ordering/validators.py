@@ -0,0 +1,91 @@
+from typing import Dict, Iterable, List
+
+from rest_framework import serializers
+
+from pizza_ordering.models import Order
+
+
+class OrderItemsValidator:
+    """
+    Validator for order_items, compiled once from the catalogue of attributes, flavours and sizes.
+    Lookups are done against frozensets and all the error messages are prepared in advance,
+    so validation of an item doesn't allocate anything.
+    """
+
+    def __init__(self, attributes: Iterable[str], flavours: Iterable[str], sizes: Iterable[str]):
+        attributes, flavours, sizes = list(attributes), list(flavours), list(sizes)
+        self.attributes = frozenset(attributes)
+        self.attributes_count = len(attributes)
+        self.flavours = frozenset(flavours)
+        self.sizes = frozenset(sizes)
+
+        self.empty_message = ("Empty orders are not allowed. "
+                              "You have to specify at least 1 position in order items.")
+        self.not_array_message = ("Empty orders are not allowed. "
+                                  "Order items should be array.")
+        self.attributes_count_message = ("Wrong order item format. "
+                                         "You have to specify exactly 3 attributes")
+        self.attributes_message = ("Wrong order item format. "
+                                   f"You have to specify those attributes: {attributes}")
+        self.flavour_message = ("Wrong order item format. "
+                                f"Flavour must be one of: {flavours}")
+        self.quantity_type_message = ("Wrong order item format. "
+                                      "Quantity must be an integer")
+        self.quantity_value_message = "Wrong order item format. Quantity must be > 0"
+        self.size_message = ("Wrong order item format. "
+                             f"Size must be one of: {sizes}")
+
+    def __call__(self, order_items: List[Dict]) -> List[Dict]:
+        """
+        Validates the whole order_items list in one pass. Raises serializers.ValidationError if validation failed.
+        """
+        # don't accept empty order_items.
+        if not order_items:
+            raise serializers.ValidationError(self.empty_message)
+
+        # don't accept order_items of other types
+        if not isinstance(order_items, list):
+            raise serializers.ValidationError(self.not_array_message)
+
+        validate_item = self.validate_item
+        for item in order_items:
+            validate_item(item)
+        return order_items
+
+    def validate_item(self, order_item: Dict) -> None:
+        """
+        Checks that order_item's element is valid (contains needed amount of parameters and their
+        values are also valid).
+        """
+        if not isinstance(order_item, dict):
+            raise serializers.ValidationError(self.attributes_message)
+
+        # check the amount of parameters
+        if len(order_item) != self.attributes_count:
+            raise serializers.ValidationError(self.attributes_count_message)
+
+        # check the names of parameters (keys view is compared with the set without building new objects)
+        if order_item.keys() != self.attributes:
+            raise serializers.ValidationError(self.attributes_message)
+
+        # check 'flavour' value (all catalogue values are strings, so unhashable JSON values are never looked up)
+        flavour = order_item['flavour']
+        if not (isinstance(flavour, str) and flavour in self.flavours):
+            raise serializers.ValidationError(self.flavour_message)
+
+        quantity = order_item['quantity']
+        # check 'quantity' value
+        if not isinstance(quantity, int):
+            raise serializers.ValidationError(self.quantity_type_message)
+        # check 'quantity' > 0
+        if not quantity > 0:
+            raise serializers.ValidationError(self.quantity_value_message)
+
+        # check 'size' value
+        size = order_item['size']
+        if not (isinstance(size, str) and size in self.sizes):
+            raise serializers.ValidationError(self.size_message)
+
+
+# validator compiled from the Order's catalogue
+order_items_validator = OrderItemsValidator(Order.ORDER_ITEM_ATTRIBUTES, Order.ITEM_FLAVOURS, Order.ITEM_SIZES)
@@ -1,41 +1,551 @@
+import math
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets, serializers
+from rest_framework import viewsets, serializers, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 
-from pizza_ordering.models import Order
-from pizza_ordering.serializers import OrderSerializer, OrderPatchSerializer
+from pizza_ordering.cache import get_order_cache, invalidate_orders
+from pizza_ordering.claims import claim_orders, get_settings as get_claims_settings, group_items, release_claim
+from pizza_ordering.conditional import (conditional_response, list_validators, order_validators, parse_order_etag,
+                                        set_validators)
+from pizza_ordering.customers import SummaryChanges
+from pizza_ordering.events import (EventStream, get_broker, publish_status_change, publish_status_changes,
+                                   status_event)
+from pizza_ordering.export import export_csv, export_ndjson
+from pizza_ordering.filters import OrderFilter
+from pizza_ordering.idempotency import HEADER as IDEMPOTENCY_HEADER, idempotent_response
+from pizza_ordering.metrics import MetricsMixin, get_settings as get_metrics_settings, render_metrics
+from pizza_ordering.models import CustomerSummary, Order, OrderItem
+from pizza_ordering.outbox import record_orders_created, record_status_changes
+from pizza_ordering.pagination import OrderPagination
+from pizza_ordering.parsers import FastJSONParser, NDJSONParser
+from pizza_ordering.renderers import CSVRenderer, EventStreamRenderer, FastJSONRenderer, NDJSONRenderer
+from pizza_ordering.replicas import is_pinned, read_alias
+from pizza_ordering.serializers import (ORDER_FIELDS, CustomerSummarySerializer, OrderClaimQuerySerializer,
+                                        OrderSerializer, OrderPatchSerializer, OrderStatusBulkSerializer,
+                                        OrderStatsQuerySerializer, order_items_from_rows, orders_to_dicts,
+                                        parse_datetime_param, save_order_item_rows, values_serialization)
+from pizza_ordering.stats import order_stats
+from pizza_ordering.transitions import (RESULT_NOT_FOUND, RESULT_UPDATED, bulk_transition_delivery_status,
+                                        transition_delivery_status)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(MetricsMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows orders to be viewed or edited.
     """
-    queryset = Order.objects.order_by('-created_at')  # sort orders by creation time in desc order.
+    queryset = Order.objects.order_by('-created_at', '-id')  # sort orders by creation time in desc order.
     serializer_class = OrderSerializer  # default serializer
+    pagination_class = OrderPagination  # limit/offset or keyset pagination
     filter_backends = [DjangoFilterBackend]  # backend for filtering
-    filterset_fields = ['customer_email', 'delivery_status']  # fields to filter by
+    filterset_class = OrderFilter  # filters by customer_email, delivery_status and order items
+
+    def get_queryset(self):
+        """
+        Prefetches OrderItem rows, when order_items are rendered from them.
+        Locks selected orders (SELECT ... FOR UPDATE) when lock_object is set.
+        """
+        queryset = super(OrderViewSet, self).get_queryset()
+        if order_items_from_rows():
+            queryset = queryset.prefetch_related(Prefetch('items', queryset=OrderItem.objects.order_by('id')))
+        if getattr(self, 'lock_object', False):
+            queryset = queryset.select_for_update()
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Handler for HTTP GET method for a single order.
+        Serialized order is cached by id. Responses carry ETag and Last-Modified derived from updated_at,
+        unchanged orders get 304 Not Modified without serialization.
+        """
+        order_cache = get_order_cache()
+        # canonical id, so '01' reads and fills the same cache entry, which invalidation deletes
+        try:
+            pk = int(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            raise Http404
+        # clients pinned to the primary after a write don't read the cache, which could be filled from a replica
+        cached = order_cache.get_order(pk) if order_cache is not None and not is_pinned(request) else None
+        if cached is not None:
+            return self.cached_response(request, cached)
+
+        generation = order_cache.generation() if order_cache is not None else None
+        instance = self.get_object()
+        etag, last_modified = order_validators(instance.pk, instance.updated_at)
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        data = self.get_serializer(instance).data
+        # reads from a replica could be behind the last invalidation, they aren't kept for the TTL
+        if order_cache is not None and read_alias() is None:
+            # plain copy of ReturnDict, so the cached payload doesn't hold serializer
+            order_cache.set_order(pk, {'etag': etag, 'last_modified': last_modified, 'data': OrderedDict(data)},
+                                  generation)
+        return set_validators(self.cache_miss_response(data, order_cache), etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        """
+        Handler for HTTP GET method for the orders list.
+        Orders are serialized straight from .values() rows (see orders_to_dicts()).
+        Pages are cached by normalized query string. Offset pages with exact count carry ETag and Last-Modified
+        derived from max(updated_at) and count of the filtered orders (when ORDERS_LIST_ETAG setting is on),
+        the count is reused for the page. Cursor pages and pages without exact count don't pay for the aggregate.
+        """
+        order_cache = get_order_cache()
+        host = request.get_host()
+        cached = (order_cache.get_list(host, request.query_params)
+                  if order_cache is not None and not is_pinned(request) else None)
+        if cached is not None:
+            return self.cached_response(request, cached)
+
+        generation = order_cache.generation() if order_cache is not None else None
+        queryset = self.filter_queryset(self.get_queryset())
+
+        etag = last_modified = None
+        if getattr(settings, 'ORDERS_LIST_ETAG', True) and self.paginator.counts_exactly(request):
+            etag, last_modified, count = list_validators(queryset, request.META.get('QUERY_STRING', ''))
+            self.paginator.known_count = count
+            not_modified = conditional_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+
+        fast = values_serialization()
+        if fast:
+            queryset = queryset.values(*ORDER_FIELDS)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            results = orders_to_dicts(page) if fast else self.get_serializer(page, many=True).data
+            response = self.get_paginated_response(results)
+            # plain copy, so the cached payload doesn't hold serializer
+            data = OrderedDict(response.data, results=list(response.data['results']))
+        else:
+            data = orders_to_dicts(queryset) if fast else list(self.get_serializer(queryset, many=True).data)
+
+        if order_cache is not None and read_alias() is None:
+            order_cache.set_list(host, request.query_params,
+                                 {'etag': etag, 'last_modified': last_modified, 'data': data}, generation)
+        response = self.cache_miss_response(data, order_cache)
+        return set_validators(response, etag, last_modified) if etag is not None else response
+
+    @staticmethod
+    def cached_response(request, cached):
+        """
+        Response for a cached payload: 304 Not Modified if client has the same version, otherwise the payload.
+        """
+        if cached['etag'] is None:
+            return Response(cached['data'], headers={'X-Cache': 'HIT'})
+        response = (conditional_response(request, cached['etag'], cached['last_modified'])
+                    or Response(cached['data']))
+        response['X-Cache'] = 'HIT'
+        return set_validators(response, cached['etag'], cached['last_modified'])
+
+    @staticmethod
+    def cache_miss_response(data, order_cache):
+        return Response(data, headers={'X-Cache': 'MISS'} if order_cache is not None else None)
+
+    def create(self, request, *args, **kwargs):
+        """
+        Handler for HTTP POST method.
+        With Idempotency-Key header the order is created once per key, repeated requests get the stored response
+        (see pizza_ordering.idempotency).
+        """
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return super(OrderViewSet, self).create(request, *args, **kwargs)
+        return idempotent_response(request, key, lambda: super(OrderViewSet, self).create(request, *args, **kwargs))
 
     def update(self, request, *args, **kwargs):
         """
         Handler for HTTP PUT method.
         Will refuse to do the actual update for order with several delivery statuses values.
+        The order is locked until the update is saved, so its delivery status can't be changed in the meantime.
+        Only changed columns are written.
+        """
+        with transaction.atomic():
+            self.lock_object = True
+            instance = self.get_object()
 
-        Under the hood, partial_update() eventually will also call this method. For those calls we don't want to
-        check delivery status because it doesn't make sense (partial_update() can only update delivery_method).
+            # reject lost updates: If-Match must match the current version of the order
+            etag, last_modified = order_validators(instance.pk, instance.updated_at)
+            precondition_failed = conditional_response(request, etag, last_modified)
+            if precondition_failed is not None:
+                return precondition_failed
 
-        """
-        obj = self.get_object()
+            # don't allow updates for orders with several delivery statuses.
+            if instance.delivery_status in Order.DELIVERY_STATUSES_NO_UPDATE:
+                raise serializers.ValidationError(
+                    f"Order couldn't be updated once it's in one of delivery statuses "
+                    f"{Order.DELIVERY_STATUSES_NO_UPDATE}")
+
+            serializer = self.get_serializer(instance, data=request.data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
 
-        # don't allow updates for orders with several delivery statuses. But partial update should be allowed.
-        if obj.delivery_status in Order.DELIVERY_STATUSES_NO_UPDATE and not kwargs.get('partial'):
-            raise serializers.ValidationError(
-                f"Order couldn't be updated once it's in one of delivery statuses {Order.DELIVERY_STATUSES_NO_UPDATE}")
+        if getattr(instance, '_prefetched_objects_cache', None):
+            # prefetched OrderItem rows could be replaced by the update
+            instance._prefetched_objects_cache = {}
+        # validators of the new version of the order, to be used in If-Match of the next update
+        return set_validators(Response(serializer.data), *order_validators(instance.pk, instance.updated_at))
+
+    def destroy(self, request, *args, **kwargs):
+        """
+        Handler for HTTP DELETE method.
+        The order is locked, so the customer summary counts it out in the state it's deleted in.
+        """
+        with transaction.atomic():
+            self.lock_object = True
+            return super(OrderViewSet, self).destroy(request, *args, **kwargs)
 
-        return super(OrderViewSet, self).update(request, *args, **kwargs)
+    def perform_destroy(self, instance):
+        instance.delete()
+        SummaryChanges().remove(instance).save()
 
     def partial_update(self, request, *args, **kwargs):
         """
         Handler for HTTP PATCH method. Used for delivery_status updates. This is the only way to update delivery_status.
         It has to have it's own serializer (OrderPatchSerializer) where delivery_status is not read-only.
+
+        The change is applied with a single conditional UPDATE, if Order.DELIVERY_STATUS_TRANSITIONS allow it from
+        the current status, otherwise 409 Conflict is returned. If-Match with the order's ETag is checked by the same
+        UPDATE, without reading the order first.
         """
         self.serializer_class = OrderPatchSerializer
-        return super(OrderViewSet, self).partial_update(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        delivery_status = serializer.validated_data.get('delivery_status')
+
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise Http404
+
+        # conditional request: the order is updated only if it's still the same version. updated_at of the version
+        # is taken from If-Match holding the order's ETag, otherwise the order is read to check the headers
+        updated_at = None
+        if delivery_status is not None and 'HTTP_IF_MATCH' in request.META \
+                and 'HTTP_IF_UNMODIFIED_SINCE' not in request.META:
+            updated_at = parse_order_etag(request.META['HTTP_IF_MATCH'], pk)
+        if updated_at is None and (delivery_status is None or 'HTTP_IF_MATCH' in request.META
+                                   or 'HTTP_IF_UNMODIFIED_SINCE' in request.META):
+            instance = self.get_object()
+            etag, last_modified = order_validators(instance.pk, instance.updated_at)
+            precondition_failed = conditional_response(request, etag, last_modified)
+            if precondition_failed is not None:
+                return precondition_failed
+            if delivery_status is None:
+                # nothing to update
+                return set_validators(Response(self.get_serializer(instance).data), etag, last_modified)
+            updated_at = instance.updated_at
+
+        with transaction.atomic():
+            order = transition_delivery_status(pk, delivery_status, updated_at)
+            if order is not None and order.delivery_status != order.previous_status:
+                # queryset and raw updates don't send post_save
+                invalidate_orders([pk])
+                publish_status_change(order, order.previous_status)
+                record_status_changes([(order, order.previous_status)])
+                SummaryChanges().change_status(order.customer_email, order.previous_status,
+                                               order.delivery_status).save()
+
+        if order is None:
+            current = Order.objects.filter(pk=pk).values_list('delivery_status', 'updated_at').first()
+            if current is None:
+                raise Http404
+            if updated_at is not None and current[1] != updated_at:
+                return Response(status=status.HTTP_412_PRECONDITION_FAILED)
+            return Response({'detail': f"Order couldn't be moved from '{current[0]}' to '{delivery_status}'."},
+                            status=status.HTTP_409_CONFLICT)
+
+        return set_validators(Response(self.get_serializer(order).data), *order_validators(order.pk, order.updated_at))
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[FastJSONParser, NDJSONParser])
+    def bulk(self, request, *args, **kwargs):
+        """
+        Handler for HTTP POST method on /orders/bulk/. Creates many orders at once.
+        Accepts JSON array or NDJSON stream of orders. Every order is validated with the same rules as a single
+        POST, invalid ones are reported by their index and valid ones are saved with multi-row INSERTs.
+        """
+        if not isinstance(request.data, list) or not request.data:
+            raise serializers.ValidationError("Bulk orders should be non-empty array.")
+
+        max_items = getattr(settings, 'ORDERS_BULK_MAX_ITEMS', 10000)
+        if len(request.data) > max_items:
+            raise serializers.ValidationError(f"Too many orders. At most {max_items} orders allowed per request.")
+
+        # single serializer instance is reused for every element (the same way ListSerializer does)
+        serializer = self.get_serializer()
+        valid, errors = [], []
+        for index, item in enumerate(request.data):
+            try:
+                valid.append((index, Order(**serializer.run_validation(item))))
+            except serializers.ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+
+        batch_size = getattr(settings, 'ORDERS_BULK_BATCH_SIZE', 500)
+        with transaction.atomic():
+            orders = Order.objects.bulk_create([order for _, order in valid], batch_size=batch_size)
+            save_order_item_rows(orders, batch_size=batch_size)
+            record_orders_created(orders, batch_size=batch_size)
+            summary_changes = SummaryChanges()
+            for order in orders:
+                summary_changes.add(order)
+            summary_changes.save()
+            invalidate_orders()
+
+        created = [{'index': index, 'id': order.id} for (index, _), order in zip(valid, orders)]
+        return Response({'created': created, 'errors': errors},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['patch'], url_path='status')
+    def bulk_status(self, request, *args, **kwargs):
+        """
+        Handler for HTTP PATCH method on /orders/status/. Changes delivery_status of many orders (selected by ids
+        or by filter) with one set-based UPDATE. Every order is changed only if Order.DELIVERY_STATUS_TRANSITIONS
+        allow it from its current status. Returns outcome for every id.
+        """
+        serializer = OrderStatusBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        delivery_status = serializer.validated_data['delivery_status']
+        ids = serializer.validated_data.get('ids')
+        max_items = getattr(settings, 'ORDERS_BULK_MAX_ITEMS', 10000)
+
+        with transaction.atomic():
+            rows = bulk_transition_delivery_status(delivery_status, ids=ids,
+                                                   queryset=serializer.validated_data.get('filter'),
+                                                   limit=max_items if ids is None else None)
+            if len(rows) > max_items:
+                # rolls the update back
+                raise serializers.ValidationError(
+                    f"Filter matches too many orders. At most {max_items} orders allowed per request.")
+
+            changed = [row for row in rows if row['result'] == RESULT_UPDATED]
+            if changed:
+                # raw updates don't send post_save
+                invalidate_orders([row['id'] for row in changed])
+                changes = [(Order(id=row['id'], customer_email=row['customer_email'],
+                                  delivery_status=delivery_status, updated_at=row['updated_at']),
+                            row['previous_status']) for row in changed]
+                publish_status_changes(changes)
+                record_status_changes(changes)
+                summary_changes = SummaryChanges()
+                for order, previous_status in changes:
+                    summary_changes.change_status(order.customer_email, previous_status, delivery_status)
+                summary_changes.save()
+
+        results = [{'id': row['id'], 'result': row['result'], 'previous_status': row['previous_status']}
+                   for row in rows]
+        if ids is not None:
+            found = {row['id'] for row in rows}
+            results += [{'id': pk, 'result': RESULT_NOT_FOUND, 'previous_status': None}
+                        for pk in ids if pk not in found]
+        return Response({'delivery_status': delivery_status, 'results': results})
+
+    @action(detail=False, methods=['post'], url_path='claim')
+    def claim(self, request, *args, **kwargs):
+        """
+        Handler for HTTP POST method on /orders/claim/. Leases a batch of at most `max` oldest unclaimed
+        not_in_delivery orders (containing items of `flavour` and `size`, when given) to the kitchen `station`
+        for `lease` seconds, concurrent stations never get the same order (see pizza_ordering.claims).
+        Returns the orders and their items grouped by flavour and size.
+        """
+        query = OrderClaimQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        with transaction.atomic():
+            ids, expires_at = claim_orders(params['station'], params['max'],
+                                           params.get('lease', get_claims_settings()['LEASE']),
+                                           flavour=params.get('flavour'), size=params.get('size'))
+            queryset = self.get_queryset().filter(id__in=ids).order_by('created_at', 'id')
+            if values_serialization():
+                orders = orders_to_dicts(queryset.values(*ORDER_FIELDS))
+            else:
+                orders = list(self.get_serializer(queryset, many=True).data)
+        return Response({'station': params['station'], 'expires_at': expires_at, 'orders': orders,
+                         'groups': group_items(orders)})
+
+    @action(detail=True, methods=['delete'], url_path='claim', url_name='claim-detail')
+    def release(self, request, *args, **kwargs):
+        """
+        Handler for HTTP DELETE method on /orders/{id}/claim/?station=. Gives the order claimed by the station back
+        to the queue: 409 Conflict is returned, if another station holds the claim, and 404, if nobody does.
+        """
+        station = request.query_params.get('station')
+        if not station:
+            raise serializers.ValidationError({'station': "This field is required."})
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise Http404
+
+        released = release_claim(pk, station)
+        if released is None:
+            raise Http404
+        if not released:
+            return Response({'detail': "Order is claimed by another station."}, status=status.HTTP_409_CONFLICT)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['get'], url_path='stats')
+    def stats(self, request, *args, **kwargs):
+        """
+        Handler for HTTP GET method on /orders/stats/. Number of orders, order items and pizzas grouped by
+        `group_by` dimensions (flavour, size, delivery_status, day, hour, customer_email) for orders created
+        in [since, until). Computed in the database, either from orders or from the hourly summary
+        (see pizza_ordering.stats and ORDERS_STATS_SOURCE setting).
+        """
+        query = OrderStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        group_by = params['group_by']
+        stats = order_stats(group_by, since=params.get('since'), until=params.get('until'),
+                            delivery_statuses=params.get('delivery_status'),
+                            customer_email=params.get('customer_email'),
+                            source=params.get('source', getattr(settings, 'ORDERS_STATS_SOURCE', 'auto')))
+        return Response(dict(group_by=group_by, **stats))
+
+    @action(detail=False, methods=['get'], url_path='export', renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request, *args, **kwargs):
+        """
+        Handler for HTTP GET method on /orders/export/. Streams orders ordered by id as NDJSON (`?format=ndjson`,
+        default) or CSV with one line per order item (`?format=csv`). Orders could be filtered with the list
+        filters and `since` (minimal creation time). Orders are read with a server-side cursor in chunks
+        of ORDERS_EXPORT_CHUNK_SIZE, so memory use doesn't depend on the number of orders. ORDERS_EXPORT_DATABASE
+        gives the database to read from (a direct connection, when the default one goes through pgbouncer).
+        """
+        queryset = self.filter_queryset(Order.objects.using(getattr(settings, 'ORDERS_EXPORT_DATABASE', None))
+                                        .order_by('id'))
+        since = request.query_params.get('since')
+        if since:
+            since_value = parse_datetime_param(since)
+            if since_value is None:
+                raise serializers.ValidationError({'since': "ISO 8601 date or datetime is required."})
+            queryset = queryset.filter(created_at__gte=since_value)
+
+        chunk_size = getattr(settings, 'ORDERS_EXPORT_CHUNK_SIZE', 2000)
+        if request.accepted_renderer.format == CSVRenderer.format:
+            response = StreamingHttpResponse(export_csv(queryset, chunk_size), content_type='text/csv; charset=utf-8')
+        else:
+            response = StreamingHttpResponse(export_ndjson(queryset, chunk_size), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="orders.{request.accepted_renderer.format}"'
+        return response
+
+    @action(detail=True, methods=['get'], url_path='events', renderer_classes=[EventStreamRenderer, FastJSONRenderer])
+    def events(self, request, *args, **kwargs):
+        """
+        Handler for HTTP GET method on /orders/{id}/events/. Server-Sent Events stream of delivery_status changes
+        of the order. The current status is sent first.
+        """
+        instance = self.get_object()
+        order_id = instance.id
+        subscription = get_broker().subscribe(lambda event: event['data']['id'] == order_id)
+        return self.event_stream_response(request, subscription, [status_event(instance, None)])
+
+    @action(detail=False, methods=['get'], url_path='events', url_name='events-list',
+            renderer_classes=[EventStreamRenderer, FastJSONRenderer])
+    def events_list(self, request, *args, **kwargs):
+        """
+        Handler for HTTP GET method on /orders/events/. Server-Sent Events stream of delivery_status changes
+        of all the orders. Could be filtered by customer_email and new delivery_status (comma separated).
+        """
+        customer_email = request.query_params.get('customer_email')
+        statuses = set()
+        for value in request.query_params.getlist('delivery_status'):
+            statuses.update(status for status in value.split(',') if status)
+        unknown = statuses - {choice for choice, _ in Order.DELIVERY_STATUSES}
+        if unknown:
+            raise serializers.ValidationError({'delivery_status': f"Unknown delivery statuses: {sorted(unknown)}"})
+
+        def predicate(event):
+            data = event['data']
+            return ((customer_email is None or data['customer_email'] == customer_email)
+                    and (not statuses or data['delivery_status'] in statuses))
+
+        return self.event_stream_response(request, get_broker().subscribe(predicate), [])
+
+    @staticmethod
+    def event_stream_response(request, subscription, initial_events):
+        """
+        Streaming response for the subscription. Stream is closed after ?timeout seconds
+        (at most ORDERS_EVENTS['MAX_DURATION']), clients are expected to reconnect. Beyond
+        ORDERS_EVENTS['MAX_STREAMS'] streams of the process 503 Service Unavailable is returned.
+        """
+        options = getattr(settings, 'ORDERS_EVENTS', {})
+        max_duration = options.get('MAX_DURATION', 300)
+        broker = get_broker()
+        try:
+            duration = float(request.query_params.get('timeout', max_duration))
+        except ValueError:
+            duration = math.nan
+        # nan would never end the stream (comparisons with it are false), inf and negative values make no sense
+        if not math.isfinite(duration) or duration <= 0:
+            broker.unsubscribe(subscription)
+            raise serializers.ValidationError({'timeout': "A valid positive number is required."})
+        duration = min(duration, max_duration)
+
+        # every stream holds a server thread till it ends, leave threads for other requests
+        max_streams = options.get('MAX_STREAMS')
+        if max_streams is not None and len(broker.subscriptions) > max_streams:
+            broker.unsubscribe(subscription)
+            return Response({'detail': "Too many event streams, retry later."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '3'})
+
+        # watchers are idle most of the time, don't hold a database connection while streaming
+        if not connection.in_atomic_block:
+            connection.close()
+
+        stream = EventStream(broker, subscription, initial_events,
+                             duration=duration, heartbeat=options.get('HEARTBEAT', 15))
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # don't let nginx buffer the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request, *args, **kwargs):
+        """
+        Handler for HTTP GET method on /orders/cache-stats/. Returns hit/miss counters of the orders cache
+        of the current process.
+        """
+        order_cache = get_order_cache()
+        return Response({'enabled': order_cache is not None,
+                         **(order_cache.stats() if order_cache is not None else {})})
+
+
+class CustomerViewSet(MetricsMixin, viewsets.GenericViewSet):
+    """
+    API endpoint with summaries of customers' orders.
+    """
+    queryset = CustomerSummary.objects.all()
+    serializer_class = CustomerSummarySerializer
+    lookup_field = 'customer_email'
+    lookup_value_regex = '[^/]+'
+
+    @action(detail=True, methods=['get'], url_path='summary')
+    def summary(self, request, *args, **kwargs):
+        """
+        Handler for HTTP GET method on /customers/{email}/summary/. Returns number of orders, active orders, time
+        of the last order and favourite flavour and size of the customer from the summary maintained with
+        the orders (see pizza_ordering.customers): one row read by primary key, however many orders there are.
+        404 is returned for customers without orders.
+        """
+        return Response(self.get_serializer(self.get_object()).data)
+
+
+def metrics(request):
+    """
+    Metrics of the orders API in Prometheus text format (404 unless ORDERS_METRICS is enabled): of the current process
+    or of all the processes sharing ORDERS_METRICS['MULTIPROCESS_DIR'].
+    """
+    if not get_metrics_settings()['ENABLED']:
+        raise Http404
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,4 +1,6 @@
 #!/bin/sh
+# stop when migrations or system checks of the settings fail
+set -e
 
 # cd to django working dir
 cd moberries_test_assignment
@@ -0,0 +1,15 @@
+#!/bin/sh
+# stop when migrations or system checks of the settings fail
+set -e
+
+# cd to django working dir
+cd moberries_test_assignment
+
+# run migrations
+python3 ./manage.py migrate
+
+# run single-process ASGI server (see pizza_ordering/asgi.py); it answers reads from its in-process orders cache
+# only with ORDERS_CACHE_INVALIDATION=postgres, so writes of other processes and containers invalidate it
+# keep-alive longer than the poll interval of clients, so pollers reuse their connections
+exec uvicorn moberries_test_assignment.asgi:application --host 0.0.0.0 --port 8000 --no-access-log \
+    --timeout-keep-alive "${ASGI_KEEPALIVE:-30}"
@@ -0,0 +1,16 @@
+#!/bin/sh
+set -e
+
+# streaming replica of the db service: on the first start the data directory is cloned from the primary
+# (pg_basebackup -R also writes standby.signal and primary_conninfo), then postgres runs as a hot standby
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    mkdir -p "$PGDATA"
+    chown postgres "$PGDATA"
+    chmod 700 "$PGDATA"
+    until gosu postgres pg_basebackup -h "${PRIMARY_HOST:-db}" -U postgres -D "$PGDATA" -X stream -R; do
+        echo "Waiting for the primary..."
+        sleep 1
+    done
+fi
+
+exec docker-entrypoint.sh postgres
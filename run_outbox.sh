@@ -0,0 +1,12 @@
+#!/bin/sh
+# stop when migrations or system checks of the settings fail
+set -e
+
+# cd to django working dir
+cd moberries_test_assignment
+
+# run migrations
+python3 ./manage.py migrate
+
+# deliver order events recorded in the outbox (see pizza_ordering/outbox.py), stops on SIGTERM after the batch
+exec python3 ./manage.py dispatch_outbox --report-interval 60
@@ -0,0 +1,17 @@
+#!/bin/sh
+# stop when migrations or system checks of the settings fail
+set -e
+
+# cd to django working dir
+cd moberries_test_assignment
+
+# run migrations
+python3 ./manage.py migrate
+
+# metrics snapshots of the previous run (see pizza_ordering/metrics.py)
+if [ -n "$ORDERS_METRICS_DIR" ]; then
+    rm -rf "$ORDERS_METRICS_DIR"
+fi
+
+# run multi-process server (see gunicorn.conf.py)
+exec gunicorn moberries_test_assignment.wsgi:application --config gunicorn.conf.py
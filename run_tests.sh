@@ -3,5 +3,9 @@
 # cd to django working dir
 cd moberries_test_assignment
 
-# run tests
-python3 ./manage.py test
\ No newline at end of file
+# run tests, the ones tagged 'slow' (export of a million orders, latency budgets) only with RUN_SLOW_TESTS=1
+if [ "${RUN_SLOW_TESTS:-0}" = "1" ]; then
+    python3 ./manage.py test
+else
+    python3 ./manage.py test --exclude-tag slow
+fi